@@ -0,0 +1,91 @@
+"""比较 MemoryDocumentStorage 与 ColumnarDocumentStorage 的内存占用及读取速度
+
+文档为固定 schema 的小记录，category 字段只有少量不同的取值，文档从 JSON 解析后添加到 storage，
+内存占用为子进程中添加文档前后常驻内存的增量。
+
+Usage: python benchmarks/bench_columnar_storage.py [num_docs]
+"""
+import json
+from multiprocessing import Pool
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from corpus import generate_corpus  # noqa
+from zhtools.utils import ColumnarDocumentStorage, MemoryDocumentStorage  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+    'category': {'type': 'str'},
+    'cnt': {'type': 'int'},
+    'score': {'type': 'float'},
+}
+CATEGORIES = ['新闻', '体育', '娱乐', '科技', '财经', '教育', '旅游', '汽车']
+
+
+def make_lines(size):
+    """返回 JSON 格式的文档，每行一个"""
+    rand = random.Random(0)
+    return [
+        json.dumps(dict(document, category=rand.choice(CATEGORIES), cnt=rand.randint(0, 1000),
+                        score=rand.random()), ensure_ascii=False)
+        for document in generate_corpus(size)
+    ]
+
+
+def make_storage(name, lines):
+    storage = MemoryDocumentStorage('id') if name == 'memory' else ColumnarDocumentStorage(SCHEMA)
+    for line in lines:
+        storage.add_document(json.loads(line))
+
+    return storage
+
+
+def rss():
+    with open('/proc/self/statm') as fin:
+        return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(name, lines):
+    before, start = rss(), time.time()
+    storage = make_storage(name, lines)  # noqa
+    elapsed = time.time() - start
+    return rss() - before, elapsed
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = make_lines(size)
+    uuids = [json.loads(line)['id'] for line in lines]
+    lookups = random.Random(1).choices(uuids, k=100000)
+    storages = {}
+    for name in ('memory', 'columnar'):
+        with Pool(1) as pool:
+            memory, elapsed = pool.apply(measure, (name, lines))
+        print(f'{name}: {memory / 2 ** 20:.1f} MiB for {size} documents, added in {elapsed:.2f}s')
+
+        storage = storages[name] = make_storage(name, lines)
+        start = time.time()
+        for uuid in lookups:
+            storage.get_by_id(uuid)['text']
+        print(f'{name}: get_by_id {len(lookups) / (time.time() - start):.0f} docs/s')
+
+        start = time.time()
+        for offset in range(0, len(lookups), 50):
+            storage.get_by_ids(lookups[offset:offset + 50])
+        print(f'{name}: get_by_ids(50) {len(lookups) / (time.time() - start):.0f} docs/s')
+
+    start = time.time()
+    for offset in range(0, len(lookups), 50):
+        storages['columnar'].get_by_ids(lookups[offset:offset + 50], fields=['cnt'])
+    print(f'columnar: get_by_ids(50, fields=[cnt]) '
+          f'{len(lookups) / (time.time() - start):.0f} docs/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""比较逐个文档调用 retrieve 与 find_duplicates 查找近似重复文档对的耗时
+
+语料中混入 10% 替换了一个字的近似重复文档。
+
+Usage: python benchmarks/bench_find_duplicates.py [num_docs] [threshold] [workers]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from bench_threshold_filtering import make_queries  # noqa
+from corpus import generate_corpus  # noqa
+from zhtools.utils import InvertedIndex, MemoryDocumentStorage  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.8
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    documents = list(generate_corpus(size))
+    duplicates = make_queries(documents, size // 10)
+    documents += [{'id': f'dup-{idx}', 'text': text} for idx, text in enumerate(duplicates)]
+
+    index, storage = InvertedIndex(SCHEMA), MemoryDocumentStorage('id')
+    index.add_documents(documents)
+    for document in documents:
+        storage.add_document(document)
+
+    start = time.time()
+    pairs = set()
+    for document in documents:
+        for result in index.retrieve(storage, document['text'], 'text', threshold=threshold):
+            other = result['document']['id']
+            if other != document['id']:
+                pairs.add(tuple(sorted((document['id'], other))))
+    elapsed = time.time() - start
+    print(f'retrieve per document: {len(pairs)} pairs in {elapsed:.2f}s')
+
+    for num_workers in sorted(set([1, workers])):
+        start = time.time()
+        found = list(index.find_duplicates(storage, 'text', threshold=threshold,
+                                           workers=num_workers))
+        elapsed = time.time() - start
+        print(f'find_duplicates (workers={num_workers}): {len(found)} pairs in {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
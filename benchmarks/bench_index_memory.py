@@ -0,0 +1,40 @@
+"""测量在合成语料上建立 InvertedIndex 所占用的内存
+
+Usage: python benchmarks/bench_index_memory.py [num_docs]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from corpus import generate_corpus  # noqa
+from zhtools.utils import InvertedIndex  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    documents = list(generate_corpus(size))
+
+    tracemalloc.start()
+    start = time.time()
+    index = InvertedIndex(SCHEMA, forward_index=False)
+    for document in documents:
+        index.add_document(document)
+    elapsed = time.time() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'documents: {size}, terms: {len(index.term_dict)}')
+    print(f'index memory: {current / 1024 / 1024:.1f} MiB, build time: {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
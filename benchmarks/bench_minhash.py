@@ -0,0 +1,67 @@
+"""比较 MinHashIndex 与 InvertedIndex 的 jaccard top-k 检索速度及召回率
+
+query 为语料中的文档替换一个字后得到的近似重复文本，以 InvertedIndex 返回的相似度不低于
+0.5 的 top-k 为准确结果，计算 MinHashIndex 在不同 bands/rows 下的召回率。
+
+Usage: python benchmarks/bench_minhash.py [num_docs] [num_queries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from bench_threshold_filtering import make_queries  # noqa
+from corpus import generate_corpus  # noqa
+from zhtools.utils import InvertedIndex, MemoryDocumentStorage, MinHashIndex  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+LIMIT = 10
+THRESHOLD = 0.5
+
+
+def timed_retrieve(index, storage, queries, **kwargs):
+    start = time.time()
+    results = [
+        set(ret['document']['id'] for ret in index.retrieve(storage, query, 'text', **kwargs))
+        for query in queries
+    ]
+    return results, len(queries) / (time.time() - start)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    documents = list(generate_corpus(size))
+    queries = make_queries(documents, num_queries)
+    storage = MemoryDocumentStorage('id')
+    for document in documents:
+        storage.add_document(document)
+
+    index = InvertedIndex(SCHEMA)
+    index.add_documents(documents)
+    expected, qps = timed_retrieve(index, storage, queries, limit=LIMIT, threshold=THRESHOLD)
+    print(f'InvertedIndex(threshold={THRESHOLD}): {qps:.0f} queries/s')
+    _, qps = timed_retrieve(index, storage, queries, limit=LIMIT)
+    print(f'InvertedIndex(threshold=None): {qps:.0f} queries/s')
+
+    for bands, rows in ((32, 4), (16, 8), (64, 2)):
+        minhash = MinHashIndex(SCHEMA, bands=bands, rows=rows)
+        start = time.time()
+        minhash.add_documents(documents)
+        build = time.time() - start
+        for rerank in (False, True):
+            results, qps = timed_retrieve(minhash, storage, queries, limit=LIMIT,
+                                          threshold=THRESHOLD, rerank=rerank)
+            recall = sum(len(exp & ret) for exp, ret in zip(expected, results)) / \
+                sum(len(exp) for exp in expected)
+            print(f'MinHashIndex(bands={bands}, rows={rows}, rerank={rerank}): '
+                  f'recall {recall:.3f}, {qps:.0f} queries/s, built in {build:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""比较 NgramTokenizer 原先逐个 n-gram 正则匹配的实现与当前实现的切分速度
+
+文本为合成的长中文文本，每隔若干个字插入一个标点，每个 n-gram 都需要判断是否包含标点。
+
+Usage: python benchmarks/bench_ngram_tokenizer.py [num_texts] [text_length]
+"""
+import os
+import random
+import sys
+import time
+
+from more_itertools import windowed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from corpus import generate_corpus  # noqa
+from zhtools.tokenize import NgramTokenizer, Token  # noqa
+
+
+PUNCTUATIONS = '，。！？、；：'
+
+
+def windowed_tokenize(tokenizer, text):
+    """原先的实现: windowed 生成 n-gram，逐个进行正则匹配并创建 Token"""
+    text = text if not tokenizer.lowercase else text.lower()
+    for idx, chars in enumerate(windowed(text, tokenizer.level, step=tokenizer.step,
+                                         fillvalue='')):
+        term = ''.join(chars)
+        if tokenizer.filter_pattern and tokenizer.filter_pattern.match(term):
+            continue
+
+        start = idx * tokenizer.step
+        yield Token(term, start, min(start + tokenizer.level, len(text)))
+
+
+def make_texts(num_texts, length):
+    rand = random.Random(0)
+    texts = []
+    for document in generate_corpus(num_texts, min_length=length, max_length=length):
+        chars = list(document['text'])
+        for pos in range(rand.randint(5, 20), len(chars), rand.randint(5, 20)):
+            chars[pos] = rand.choice(PUNCTUATIONS)
+        texts.append(''.join(chars))
+
+    return texts
+
+
+def timed(func, texts):
+    start = time.time()
+    results = [func(text) for text in texts]
+    return results, time.time() - start
+
+
+def main():
+    num_texts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    texts = make_texts(num_texts, length)
+    chars = num_texts * length
+    for level in (2, 3):
+        tokenizer = NgramTokenizer(level=level)
+        expected, baseline = timed(
+            lambda text: [token.word for token in windowed_tokenize(tokenizer, text)], texts
+        )
+        print(f'level={level} windowed lcut: {chars / baseline / 1e6:.2f}M chars/s')
+        for name, func in (('lcut', tokenizer.lcut),
+                           ('tokenize', lambda text: [
+                               token.word for token in tokenizer.tokenize(text)]),
+                           ('tokenize_stream', lambda text: tokenizer.tokenize_stream(text).words)):
+            results, elapsed = timed(func, texts)
+            assert results == expected
+            print(f'level={level} {name}: {chars / elapsed / 1e6:.2f}M chars/s, '
+                  f'{baseline / elapsed:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
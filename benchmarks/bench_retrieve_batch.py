@@ -0,0 +1,56 @@
+"""比较逐个调用 retrieve 与 retrieve_batch 的吞吐
+
+storage 的每次读取模拟 0.2ms 的网络延迟。
+
+Usage: python benchmarks/bench_retrieve_batch.py [num_docs] [num_queries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from corpus import generate_corpus  # noqa
+from zhtools.utils import InvertedIndex, MemoryDocumentStorage  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+
+
+class SlowStorage(MemoryDocumentStorage):
+
+    def get_by_id(self, uuid):
+        time.sleep(0.0002)
+        return super().get_by_id(uuid)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    documents = list(generate_corpus(size))
+    index, storage = InvertedIndex(SCHEMA), SlowStorage('id')
+    index.add_documents(documents)
+    for document in documents:
+        storage.add_document(document)
+
+    # 批量匹配的 query 往往有较多重复，这里每个 query 平均出现两次
+    queries = [documents[idx % (num_queries // 2)]['text'][:12] for idx in range(num_queries)]
+    for rank_metric in ('jaccard', 'lcs'):
+        start = time.time()
+        for query in queries:
+            index.retrieve(storage, query, 'text', limit=10, rank_metric=rank_metric)
+        sequential = time.time() - start
+
+        start = time.time()
+        index.retrieve_batch(storage, queries, 'text', limit=10, rank_metric=rank_metric)
+        batch = time.time() - start
+
+        print(f'{rank_metric}: sequential {num_queries / sequential:.0f} queries/s, '
+              f'batch {num_queries / batch:.0f} queries/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""比较不同 storage 下 InvertedIndex.retrieve 及单独获取 top-k 文档的耗时
+
+Usage: python benchmarks/bench_storage.py [num_docs] [num_queries] [limit]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from bench_threshold_filtering import make_queries  # noqa
+from corpus import generate_corpus  # noqa
+from zhtools.utils import (  # noqa
+    CachedStorage, InvertedIndex, LogFileStorage, MemoryDocumentStorage, SQLiteDocumentStorage,
+)
+from zhtools.utils.storage import project  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+
+
+class SingleGetStorage(SQLiteDocumentStorage):
+
+    """逐个获取文档的 SQLiteDocumentStorage，作为批量获取的对照"""
+
+    def get_by_ids(self, uuids, fields=None):
+        return project([self.get_by_id(uuid) for uuid in uuids], fields)
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    documents = list(generate_corpus(size))
+    queries = make_queries(documents, num_queries)
+    index = InvertedIndex(SCHEMA)
+    index.add_documents(documents)
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        storages = {
+            'memory': MemoryDocumentStorage('id'),
+            'sqlite(get_by_id)': SingleGetStorage('id', os.path.join(base_dir, 'single.db')),
+            'sqlite(get_by_ids)': SQLiteDocumentStorage('id', os.path.join(base_dir, 'multi.db')),
+            'cached(sqlite)': CachedStorage(
+                SQLiteDocumentStorage('id', os.path.join(base_dir, 'cached.db')),
+                maxsize=size // 10,
+            ),
+            'logfile': LogFileStorage('id', os.path.join(base_dir, 'docs.log')),
+        }
+        for name, storage in storages.items():
+            _, elapsed = timed(storage.add_documents, documents)
+            print(f'{name}: added {size} documents in {elapsed:.2f}s')
+
+        topk = [
+            [ret['document']['id'] for ret in index.retrieve(storages['memory'], query, 'text',
+                                                             limit=limit)]
+            for query in queries
+        ]
+        for name, storage in storages.items():
+            _, elapsed = timed(lambda: [storage.get_by_ids(uuids) for uuids in topk])
+            _, total = timed(lambda: [
+                index.retrieve(storage, query, 'text', limit=limit) for query in queries
+            ])
+            print(f'{name}: fetch top-{limit} {num_queries / elapsed:.0f} queries/s, '
+                  f'retrieve {num_queries / total:.0f} queries/s')
+            if isinstance(storage, CachedStorage):
+                print(f'{name}: {storage.stats}')
+
+        # 只获取部分字段或不获取文档
+        storage = storages['sqlite(get_by_ids)']
+        for name, kwargs in (('fields=[id]', {'fields': ['id']}),
+                             ('return_documents=False', {'return_documents': False})):
+            _, total = timed(lambda: [
+                index.retrieve(storage, query, 'text', limit=limit, **kwargs) for query in queries
+            ])
+            print(f'sqlite(get_by_ids): retrieve with {name} {num_queries / total:.0f} queries/s')
+
+        # 重新打开 LogFileStorage，分别使用偏移量索引及扫描数据文件恢复
+        log_path = os.path.join(base_dir, 'docs.log')
+        storages['logfile'].close()
+        _, elapsed = timed(LogFileStorage, 'id', log_path)
+        print(f'logfile: reopened with offset index in {elapsed * 1000:.1f}ms')
+        os.remove(f'{log_path}.idx')
+        _, elapsed = timed(LogFileStorage, 'id', log_path)
+        print(f'logfile: reopened by scanning in {elapsed * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""测量设置 threshold 时前缀过滤及长度过滤减少的候选文档数量
+
+query 为语料中的文档替换一个字后得到的近似重复文本，对比不设置 threshold 与设置
+threshold 时的候选文档数量及检索耗时。
+
+Usage: python benchmarks/bench_threshold_filtering.py [num_docs] [num_queries]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+from corpus import generate_corpus  # noqa
+from zhtools.utils import InvertedIndex, MemoryDocumentStorage  # noqa
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+}
+
+
+def make_queries(documents, num_queries, seed=0):
+    rand = random.Random(seed)
+    queries = []
+    for document in rand.sample(documents, num_queries):
+        text = list(document['text'])
+        text[rand.randrange(len(text))] = chr(0x4e00 + rand.randrange(2000))
+        queries.append(''.join(text))
+
+    return queries
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    documents = list(generate_corpus(size))
+    index, storage = InvertedIndex(SCHEMA), MemoryDocumentStorage('id')
+    index.add_documents(documents)
+    for document in documents:
+        storage.add_document(document)
+
+    queries = [index.preprocess(query) for query in make_queries(documents, num_queries)]
+    for rank_metric in ('jaccard', 'dice', 'cosine'):
+        baseline = sum(
+            len(index._collect_candidates(query, 'text', rank_metric)[1]) for query in queries
+        )
+        start = time.time()
+        for query in queries:
+            index.retrieve(storage, query, 'text', rank_metric=rank_metric, threshold=None)
+        elapsed = time.time() - start
+        print(f'{rank_metric}: {baseline / num_queries:.0f} candidates/query without threshold, '
+              f'{num_queries / elapsed:.0f} queries/s')
+
+        for threshold in (0.5, 0.8, 0.9):
+            filtered = sum(
+                len(index._collect_candidates(query, 'text', rank_metric, 'both', threshold)[1])
+                for query in queries
+            )
+            start = time.time()
+            for query in queries:
+                index.retrieve(storage, query, 'text', rank_metric=rank_metric, threshold=threshold)
+            elapsed = time.time() - start
+            print(f'  threshold {threshold}: {filtered / num_queries:.0f} candidates/query '
+                  f'({filtered / baseline:.2%} of baseline), {num_queries / elapsed:.0f} queries/s')
+
+
+if __name__ == '__main__':
+    main()
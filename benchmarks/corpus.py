@@ -0,0 +1,13 @@
+"""用于 benchmark 的合成中文语料"""
+import random
+
+
+def generate_corpus(size, min_length=10, max_length=40, vocab_size=2000, seed=42):
+    """生成 size 条文档，字符按 zipf 分布从 vocab_size 个常用汉字中抽取"""
+    rand = random.Random(seed)
+    vocab = [chr(0x4e00 + idx) for idx in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    for idx in range(size):
+        length = rand.randint(min_length, max_length)
+        text = ''.join(rand.choices(vocab, weights=weights, k=length))
+        yield {'id': f'{idx:08d}-{rand.getrandbits(64):016x}', 'text': text}
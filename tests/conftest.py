@@ -22,20 +22,24 @@ class MockResponse():
 def mock_corenlp_post(monkeypatch):
 
     text_to_words = {
-        '今天的天气真好': ['今天', '的', '天气', '真', '好']
+        '今天的天气真好': ['今天', '的', '天气', '真', '好'],
+        '明天下雨': ['明天', '下雨'],
     }
 
     def fake_post(self, *args, data=None, **kwargs):
         text = data.decode('utf-8')
-        words = text_to_words.get(text, [])
-
-        tokens = []
-        for word, span in zip(words, align_tokens(words, text)):
-            tokens.append({
-                'originalText': word,
-                'characterOffsetBegin': span[0],
-                'characterOffsetEnd': span[1]
-            })
+
+        # 以空行分隔的多个段落分别查找，位置相对于整个文本
+        tokens, offset = [], 0
+        for paragraph in text.split('\n\n'):
+            words = text_to_words.get(paragraph, [])
+            for word, span in zip(words, align_tokens(words, paragraph)):
+                tokens.append({
+                    'originalText': word,
+                    'characterOffsetBegin': offset + span[0],
+                    'characterOffsetEnd': offset + span[1]
+                })
+            offset += len(paragraph) + 2
 
         data = {}
         if tokens:
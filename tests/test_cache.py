@@ -0,0 +1,41 @@
+from zhtools.utils.cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache and cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats == {'size': 2, 'weight': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_lru_cache_weight():
+    cache = LRUCache(max_weight=5, weigher=lambda key, value: len(value))
+    cache.put('a', 'xx')
+    cache.put('b', 'yyy')
+    cache.put('c', 'zz')
+    assert 'a' not in cache and len(cache) == 2 and cache.weight == 5
+
+    cache.put('d', 'too long')
+    assert 'd' not in cache
+
+    cache.clear()
+    assert len(cache) == 0 and cache.weight == 0
+
+
+def test_lru_cache_ttl():
+    now = [0.0]
+    cache = LRUCache(ttl=10, timer=lambda: now[0])
+    cache.put('a', 1)
+    now[0] = 5.0
+    cache.put('b', 2)
+    assert cache.get('a') == 1 and 'b' in cache
+
+    now[0] = 12.0
+    assert 'a' not in cache and cache.get('a') is None
+    assert cache.get('b') == 2 and len(cache) == 1
+    assert cache.stats['misses'] == 1
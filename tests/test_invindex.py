@@ -1,11 +1,16 @@
+import asyncio
+import math
 from contextlib import contextmanager
+from copy import deepcopy
 from os.path import join
 import shutil
 import tempfile
+import types
 
 import pytest
 
-from zhtools.utils.storage import MemoryDocumentStorage
+from zhtools.utils.storage import AsyncStorage, MemoryDocumentStorage
+from zhtools.utils.index_file import IndexFileError
 from zhtools.utils.inverted_index import IndexSchema, InvertedIndex, FieldNotExistsError
 from zhtools.similarity import compute_similarity
 from zhtools.tokenize import get_tokenizer
@@ -40,6 +45,11 @@ class TestIndexSchema():
                 "id": {"type": "str", "uuid": True, "index": False},
                 "text": {"type": "str", "index": False},
             },
+            {"id": {"type": "str", "uuid": True}, "cnt": {"type": "int", "exact": True}},
+            {
+                "id": {"type": "str", "uuid": True},
+                "text": {"type": "str", "index": False, "exact": True},
+            },
         ]
     )
     def test_init_error(self, schema_data):
@@ -80,7 +90,36 @@ class TestInvertedIndex():
     def test_dump_load(self):
         with tempdir() as base_dir:
             self.index.dump(join(base_dir, 'test.index'))
-            self.index = InvertedIndex.load(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'))
+
+            for query, field in [('first', 'text'), ('doc', 'text'), (4, 'cnt')]:
+                for rank_metric in InvertedIndex.METRICS:
+                    assert index.retrieve(self.storage, query, field, rank_metric=rank_metric) == \
+                        self.index.retrieve(self.storage, query, field, rank_metric=rank_metric)
+
+            assert index.match_on_field(self.storage, 'text', 'first doc') == \
+                self.index.match_on_field(self.storage, 'text', 'first doc')
+
+            # 加载后的索引可以继续添加文档并再次导出
+            document = {'id': '6', 'text': 'sixth doc', 'cnt': 4}
+            index.add_document(document)
+            self.storage.add_document(document)
+            assert len(index.retrieve(self.storage, 'doc', 'text')) == 5
+            assert len(index.match_on_field(self.storage, 'cnt', 4)) == 2
+
+            index.dump(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'))
+            assert index.match_on_field(self.storage, 'text', 'sixth doc') == [document]
+            assert [doc['id'] for doc in index.match_range(self.storage, 'cnt', 3)] == \
+                ['2', '1', '6']
+
+    def test_load_error(self):
+        with tempdir() as base_dir:
+            with open(join(base_dir, 'test.index'), 'wb') as fout:
+                fout.write(b'not an index file')
+
+            with pytest.raises(IndexFileError):
+                InvertedIndex.load(join(base_dir, 'test.index'))
 
     @pytest.mark.parametrize(
         ("bad_doc", "exception"),
@@ -188,3 +227,629 @@ class TestInvertedIndex():
     def test_match_on_field_error(self):
         with pytest.raises(FieldNotExistsError):
             self.index.match_on_field(self.storage, 'some field', 'some value')
+
+    @pytest.mark.parametrize(
+        'lo, hi, ids',
+        [
+            (2, 3, ['3', '2']),
+            (None, 2, ['4', '3']),
+            (3, None, ['2', '1']),
+            (None, None, ['4', '3', '2', '1']),
+            (5, None, []),
+            (3, 2, []),
+        ]
+    )
+    def test_match_range(self, lo, hi, ids):
+        results = self.index.match_range(self.storage, 'cnt', lo, hi)
+        assert [doc['id'] for doc in results] == ids
+
+    def test_match_range_error(self):
+        with pytest.raises(FieldNotExistsError):
+            self.index.match_range(self.storage, 'some field', 1, 2)
+        with pytest.raises(ValueError):
+            self.index.match_range(self.storage, 'text', 1, 2)
+
+    def test_int_out_of_range(self):
+        with pytest.raises(ValueError):
+            self.index.add_document({'id': 'big', 'text': 'big', 'cnt': 2 ** 64})
+        assert 'big' not in self.index.doc_ids
+        assert not self.index.match_on_field(self.storage, 'cnt', 2 ** 64)
+        assert [doc['id'] for doc in self.index.match_range(self.storage, 'cnt', 3)] == \
+            ['2', '1']
+
+    @pytest.mark.parametrize(
+        'filters, ids',
+        [
+            ({'cnt': (2, 3)}, ['2', '3']),
+            ({'cnt': 4}, ['1']),
+            ({'cnt': (None, 1)}, ['4']),
+            ({'cnt': (5, None)}, []),
+        ]
+    )
+    def test_retrieve_filters(self, filters, ids):
+        for rank_metric in ('jaccard', 'lcs', 'bm25'):
+            results = self.index.retrieve(self.storage, 'doc', 'text', rank_metric=rank_metric,
+                                          filters=filters)
+            assert sorted(ret['document']['id'] for ret in results) == ids
+
+        results = self.index.retrieve_batch(self.storage, ['doc'], 'text', filters=filters)
+        assert sorted(ret['document']['id'] for ret in results[0]) == ids
+        storage = SlowAsyncStorage(self.storage, latency=0)
+        results = asyncio.run(self.index.aretrieve(storage, 'doc', 'text', filters=filters))
+        assert sorted(ret['document']['id'] for ret in results) == ids
+
+
+class CountingStorage(MemoryDocumentStorage):
+
+    def __init__(self, uuid_field):
+        super().__init__(uuid_field)
+        self.fetches = 0
+
+    def get_by_id(self, uuid):
+        self.fetches += 1
+        return super().get_by_id(uuid)
+
+
+class SlowAsyncStorage(AsyncStorage):
+
+    """每次获取文档有 latency 秒延迟的异步 storage，记录同时进行的请求数量"""
+
+    def __init__(self, storage, latency=0.01):
+        self.storage = storage
+        self.latency = latency
+        self.fetches = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def get_by_id(self, uuid):
+        self.fetches += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.latency)
+        self.running -= 1
+        return self.storage.get_by_id(uuid)
+
+    async def add_document(self, document):
+        return self.storage.add_document(document)
+
+
+class TestInvertedIndexRanking():
+
+    SCHEMA = {
+        'id': {'type': 'str', 'uuid': True, 'index': False},
+        'text': {'type': 'str'},
+    }
+    TEXTS = [
+        '今天天气真好', '今天天气不好', '明天天气真好啊', '天气预报说今天有雨',
+        '今天的天气真的很好', '好天气', '今天', '天气真好今天天气真好',
+        '昨天天气还不错', '今天天气怎么样', '今天去公园玩', '公园里的天气真好',
+    ]
+
+    def setup(self):
+        self.index = InvertedIndex(self.SCHEMA)
+        self.storage = CountingStorage('id')
+        for idx, text in enumerate(self.TEXTS):
+            document = {'id': str(idx), 'text': text}
+            self.index.add_document(document)
+            self.storage.add_document(document)
+
+    def brute_force(self, query, rank_metric, metric_base):
+        scores = []
+        for text in self.TEXTS:
+            if metric_base == 'document':
+                score = compute_similarity(text, query, method=rank_metric,
+                                           tokenizer=TOKENIZER, partial=True)
+            else:
+                score = compute_similarity(query, text, method=rank_metric,
+                                           tokenizer=TOKENIZER, partial=metric_base == 'query')
+            if score > 0:
+                scores.append(score)
+
+        return sorted(scores, reverse=True)
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'dice', 'cosine', 'lcs'])
+    @pytest.mark.parametrize('metric_base', ['both', 'query', 'document'])
+    @pytest.mark.parametrize('limit', [None, 1, 3])
+    def test_retrieve_topk(self, rank_metric, metric_base, limit):
+        query = '今天天气真好'
+        results = self.index.retrieve(self.storage, query, 'text', limit=limit,
+                                      rank_metric=rank_metric, metric_base=metric_base)
+        expected = self.brute_force(query, rank_metric, metric_base)
+        assert [ret['score'] for ret in results] == pytest.approx(expected[:limit])
+
+    def test_retrieve_pruning(self):
+        results = self.index.retrieve(self.storage, '今天天气真好', 'text', limit=1,
+                                      metric_base='query')
+        assert results[0]['score'] == 1.0
+        assert self.storage.fetches < len(self.TEXTS)
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'dice'])
+    def test_retrieve_without_storage_scoring(self, rank_metric):
+        results = self.index.retrieve(self.storage, '今天天气', 'text', limit=3,
+                                      rank_metric=rank_metric)
+        assert len(results) == 3
+        assert self.storage.fetches == len(results)
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'dice', 'cosine', 'lcs'])
+    @pytest.mark.parametrize('metric_base', ['both', 'query', 'document'])
+    @pytest.mark.parametrize('threshold', [0.3, 0.6, 0.9])
+    def test_retrieve_threshold(self, rank_metric, metric_base, threshold):
+        query = '今天天气真好'
+        expected = [
+            score for score in self.brute_force(query, rank_metric, metric_base)
+            if score >= threshold
+        ]
+        results = self.index.retrieve(self.storage, query, 'text', rank_metric=rank_metric,
+                                      metric_base=metric_base, threshold=threshold)
+        assert [ret['score'] for ret in results] == pytest.approx(expected)
+
+        batch = self.index.retrieve_batch(self.storage, [query], 'text', rank_metric=rank_metric,
+                                          metric_base=metric_base, threshold=threshold)
+        assert batch == [results]
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'dice', 'cosine'])
+    def test_candidate_filtering(self, rank_metric):
+        _, candidates = self.index._collect_candidates('今天天气真好', 'text', rank_metric)
+        _, filtered = self.index._collect_candidates('今天天气真好', 'text', rank_metric,
+                                                     threshold=0.8)
+        assert set(filtered) < set(candidates)
+        for docid, overlap in filtered.items():
+            assert candidates[docid] == overlap
+
+    @pytest.mark.parametrize('rank_metric', ['cosine', 'lcs'])
+    @pytest.mark.parametrize('metric_base', ['both', 'query', 'document'])
+    def test_retrieve_forward_index(self, rank_metric, metric_base):
+        index = InvertedIndex(self.SCHEMA, forward_index=False)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        query = '今天天气真好啊'
+        expected = index.retrieve(self.storage, query, 'text', rank_metric=rank_metric,
+                                  metric_base=metric_base)
+        self.storage.fetches = 0
+        results = self.index.retrieve(self.storage, query, 'text', rank_metric=rank_metric,
+                                      metric_base=metric_base)
+        assert results == expected
+        assert self.storage.fetches == len(results)
+
+    @pytest.mark.parametrize('workers', [None, 2])
+    def test_add_documents(self, workers):
+        index = InvertedIndex(self.SCHEMA)
+        documents = [{'id': str(idx), 'text': text} for idx, text in enumerate(self.TEXTS)]
+        assert index.add_documents(documents, workers=workers, batch_size=5) == len(documents)
+
+        assert index.term_dict == self.index.term_dict
+        assert index.uuids == self.index.uuids
+        for rank_metric in InvertedIndex.METRICS:
+            assert index.retrieve(self.storage, '今天天气', 'text', rank_metric=rank_metric) == \
+                self.index.retrieve(self.storage, '今天天气', 'text', rank_metric=rank_metric)
+
+    def test_add_documents_error(self):
+        index = InvertedIndex(self.SCHEMA)
+        with pytest.raises(FieldNotExistsError):
+            index.add_documents([{'id': '1', 'text': 'a'}, {'text': 'b'}], workers=2)
+
+    def test_retrieve_cache(self):
+        index = InvertedIndex(self.SCHEMA, cache_size=10)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        expected = index.retrieve(self.storage, '今天天气', 'text', limit=3)
+        fetches = self.storage.fetches
+        assert index.retrieve(self.storage, '今天天气', 'text', limit=3) == expected
+        assert self.storage.fetches == fetches
+        assert index.cache.hits == 1 and index.cache.misses == 1
+
+        # 修改索引后缓存的结果失效
+        index.delete_document(expected[0]['document']['id'])
+        assert index.retrieve(self.storage, '今天天气', 'text', limit=3) != expected
+        assert index.cache.misses == 2
+
+    def test_retrieve_cache_storage(self):
+        index = InvertedIndex(self.SCHEMA, cache_size=10)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        # 修改返回的文档不影响缓存的结果
+        results = index.retrieve(self.storage, '今天天气', 'text', limit=3)
+        document = deepcopy(results[0]['document'])
+        results[0]['document']['text'] = '修改后的文档'
+        assert index.retrieve(self.storage, '今天天气', 'text', limit=3)[0]['document'] == document
+
+        # storage 被回收后，复用了同一个 id 的新 storage 不会得到之前缓存的结果
+        storage = MemoryDocumentStorage('id')
+        storage.add_document({'id': '0', 'text': '旧文档'})
+        assert index.retrieve(storage, '今天天气', 'text', limit=3)[0]['document'] == \
+            {'id': '0', 'text': '旧文档'}
+        storage_id = id(storage)
+        del storage
+        storage = MemoryDocumentStorage('id')
+        storage.add_document({'id': '0', 'text': '新文档'})
+        if id(storage) == storage_id:
+            assert index.retrieve(storage, '今天天气', 'text', limit=3)[0]['document'] == \
+                {'id': '0', 'text': '新文档'}
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'lcs'])
+    @pytest.mark.parametrize('forward_index', [True, False])
+    def test_retrieve_batch(self, rank_metric, forward_index):
+        index = InvertedIndex(self.SCHEMA, forward_index=forward_index)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        queries = ['今天天气真好', '公园', '今天天气真好', 123, '天气预报']
+        expected = [
+            index.retrieve(self.storage, query, 'text', limit=3, rank_metric=rank_metric)
+            for query in queries
+        ]
+        self.storage.fetches = 0
+        results = index.retrieve_batch(self.storage, queries, 'text', limit=3,
+                                       rank_metric=rank_metric)
+        assert results == expected
+        fetched = set(ret['document']['id'] for rets in results for ret in rets)
+        if forward_index:
+            assert self.storage.fetches == len(fetched)
+        else:
+            assert self.storage.fetches <= len(self.TEXTS)
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'cosine', 'lcs'])
+    @pytest.mark.parametrize('forward_index', [True, False])
+    @pytest.mark.parametrize('limit', [None, 3])
+    def test_aretrieve(self, rank_metric, forward_index, limit):
+        index = InvertedIndex(self.SCHEMA, forward_index=forward_index)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        storage = SlowAsyncStorage(self.storage, latency=0.001)
+        for query in ['今天天气真好', '公园', 123]:
+            expected = index.retrieve(self.storage, query, 'text', limit=limit,
+                                      rank_metric=rank_metric)
+            results = asyncio.run(index.aretrieve(storage, query, 'text', limit=limit,
+                                                  rank_metric=rank_metric, concurrency=4))
+            assert results == expected
+            assert storage.max_running <= 4
+
+    def test_aretrieve_concurrency(self):
+        storage = SlowAsyncStorage(self.storage, latency=0.02)
+        results = asyncio.run(self.index.aretrieve(storage, '天气', 'text', concurrency=16))
+
+        # 所有文档同时获取
+        assert len(results) == storage.fetches > 5
+        assert storage.max_running == storage.fetches
+
+    def test_amatch_on_field(self):
+        schema = {'id': {'type': 'int', 'uuid': True}, 'text': {'type': 'str'},
+                  'cnt': {'type': 'int'}}
+        index, storage = InvertedIndex(schema), MemoryDocumentStorage('id')
+        for idx, text in enumerate(self.TEXTS):
+            document = {'id': idx, 'text': text, 'cnt': idx % 3}
+            index.add_document(document)
+            storage.add_document(document)
+
+        async_storage = SlowAsyncStorage(storage, latency=0.001)
+        for field, value in [('text', '今天'), ('text', '明天'), ('cnt', 1), ('id', 3),
+                             ('id', 100), ('cnt', '1')]:
+            expected = index.match_on_field(storage, field, value)
+            results = asyncio.run(index.amatch_on_field(async_storage, field, value))
+            assert results == expected
+
+        # 已从索引中删除的文档，即使仍在 storage 中也不返回
+        assert index.delete_document(3)
+        assert index.match_on_field(storage, 'id', 3) == []
+        assert index.match_on_field(storage, 'id', 3, return_documents=False) == []
+        assert asyncio.run(index.amatch_on_field(async_storage, 'id', 3)) == []
+        assert index.match_on_field(storage, 'id', 4, return_documents=False) == [4]
+
+    @pytest.mark.parametrize('workers', [None, 2])
+    def test_exact_match(self, workers):
+        schema = dict(self.SCHEMA, text={'type': 'str', 'exact': True})
+        index, storage = InvertedIndex(schema), CountingStorage('id')
+        documents = [{'id': str(idx), 'text': text} for idx, text in enumerate(self.TEXTS)]
+        documents.append({'id': 'dup', 'text': self.TEXTS[0]})
+        index.add_documents(documents, workers=workers, batch_size=4)
+        for document in documents:
+            storage.add_document(document)
+
+        for value in ['今天天气真好', '今天', '天气真好', '今天天气真好！', '不存在的文本']:
+            expected = self.index.match_on_field(self.storage, 'text', value)
+            expected += [doc for doc in documents[-1:] if doc['text'] == value]
+            storage.fetches = 0
+            results = index.match_on_field(storage, 'text', value)
+            assert results == expected
+            # 只获取匹配的文档
+            assert storage.fetches == len(expected)
+
+        index.delete_document('0')
+        index.add_document({'id': '1', 'text': '今天天气真好'})
+        storage.add_document({'id': '1', 'text': '今天天气真好'})
+        assert [doc['id'] for doc in index.match_on_field(storage, 'text', '今天天气真好')] == \
+            ['dup', '1']
+        assert index.match_on_field(storage, 'text', self.TEXTS[1]) == []
+
+        index.merge()
+        with tempdir() as base_dir:
+            index.dump(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'))
+
+        assert [doc['id'] for doc in index.match_on_field(storage, 'text', '今天天气真好')] == \
+            ['dup', '1']
+        index.add_document({'id': '2', 'text': '今天天气真好'})
+        storage.add_document({'id': '2', 'text': '今天天气真好'})
+        assert [doc['id'] for doc in index.match_on_field(storage, 'text', '今天天气真好')] == \
+            ['dup', '1', '2']
+        assert index.match_on_field(storage, 'text', self.TEXTS[2]) == []
+
+    def brute_force_relevance(self, query, rank_metric):
+        docs = [TOKENIZER.lcut(text) for text in self.TEXTS]
+        avgdl = sum(len(terms) for terms in docs) / len(docs)
+        scores = []
+        for terms in docs:
+            score = 0.0
+            for term in TOKENIZER.lcut(query):
+                df = sum(1 for other in docs if term in other)
+                tf = terms.count(term)
+                if not tf:
+                    continue
+                if rank_metric == 'bm25':
+                    idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                    score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(terms) / avgdl))
+                else:
+                    idf = 1 + math.log((len(docs) + 1) / (df + 1))
+                    score += math.sqrt(tf / len(terms)) * idf ** 2
+            if score > 0:
+                scores.append(score)
+
+        return sorted(scores, reverse=True)
+
+    @pytest.mark.parametrize('rank_metric', ['bm25', 'tfidf'])
+    @pytest.mark.parametrize('limit', [None, 3])
+    def test_retrieve_relevance(self, rank_metric, limit):
+        query = '今天天气真好今天'
+        results = self.index.retrieve(self.storage, query, 'text', limit=limit,
+                                      rank_metric=rank_metric)
+        expected = self.brute_force_relevance(query, rank_metric)
+        assert [ret['score'] for ret in results] == pytest.approx(expected[:limit])
+        # 相关度只由索引计算，只有返回的文档需要从 storage 中获取
+        assert self.storage.fetches == len(results)
+
+        threshold = expected[2]
+        results = self.index.retrieve(self.storage, query, 'text', rank_metric=rank_metric,
+                                      threshold=threshold)
+        assert len(results) == len([score for score in expected if score >= threshold])
+        assert self.index.retrieve_batch(self.storage, [query], 'text', rank_metric=rank_metric,
+                                         threshold=threshold) == [results]
+        assert asyncio.run(self.index.aretrieve(
+            SlowAsyncStorage(self.storage, latency=0), query, 'text', rank_metric=rank_metric,
+            threshold=threshold
+        )) == results
+
+    def brute_force_pairs(self, texts, rank_metric, threshold):
+        pairs = {}
+        for second, second_text in texts.items():
+            for first, first_text in texts.items():
+                if int(first) >= int(second):
+                    continue
+                score = compute_similarity(first_text, second_text, method=rank_metric,
+                                           tokenizer=TOKENIZER)
+                # find_duplicates 中 lcs 取两个方向中较大的值
+                if rank_metric == 'lcs':
+                    score = max(score, compute_similarity(second_text, first_text,
+                                                          method=rank_metric, tokenizer=TOKENIZER))
+                if score >= threshold:
+                    pairs[(first, second)] = score
+
+        return pairs
+
+    @pytest.mark.parametrize('rank_metric', ['jaccard', 'dice', 'cosine', 'lcs'])
+    @pytest.mark.parametrize('forward_index', [True, False])
+    @pytest.mark.parametrize('workers', [None, 2])
+    def test_find_duplicates(self, rank_metric, forward_index, workers):
+        index = InvertedIndex(self.SCHEMA, forward_index=forward_index, segment_size=4)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        pairs = index.find_duplicates(self.storage, 'text', rank_metric, threshold=0.4,
+                                      workers=workers, batch_size=5)
+        assert isinstance(pairs, types.GeneratorType)
+        results = {(first, second): score for first, second, score in pairs}
+        expected = self.brute_force_pairs(dict(enumerate(self.TEXTS)), rank_metric, 0.4)
+        assert results.keys() == {(str(first), str(second)) for first, second in expected}
+        for (first, second), score in expected.items():
+            assert results[(str(first), str(second))] == pytest.approx(score)
+
+    def test_find_duplicates_loaded(self):
+        # 从文件加载且开启缓存的索引无法序列化，多进程时子进程通过 fork 继承
+        with tempdir() as base_dir:
+            self.index.dump(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'), cache_size=10)
+            expected = list(index.find_duplicates(self.storage, 'text', threshold=0.4))
+            assert expected
+            assert list(index.find_duplicates(self.storage, 'text', threshold=0.4, workers=2,
+                                              batch_size=5)) == expected
+
+    @pytest.mark.parametrize('texts', [['丙乙丙丙', '丙丙乙丁丙丙'], ['丙丙乙丁丙丙', '丙乙丙丙']])
+    def test_find_duplicates_lcs_symmetric(self, texts):
+        index = InvertedIndex(self.SCHEMA)
+        for idx, text in enumerate(texts):
+            index.add_document({'id': str(idx), 'text': text})
+
+        pairs = list(index.find_duplicates(self.storage, 'text', 'lcs', threshold=0.5))
+        assert pairs == [('0', '1', pytest.approx(0.5))]
+
+    def test_find_duplicates_updates(self):
+        index = InvertedIndex(self.SCHEMA, segment_size=4)
+        for idx, text in enumerate(self.TEXTS):
+            index.add_document({'id': str(idx), 'text': text})
+
+        index.delete_document('1')
+        index.add_document({'id': '7', 'text': '公园里天气真好'})
+        index.merge()
+        index.delete_document('2')
+        texts = dict(enumerate(self.TEXTS))
+        texts.update({7: '公园里天气真好'})
+        del texts[1], texts[2]
+
+        results = {
+            (first, second): score
+            for first, second, score in index.find_duplicates(self.storage, 'text', threshold=0.3)
+        }
+        expected = self.brute_force_pairs(texts, 'jaccard', 0.3)
+        # 更新后的文档 7 的 doc id 最大，因此在文档对中排在后面
+        assert results.keys() == {
+            tuple(sorted((str(first), str(second)), key=lambda uuid: uuid == '7'))
+            for first, second in expected
+        }
+
+    def test_find_duplicates_error(self):
+        schema = dict(self.SCHEMA, cnt={'type': 'int'})
+        index = InvertedIndex(schema)
+        with pytest.raises(FieldNotExistsError):
+            list(index.find_duplicates(self.storage, 'none'))
+        with pytest.raises(ValueError):
+            list(index.find_duplicates(self.storage, 'cnt'))
+        assert list(index.find_duplicates(self.storage, 'id')) == []
+
+
+class TestInvertedIndexSegments():
+
+    SCHEMA = {
+        'id': {'type': 'str', 'uuid': True, 'index': False},
+        'text': {'type': 'str'},
+        'cnt': {'type': 'int'},
+    }
+
+    def setup(self):
+        self.index = InvertedIndex(self.SCHEMA, segment_size=2, merge_factor=2)
+        self.storage = MemoryDocumentStorage('id')
+        for idx in range(7):
+            self.add({'id': str(idx), 'text': f'doc {idx}', 'cnt': idx % 2})
+
+    def add(self, document):
+        self.index.add_document(document)
+        self.storage.update_document(document)
+
+    def uuids(self, results):
+        return sorted(ret['document']['id'] for ret in results)
+
+    def test_segments(self):
+        assert len(self.index.segments) > 1
+        assert [segment.level for segment in self.index.segments] == [1, 0, 0]
+        assert self.uuids(self.index.retrieve(self.storage, 'doc', 'text')) == \
+            [str(idx) for idx in range(7)]
+
+    def test_delete_document(self):
+        assert self.index.delete_document('1')
+        assert not self.index.delete_document('1')
+
+        assert '1' not in self.uuids(self.index.retrieve(self.storage, 'doc', 'text'))
+        assert not self.index.match_on_field(self.storage, 'text', 'doc 1')
+        assert [doc['id'] for doc in self.index.match_on_field(self.storage, 'cnt', 1)] == \
+            ['3', '5']
+
+    def test_update_document(self):
+        self.add({'id': '1', 'text': 'new text', 'cnt': 0})
+
+        assert '1' not in self.uuids(self.index.retrieve(self.storage, 'doc', 'text'))
+        assert self.uuids(self.index.retrieve(self.storage, 'new text', 'text')) == ['1']
+        assert '1' in [doc['id'] for doc in self.index.match_on_field(self.storage, 'cnt', 0)]
+
+    def test_merge(self):
+        self.index.delete_document('2')
+        self.add({'id': '3', 'text': 'third', 'cnt': 3})
+        expected = self.index.retrieve(self.storage, 'doc', 'text')
+
+        self.index.merge()
+        assert len(self.index.segments) == 1 and not self.index.deleted
+        assert self.index.retrieve(self.storage, 'doc', 'text') == expected
+
+        self.add({'id': '8', 'text': 'doc 8', 'cnt': 0})
+        assert len(self.index.segments) == 2
+        assert '8' in self.uuids(self.index.retrieve(self.storage, 'doc', 'text'))
+
+    def test_term_freqs(self):
+        self.add({'id': '7', 'text': 'doc doc', 'cnt': 0})
+        self.index.delete_document('0')
+        segment, field_id = self.index.segments[-1], self.index.fields.index('text')
+        term_id = self.index.term_dict['do']
+        assert list(segment.get_freqs(field_id, term_id)) == [1] * (len(segment) - 1) + [2]
+        field_lengths = self.index.field_lengths[field_id]
+        assert self.index.field_stats[field_id] == [sum(field_lengths) - field_lengths[0], 7]
+
+        expected = self.index.retrieve(self.storage, 'doc', 'text', rank_metric='bm25')
+        assert expected[0]['document']['id'] == '7'
+        with tempdir() as base_dir:
+            self.index.dump(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'))
+            assert index.field_stats == self.index.field_stats
+            self.index.merge()
+            for rank_metric in ('bm25', 'tfidf'):
+                assert index.retrieve(self.storage, 'doc', 'text', rank_metric=rank_metric) == \
+                    self.index.retrieve(self.storage, 'doc', 'text', rank_metric=rank_metric)
+
+    def test_dump_load(self):
+        self.index.delete_document('2')
+        self.add({'id': '3', 'text': 'third', 'cnt': 3})
+        with tempdir() as base_dir:
+            self.index.dump(join(base_dir, 'test.index'))
+            index = InvertedIndex.load(join(base_dir, 'test.index'))
+
+            assert index.retrieve(self.storage, 'doc', 'text') == \
+                self.index.retrieve(self.storage, 'doc', 'text')
+            assert not index.delete_document('2')
+            assert index.delete_document('4')
+            assert '4' not in self.uuids(index.retrieve(self.storage, 'doc', 'text'))
+
+            index.add_document({'id': '5', 'text': 'fifth', 'cnt': 5})
+            assert '5' not in self.uuids(index.retrieve(self.storage, 'doc', 'text'))
+            index.merge()
+            assert self.uuids(index.retrieve(self.storage, 'doc', 'text')) == ['0', '1', '6']
+
+    def test_dump_load_repeated(self):
+        self.index.delete_document('2')
+        self.index.merge()
+        with tempdir() as base_dir:
+            self.index.dump(join(base_dir, 'first.index'))
+            loaded = InvertedIndex.load(join(base_dir, 'first.index'))
+            assert loaded.delete_document('4')
+            field_stats = deepcopy(loaded.field_stats)
+            loaded.dump(join(base_dir, 'second.index'))
+            index = InvertedIndex.load(join(base_dir, 'second.index'))
+
+            assert '2' not in index.doc_ids and '4' not in index.doc_ids
+            assert not index.delete_document('2')
+            assert not index.delete_document('4')
+            assert index.field_stats == field_stats
+            assert index.retrieve(self.storage, 'doc', 'text') == \
+                loaded.retrieve(self.storage, 'doc', 'text')
+
+    def test_merge_compacts_docids(self):
+        schema = dict(self.SCHEMA, text={'type': 'str', 'exact': True})
+        index = InvertedIndex(schema, segment_size=2, merge_factor=2)
+        for round_ in range(5):
+            for idx in range(7):
+                document = {'id': str(idx), 'text': f'doc {idx} v{round_}', 'cnt': idx + round_}
+                index.add_document(document)
+                self.storage.update_document(document)
+            index.delete_document('6')
+            index.merge()
+            assert len(index.uuids) == len(index.doc_ids) == 6
+            assert all(len(lengths) == 6 for lengths in index.doc_lengths)
+            assert all(len(lengths) == 6 for lengths in index.field_lengths)
+
+        assert self.uuids(index.retrieve(self.storage, 'v4', 'text')) == \
+            [str(idx) for idx in range(6)]
+        assert [doc['id'] for doc in index.match_on_field(self.storage, 'text', 'doc 3 v4')] == \
+            ['3']
+        assert [doc['id'] for doc in index.match_range(self.storage, 'cnt', 5, 6)] == ['1', '2']
+
+        with tempdir() as base_dir:
+            document = {'id': '0', 'text': 'doc 0 v5', 'cnt': 0}
+            index.add_document(document)
+            self.storage.update_document(document)
+            index.dump(join(base_dir, 'test.index'))
+            assert len(index.uuids) == 6
+            loaded = InvertedIndex.load(join(base_dir, 'test.index'))
+            loaded.delete_document('1')
+            loaded.merge()
+            assert list(loaded.uuids) == ['2', '3', '4', '5', '0']
+            assert [doc['id'] for doc in loaded.match_range(self.storage, 'cnt', 0, 6)] == \
+                ['0', '2']
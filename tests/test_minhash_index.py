@@ -0,0 +1,84 @@
+import pytest
+
+from zhtools.similarity import compute_similarity
+from zhtools.tokenize import get_tokenizer
+from zhtools.utils.storage import MemoryDocumentStorage
+from zhtools.utils.inverted_index import FieldNotExistsError
+from zhtools.utils.minhash_index import MinHashIndex
+
+
+TOKENIZER = get_tokenizer('ngram', level=2)
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True},
+    'text': {'type': 'str'},
+    'cnt': {'type': 'int'},
+}
+TEXTS = [
+    '今天天气真好，我们一起去公园散步吧', '今天天气真好，我们一起去公园跑步吧',
+    '今天天气真好，我们一起去公园散步', '明天可能会下雨，记得带伞',
+    '天气预报说明天有雨', '今天天气真好', '公园里有很多人在散步', '',
+]
+
+
+@pytest.fixture
+def index_storage():
+    index, storage = MinHashIndex(SCHEMA, bands=32, rows=4), MemoryDocumentStorage('id')
+    for idx, text in enumerate(TEXTS):
+        document = {'id': str(idx), 'text': text, 'cnt': idx}
+        index.add_document(document)
+        storage.add_document(document)
+
+    return index, storage
+
+
+def test_signature():
+    index = MinHashIndex(SCHEMA, bands=4, rows=2)
+    signature = index.signature('今天天气真好')
+    assert len(signature) == 8
+    assert signature == MinHashIndex(SCHEMA, bands=4, rows=2).signature('今天天气真好')
+    assert signature != MinHashIndex(SCHEMA, bands=4, rows=2, seed=2).signature('今天天气真好')
+    assert index.signature('') is None
+
+
+def test_retrieve(index_storage):
+    index, storage = index_storage
+    results = index.retrieve(storage, TEXTS[0], 'text')
+    assert results[0] == {'document': storage.get_by_id('0'), 'score': 1.0}
+    ids = [ret['document']['id'] for ret in results]
+    assert '1' in ids and '2' in ids
+    assert '3' not in ids and '7' not in ids
+    assert [ret['score'] for ret in results] == sorted([ret['score'] for ret in results],
+                                                       reverse=True)
+
+    assert len(index.retrieve(storage, TEXTS[0], 'text', limit=2)) == 2
+    assert all(ret['score'] >= 0.7 for ret in index.retrieve(storage, TEXTS[0], 'text',
+                                                             threshold=0.7))
+    assert index.retrieve(storage, '', 'text') == []
+    assert index.retrieve(storage, 1, 'cnt') == []
+
+
+def test_retrieve_rerank(index_storage):
+    index, storage = index_storage
+    results = index.retrieve(storage, TEXTS[1], 'text', rerank=True)
+    for ret in results:
+        expected = compute_similarity(TEXTS[1], ret['document']['text'], method='jaccard',
+                                      tokenizer=TOKENIZER)
+        assert ret['score'] == pytest.approx(expected)
+
+
+def test_delete_update(index_storage):
+    index, storage = index_storage
+    assert index.delete_document('1')
+    assert not index.delete_document('1')
+    assert '1' not in [ret['document']['id'] for ret in index.retrieve(storage, TEXTS[1], 'text')]
+
+    index.add_document({'id': '3', 'text': TEXTS[0], 'cnt': 3})
+    ids = [ret['document']['id'] for ret in index.retrieve(storage, TEXTS[0], 'text')]
+    assert ids.count('3') == 1
+    assert len(index) == len(TEXTS) - 1
+
+
+def test_retrieve_error(index_storage):
+    index, storage = index_storage
+    with pytest.raises(FieldNotExistsError):
+        index.retrieve(storage, 'a', 'none')
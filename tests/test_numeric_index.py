@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from zhtools.utils.numeric_index import FLOAT_TYPECODE, INT_TYPECODE, NumericIndex
+
+
+def test_range():
+    index = NumericIndex(INT_TYPECODE)
+    for docid, value in enumerate([5, 3, 8, 3, 1]):
+        index.add(value, docid)
+
+    assert len(index) == 5
+    assert list(index.range(3, 5)) == [1, 3, 0]
+    assert list(index.range(hi=3)) == [4, 1, 3]
+    assert list(index.range(lo=6)) == [2]
+    assert list(index.range()) == [4, 1, 3, 0, 2]
+    assert list(index.range(9, 10)) == []
+
+    # 新添加的值在下一次查询时归并
+    index.add(4, 5)
+    assert list(index.range(3, 5)) == [1, 3, 5, 0]
+
+
+def test_discard():
+    index = NumericIndex(FLOAT_TYPECODE)
+    for docid, value in enumerate([0.5, 1.5, 2.5]):
+        index.add(value, docid)
+
+    index.discard({1})
+    values, docids = index.items()
+    assert list(values) == [0.5, 2.5] and list(docids) == [0, 2]
+    assert list(index.range(1.0, 2.0)) == []
+
+
+def test_from_sorted_values():
+    index = NumericIndex(INT_TYPECODE, values=memoryview(b''.join(
+        value.to_bytes(8, 'little', signed=True) for value in [1, 2, 2]
+    )).cast('q'), docids=[3, 0, 1])
+    index.add(0, 2)
+    assert list(index.range(2, 2)) == [0, 1]
+    assert list(index.range(hi=1)) == [2, 3]
+
+
+def test_pending_buffer():
+    index = NumericIndex(INT_TYPECODE)
+    rand, pairs = random.Random(0), []
+    for docid in range(3000):
+        value = rand.randint(0, 100)
+        index.add(value, docid)
+        pairs.append((value, docid))
+        if docid % 97 == 0:
+            # 查询不会归并缓冲区，缓冲区超过上限后才归并
+            assert len(index.pending) <= max(index.MAX_PENDING, len(index.values) // 8)
+            expected = [docid for value, docid in sorted(pairs) if 20 <= value <= 40]
+            assert list(index.range(20, 40)) == expected
+            assert list(index.range()) == [docid for _, docid in sorted(pairs)]
+    assert 0 < len(index.values) < len(index) == 3000
+
+    with pytest.raises(ValueError):
+        index.add(2 ** 63, 3000)
+    assert len(index) == 3000
@@ -0,0 +1,26 @@
+from collections import Counter
+
+import pytest
+
+from zhtools.utils.postings import accumulate_known, intersect, new_postings
+
+
+@pytest.mark.parametrize(
+    'postings_list, expected',
+    [
+        ([], []),
+        ([[1, 2, 3]], [1, 2, 3]),
+        ([[1, 2, 3, 7], [2, 3, 8], [0, 3, 7]], [3]),
+        ([[1, 2], [3, 4]], []),
+    ]
+)
+def test_intersect(postings_list, expected):
+    assert list(intersect([new_postings(p) for p in postings_list])) == expected
+
+
+@pytest.mark.parametrize('postings', [[2, 5], list(range(0, 100, 2))])
+def test_accumulate_known(postings):
+    counter = Counter({2: 1, 3: 1, 6: 2})
+    accumulate_known(counter, new_postings(postings), weight=2)
+    expected = {2: 3, 3: 1, 6: 4 if 6 in postings else 2}
+    assert counter == Counter(expected)
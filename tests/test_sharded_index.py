@@ -0,0 +1,79 @@
+import pytest
+
+from zhtools.utils.storage import MemoryDocumentStorage
+from zhtools.utils.inverted_index import InvertedIndex, FieldNotExistsError
+from zhtools.utils.sharded_index import ShardedInvertedIndex
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True},
+    'text': {'type': 'str'},
+    'cnt': {'type': 'int'},
+}
+DOCUMENTS = [
+    {'id': str(idx), 'text': text, 'cnt': idx % 3}
+    for idx, text in enumerate([
+        '今天天气真好', '今天天气不好', '明天天气真好啊', '天气预报说今天有雨',
+        '今天的天气真的很好', '好天气', '今天', '天气真好今天天气真好',
+    ])
+]
+
+
+@pytest.fixture(scope='module')
+def sharded_index():
+    with ShardedInvertedIndex(SCHEMA, num_shards=3) as index:
+        index.add_documents(DOCUMENTS[:-1])
+        index.add_document(DOCUMENTS[-1])
+        yield index
+
+
+@pytest.fixture(scope='module')
+def single_index():
+    index, storage = InvertedIndex(SCHEMA), MemoryDocumentStorage('id')
+    for document in DOCUMENTS:
+        index.add_document(document)
+        storage.add_document(document)
+
+    return index, storage
+
+
+@pytest.mark.parametrize('limit', [None, 1, 3])
+@pytest.mark.parametrize('rank_metric', ['jaccard', 'lcs', 'bm25', 'tfidf'])
+def test_retrieve(sharded_index, single_index, limit, rank_metric):
+    index, storage = single_index
+    results = sharded_index.retrieve('今天天气', 'text', limit=limit, rank_metric=rank_metric)
+    expected = index.retrieve(storage, '今天天气', 'text', limit=limit, rank_metric=rank_metric)
+    # bm25/tfidf 按所有分片的统计信息计算，分数与单个索引一致
+    assert [ret['score'] for ret in results] == \
+        pytest.approx([ret['score'] for ret in expected])
+
+
+def test_match_on_field(sharded_index):
+    assert sharded_index.match_on_field('id', '3') == [DOCUMENTS[3]]
+    assert sorted(doc['id'] for doc in sharded_index.match_on_field('cnt', 1)) == \
+        ['1', '4', '7']
+
+
+def test_match_range(sharded_index):
+    results = sharded_index.match_range('cnt', 1)
+    assert [doc['cnt'] for doc in results] == [1, 1, 1, 2, 2]
+    assert sorted(doc['id'] for doc in results) == ['1', '2', '4', '5', '7']
+
+
+def test_error(sharded_index):
+    with pytest.raises(FieldNotExistsError):
+        sharded_index.retrieve('今天', 'unknown')
+
+
+def test_update_delete():
+    with ShardedInvertedIndex(SCHEMA, num_shards=2) as index:
+        index.add_documents(DOCUMENTS)
+        index.add_document({'id': '1', 'text': '明天下雨', 'cnt': 1})
+        assert index.match_on_field('id', '1') == [{'id': '1', 'text': '明天下雨', 'cnt': 1}]
+        assert [ret['document']['id'] for ret in index.retrieve('下雨', 'text')] == ['1']
+        assert '1' not in [ret['document']['id'] for ret in index.retrieve('天气不好', 'text')]
+
+        assert index.delete_document('1')
+        assert not index.delete_document('1')
+        assert index.match_on_field('id', '1') == []
+        assert index.retrieve('下雨', 'text') == []
@@ -0,0 +1,429 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from os.path import join
+import pickle
+import threading
+
+import pytest
+
+from zhtools.utils.columnar_storage import ColumnarDocumentStorage
+from zhtools.utils.inverted_index import FieldNotExistsError, InvertedIndex
+from zhtools.utils.log_storage import LogFileStorage
+from zhtools.utils.storage import (
+    CachedStorage, MemoryDocumentStorage, SQLiteDocumentStorage, approximate_size, project,
+)
+
+
+SCHEMA = {
+    'id': {'type': 'str', 'uuid': True, 'index': False},
+    'text': {'type': 'str'},
+    'cnt': {'type': 'int'},
+}
+DOCUMENTS = [
+    {'id': str(idx), 'text': text, 'cnt': idx % 3}
+    for idx, text in enumerate([
+        '今天天气真好', '今天天气不好', '明天天气真好啊', '天气预报说今天有雨',
+        '今天的天气真的很好', '好天气', '今天', '天气真好今天天气真好',
+    ])
+]
+
+
+class CountingSQLiteStorage(SQLiteDocumentStorage):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.single_gets = 0
+        self.multi_gets = 0
+
+    def get_by_id(self, uuid):
+        self.single_gets += 1
+        return super().get_by_id(uuid)
+
+    def get_by_ids(self, uuids, fields=None):
+        self.multi_gets += 1
+        return super().get_by_ids(uuids, fields)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = CountingSQLiteStorage('id', join(tmp_path, 'docs.db'), batch_size=3)
+    yield storage
+    storage.close()
+
+
+def test_sqlite_storage(storage):
+    assert storage.add_documents(DOCUMENTS) == len(DOCUMENTS)
+    assert storage.add_documents(DOCUMENTS[:2]) == 0
+    assert not storage.add_document(DOCUMENTS[0])
+    assert storage.add_document({'id': 8, 'text': 'int uuid'})
+    assert len(storage) == len(DOCUMENTS) + 1
+
+    assert storage.get_by_id('1') == DOCUMENTS[1]
+    assert storage.get_by_id('none') is None
+    assert storage.get_by_id(8) == {'id': 8, 'text': 'int uuid'}
+    assert storage.get_by_id('8') is None
+    assert storage.get_by_ids(['3', 'none', '0', '3']) == \
+        [DOCUMENTS[3], None, DOCUMENTS[0], DOCUMENTS[3]]
+    assert storage.get_by_ids([]) == []
+
+    uuids = [f'bulk-{idx}' for idx in range(2000)]
+    storage.add_documents({'id': uuid, 'text': uuid} for uuid in uuids)
+    assert [doc['text'] for doc in storage.get_by_ids(uuids)] == uuids
+
+
+def test_sqlite_storage_threads(storage):
+    storage.add_documents(DOCUMENTS)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(storage.get_by_id, [doc['id'] for doc in DOCUMENTS] * 4))
+
+    assert results == DOCUMENTS * 4
+
+    # 线程结束后其连接被关闭，只保留当前线程的连接
+    threads = [threading.Thread(target=storage.get_by_id, args=('0',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(storage._connections) == 1
+    assert storage.get_by_id('0') == DOCUMENTS[0]
+
+
+def test_memory_storage_get_by_ids():
+    storage = MemoryDocumentStorage('id')
+    assert storage.add_documents(DOCUMENTS + DOCUMENTS[:1]) == len(DOCUMENTS)
+    assert storage.get_by_ids(['2', 'none']) == [DOCUMENTS[2], None]
+
+
+def test_cached_storage(storage):
+    storage.add_documents(DOCUMENTS[:4])
+    cached = CachedStorage(storage, maxsize=3)
+    assert cached.get_by_id('0') == DOCUMENTS[0]
+    assert cached.get_by_id('0') == DOCUMENTS[0]
+    assert cached.get_by_id('none') is None
+    assert storage.single_gets == 2
+
+    assert cached.get_by_ids(['0', '1', '2', 'none', '1']) == \
+        [DOCUMENTS[0], DOCUMENTS[1], DOCUMENTS[2], None, DOCUMENTS[1]]
+    assert storage.multi_gets == 1
+    assert cached.get_by_ids(['0', '1', '2']) == DOCUMENTS[:3]
+    assert storage.multi_gets == 1
+
+    # 写入的文档同时进入缓存，淘汰最久未使用的文档
+    assert cached.add_document(DOCUMENTS[4])
+    assert not cached.add_document(DOCUMENTS[4])
+    assert cached.get_by_id('4') == DOCUMENTS[4]
+    assert storage.single_gets == 2
+    assert cached.stats == {'size': 3, 'weight': 3, 'hits': 6, 'misses': 6, 'evictions': 1}
+
+    assert cached.add_documents(DOCUMENTS[4:]) == len(DOCUMENTS) - 5
+    assert cached.get_by_ids([doc['id'] for doc in DOCUMENTS]) == DOCUMENTS
+    assert len(storage) == len(DOCUMENTS)
+
+
+def test_cached_storage_bytes():
+    backend = MemoryDocumentStorage('id')
+    backend.add_documents(DOCUMENTS)
+    max_bytes = approximate_size(DOCUMENTS[0]) * 2
+    cached = CachedStorage(backend, max_bytes=max_bytes)
+    assert cached.get_by_ids([doc['id'] for doc in DOCUMENTS]) == DOCUMENTS
+    assert 0 < cached.stats['weight'] <= max_bytes and cached.stats['size'] < len(DOCUMENTS)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(cached.get_by_id, [doc['id'] for doc in DOCUMENTS] * 50))
+    assert results == DOCUMENTS * 50
+
+
+class BlockingStorage(MemoryDocumentStorage):
+
+    """读取到文档后等待 resume，用于在读取期间从其他线程写入"""
+
+    def __init__(self, uuid_field):
+        super().__init__(uuid_field)
+        self.fetched = threading.Event()
+        self.resume = threading.Event()
+
+    def get_by_id(self, uuid):
+        document = super().get_by_id(uuid)
+        self.fetched.set()
+        self.resume.wait(5)
+        return document
+
+    def get_by_ids(self, uuids, fields=None):
+        return project([self.get_by_id(uuid) for uuid in uuids], fields)
+
+
+@pytest.mark.parametrize('method', ['get_by_id', 'get_by_ids'])
+@pytest.mark.parametrize('write', ['update', 'delete'])
+def test_cached_storage_read_write_race(method, write):
+    backend = BlockingStorage('id')
+    backend.add_document({'id': '0', 'text': 'old'})
+    cached = CachedStorage(backend)
+
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(getattr(cached, method), '0' if method == 'get_by_id' else ['0'])
+        assert backend.fetched.wait(5)
+        if write == 'update':
+            cached.update_document({'id': '0', 'text': 'new'})
+        else:
+            assert cached.delete_document('0')
+        backend.resume.set()
+        future.result()
+
+    # 读取期间被写入的旧文档不会放入缓存
+    expected = {'id': '0', 'text': 'new'} if write == 'update' else None
+    assert cached.get_by_id('0') == expected
+    assert cached.get_by_ids(['0']) == [expected]
+    assert not cached._fetching
+
+
+def test_cached_storage_copies(storage):
+    cached = CachedStorage(storage)
+    document = {'id': '0', 'text': '今天天气真好'}
+    assert cached.add_document(document)
+    document['text'] = '修改后的文档'
+    assert cached.get_by_id('0') == {'id': '0', 'text': '今天天气真好'}
+
+    cached.update_document(document)
+    document['text'] = '再次修改'
+    assert cached.get_by_id('0') == {'id': '0', 'text': '修改后的文档'}
+    assert storage.single_gets == 0
+
+
+def test_log_file_storage(tmp_path):
+    path = join(tmp_path, 'docs.log')
+    storage = LogFileStorage('id', path)
+    assert storage.add_documents(DOCUMENTS) == len(DOCUMENTS)
+    assert not storage.add_document(DOCUMENTS[0])
+    assert storage.add_document({'id': 8, 'text': 'int uuid'})
+    assert storage.get_by_id('3') == DOCUMENTS[3]
+    assert storage.get_by_id(8) == {'id': 8, 'text': 'int uuid'}
+    assert storage.get_by_id('8') is None
+    assert storage.get_by_ids(['5', 'none', '1']) == [DOCUMENTS[5], None, DOCUMENTS[1]]
+
+    storage.update_document({'id': '1', 'text': '更新后的文档'})
+    assert storage.delete_document('2')
+    assert not storage.delete_document('2')
+    assert storage.get_by_id('1') == {'id': '1', 'text': '更新后的文档'}
+    assert storage.get_by_id('2') is None and len(storage) == len(DOCUMENTS)
+    storage.close()
+
+    expected = {doc['id']: doc for doc in DOCUMENTS if doc['id'] != '2'}
+    expected.update({'1': {'id': '1', 'text': '更新后的文档'}, 8: {'id': 8, 'text': 'int uuid'}})
+
+    # 从偏移量索引恢复，并扫描之后追加的记录
+    storage = LogFileStorage('id', path)
+    assert storage.get_by_ids(list(expected)) == list(expected.values())
+    storage.update_document({'id': '3', 'text': '再次更新'})
+    storage._file.flush()
+    expected['3'] = {'id': '3', 'text': '再次更新'}
+    reopened = LogFileStorage('id', path)
+    assert reopened.get_by_ids(list(expected)) == list(expected.values())
+    reopened.close()
+    storage.close()
+
+    # 没有偏移量索引时扫描整个数据文件，末尾不完整的记录被截断
+    os.remove(f'{path}.idx')
+    with open(path, 'ab') as fout:
+        fout.write(b'\x00\xff\x00')
+    storage = LogFileStorage('id', path)
+    assert storage.get_by_ids(list(expected)) == list(expected.values())
+    assert storage.add_document({'id': '9', 'text': 'new'})
+    assert storage.get_by_id('9') == {'id': '9', 'text': 'new'}
+    expected['9'] = {'id': '9', 'text': 'new'}
+
+    size, garbage = os.path.getsize(path), storage.garbage
+    assert storage.compact() == garbage > 0
+    assert os.path.getsize(path) == size - garbage and storage.garbage == 0
+    assert storage.get_by_ids(list(expected)) == list(expected.values())
+    storage.close()
+
+    storage = LogFileStorage('id', path)
+    assert storage.get_by_ids(list(expected)) == list(expected.values())
+    assert storage.garbage == 0
+    assert storage.delete_document(8)
+    storage.close()
+
+    del expected[8]
+    storage = LogFileStorage('id', path)
+    assert storage.get_by_ids(list(expected)) == list(expected.values())
+    storage.close()
+
+
+def test_log_file_storage_compact_crash(tmp_path, monkeypatch):
+    path = join(tmp_path, 'docs.log')
+    storage = LogFileStorage('id', path)
+    storage.add_documents(DOCUMENTS)
+    storage.flush()
+    storage.update_document({'id': '1', 'text': '更新后的文档'})
+    storage.add_document({'id': '9', 'text': 'new'})
+    with open(f'{path}.idx', 'rb') as fin:
+        stale_index = fin.read()
+
+    expected = {doc['id']: doc for doc in DOCUMENTS}
+    expected.update({'1': {'id': '1', 'text': '更新后的文档'}, '9': {'id': '9', 'text': 'new'}})
+
+    # 替换数据文件后、写入偏移量索引前崩溃
+    def crash():
+        raise OSError('crash')
+
+    monkeypatch.setattr(storage, '_write_sidecar', crash)
+    with pytest.raises(OSError):
+        storage.compact()
+    assert not os.path.exists(f'{path}.idx')
+    size = os.path.getsize(path)
+
+    reopened = LogFileStorage('id', path)
+    assert reopened.get_by_ids(list(expected)) == list(expected.values())
+    reopened._close_files()
+
+    # 即使旧的偏移量索引仍然存在，nonce 不一致时也不会使用它，数据文件不会被截断
+    with open(f'{path}.idx', 'wb') as fout:
+        fout.write(stale_index)
+    reopened = LogFileStorage('id', path)
+    assert os.path.getsize(path) == size
+    assert reopened.get_by_ids(list(expected)) == list(expected.values())
+    reopened.close()
+
+    reopened = LogFileStorage('id', path)
+    assert reopened.get_by_ids(list(expected)) == list(expected.values())
+    reopened.close()
+
+
+def test_columnar_storage():
+    storage = ColumnarDocumentStorage(dict(SCHEMA, score={'type': 'float'}))
+    assert storage.add_documents(DOCUMENTS) == len(DOCUMENTS)
+    assert not storage.add_document(DOCUMENTS[0])
+    assert storage.add_document({'id': 'x', 'text': DOCUMENTS[0]['text'], 'score': 0.5})
+    assert len(storage) == len(DOCUMENTS) + 1
+
+    document = storage.get_by_id('3')
+    assert document == DOCUMENTS[3] and dict(document) == DOCUMENTS[3]
+    assert document['cnt'] == 0 and 'score' not in document
+    with pytest.raises(TypeError):
+        document['cnt'] = 1
+    assert pickle.loads(pickle.dumps(document)) == DOCUMENTS[3]
+    assert storage.get_by_id('x') == {'id': 'x', 'text': DOCUMENTS[0]['text'], 'score': 0.5}
+    assert storage.get_by_id('x')['text'] is storage.get_by_id('0')['text']
+    assert storage.get_by_id('none') is None
+
+    assert storage.get_by_ids(['1', 'none']) == [DOCUMENTS[1], None]
+    assert storage.get_by_ids(['1', 'x', 'none'], fields=['text', 'score']) == \
+        [{'text': DOCUMENTS[1]['text']}, {'text': DOCUMENTS[0]['text'], 'score': 0.5}, None]
+    with pytest.raises(FieldNotExistsError):
+        storage.get_by_ids(['1'], fields=['unknown'])
+    with pytest.raises(ValueError):
+        storage.add_document({'id': 'y', 'unknown': 1})
+    with pytest.raises(ValueError):
+        storage.add_document({'id': 'y', 'cnt': 'not int'})
+    with pytest.raises(ValueError):
+        storage.add_document({'id': 'y', 'text': '溢出', 'cnt': 2 ** 64})
+    assert storage.get_by_id('y') is None
+    assert len({len(column) for column in storage.columns.values()}) == 1
+    assert storage.add_document({'id': 'z', 'cnt': 2 ** 63 - 1})
+    assert storage.get_by_id('z') == {'id': 'z', 'cnt': 2 ** 63 - 1}
+
+    index = InvertedIndex(SCHEMA)
+    index.add_documents(DOCUMENTS)
+    memory = MemoryDocumentStorage('id')
+    memory.add_documents(DOCUMENTS)
+    assert index.retrieve(storage, '今天天气', 'text', limit=3) == \
+        index.retrieve(memory, '今天天气', 'text', limit=3)
+
+
+@pytest.mark.parametrize('forward_index', [True, False])
+def test_index_multi_get(storage, forward_index, monkeypatch):
+    index, memory = InvertedIndex(SCHEMA, forward_index=forward_index), MemoryDocumentStorage('id')
+    index.add_documents(DOCUMENTS)
+    storage.add_documents(DOCUMENTS)
+    memory.add_documents(DOCUMENTS)
+
+    for rank_metric in ('jaccard', 'cosine', 'bm25'):
+        storage.single_gets = storage.multi_gets = 0
+        results = index.retrieve(storage, '今天天气', 'text', limit=3, rank_metric=rank_metric)
+        assert results == index.retrieve(memory, '今天天气', 'text', limit=3,
+                                         rank_metric=rank_metric)
+        # 没有正排索引时 cosine 需要获取候选文档的原文，候选文档按窗口批量获取，返回的文档已在其中
+        assert (storage.single_gets, storage.multi_gets) == (0, 1)
+
+    # 候选文档超过一个窗口时分多次获取
+    monkeypatch.setattr(InvertedIndex, 'FETCH_WINDOW', 3)
+    storage.single_gets = storage.multi_gets = 0
+    results = index.retrieve(storage, '天气', 'text', rank_metric='lcs')
+    assert results == index.retrieve(memory, '天气', 'text', rank_metric='lcs')
+    assert storage.single_gets == 0
+    assert storage.multi_gets == (1 if forward_index else 3)
+
+    storage.single_gets = storage.multi_gets = 0
+    assert index.match_on_field(storage, 'text', '今天') == [DOCUMENTS[6]]
+    assert index.match_range(storage, 'cnt', 2) == [DOCUMENTS[2], DOCUMENTS[5]]
+    assert (storage.single_gets, storage.multi_gets) == (0, 2)
+
+
+def test_storage_fields(storage, tmp_path):
+    documents = DOCUMENTS + [{'id': 'nested', 'text': None, 'tags': ['a', 'b'], 'ok': True}]
+    expected = [{'text': DOCUMENTS[1]['text']}, None, {'tags': ['a', 'b'], 'ok': True}]
+    log_storage = LogFileStorage('id', join(tmp_path, 'docs.log'))
+    memory = MemoryDocumentStorage('id')
+    for backend in (storage, log_storage, memory, CachedStorage(memory)):
+        backend.add_documents(documents)
+        assert backend.get_by_ids(['1', 'none', 'nested'], fields=['tags', 'ok', 'text'])[:2] == \
+            expected[:2]
+        assert backend.get_by_ids(['nested'], fields=['tags', 'ok']) == expected[2:]
+        assert backend.get_by_ids(['nested'], fields=['text']) == [{'text': None}]
+    log_storage.close()
+
+
+def test_storage_update_delete(storage, tmp_path):
+    log_storage = LogFileStorage('id', join(tmp_path, 'docs.log'))
+    memory = MemoryDocumentStorage('id')
+    backends = [storage, log_storage, memory, CachedStorage(MemoryDocumentStorage('id')),
+                ColumnarDocumentStorage(SCHEMA)]
+    updated = {'id': '1', 'text': '更新后的文档', 'cnt': 5}
+    for backend in backends:
+        backend.add_documents(DOCUMENTS)
+        backend.update_document(updated)
+        backend.update_document({'id': 'new', 'text': '新文档'})
+        assert backend.get_by_ids(['1', 'new', '2']) == \
+            [updated, {'id': 'new', 'text': '新文档'}, DOCUMENTS[2]]
+        assert backend.delete_document('2')
+        assert not backend.delete_document('2')
+        assert backend.get_by_id('2') is None
+        assert backend.add_document(DOCUMENTS[2])
+        assert backend.get_by_id('2') == DOCUMENTS[2]
+        if hasattr(backend, '__len__'):
+            assert len(backend) == len(DOCUMENTS) + 1
+    log_storage.close()
+
+
+def test_index_fields(storage):
+    index = InvertedIndex(SCHEMA)
+    index.add_documents(DOCUMENTS)
+    storage.add_documents(DOCUMENTS)
+
+    results = index.retrieve(storage, '今天天气', 'text', limit=3)
+    projected = index.retrieve(storage, '今天天气', 'text', limit=3, fields=['cnt'])
+    assert projected == [
+        {'document': {'cnt': ret['document']['cnt']}, 'score': ret['score']} for ret in results
+    ]
+    storage.single_gets = storage.multi_gets = 0
+    assert index.retrieve(storage, '今天天气', 'text', limit=3, return_documents=False) == [
+        {'uuid': ret['document']['id'], 'score': ret['score']} for ret in results
+    ]
+    assert index.retrieve_batch(storage, ['今天天气'], 'text', limit=3,
+                                return_documents=False)[0][0]['uuid'] == '0'
+    assert index.retrieve(storage, 2, 'cnt', return_documents=False) == [
+        {'uuid': '2', 'score': 1.0}, {'uuid': '5', 'score': 1.0}
+    ]
+    assert (storage.single_gets, storage.multi_gets) == (0, 0)
+
+    assert index.match_on_field(storage, 'text', '今天', fields=['cnt']) == [{'cnt': 0}]
+    assert index.match_on_field(storage, 'text', '今天', return_documents=False) == ['6']
+    assert index.match_on_field(storage, 'cnt', 1, fields=['id']) == [
+        {'id': '1'}, {'id': '4'}, {'id': '7'}
+    ]
+
+    index = InvertedIndex(dict(SCHEMA, id={'type': 'str', 'uuid': True}))
+    index.add_documents(DOCUMENTS)
+    assert index.match_on_field(storage, 'id', '3', fields=['cnt']) == [{'cnt': 0}]
+    assert index.match_on_field(storage, 'id', '3', return_documents=False) == ['3']
+    assert index.match_on_field(storage, 'id', 'none', return_documents=False) == []
@@ -1,5 +1,6 @@
 import re
 
+from more_itertools import windowed
 import pytest
 import regex
 
@@ -9,7 +10,24 @@ from zhtools.tokenize import (
     register_tokenizer,
     NgramTokenizer,
 )
-from zhtools.tokenize.token import Token
+from zhtools.tokenize.token import Token, TokenStream
+
+
+def test_token():
+    token = Token('天气', 2, 4)
+    assert token == Token('天气', 2, 4)
+    assert token != Token('天气', 3, 5)
+    assert token != ('天气', 2, 4)
+    assert not hasattr(token, '__dict__')
+
+    stream = TokenStream(['今天', '天气'], [0, 2], [2, 4])
+    assert len(stream) == 2
+    assert stream[1] == token
+    assert list(stream) == [Token('今天', 0, 2), token]
+    assert stream[1:] == TokenStream.from_tokens([token])
+    assert stream.starts.typecode == 'i'
+    with pytest.raises(ValueError):
+        TokenStream(['今天'], [0, 2], [2, 4])
 
 
 def test_get_tokenizer():
@@ -68,18 +86,40 @@ def test_ngram_tokenization():
     assert list(tokenizer.tokenize(text)) == tokens
     assert list(tokenizer.cut(text)) == words
     assert tokenizer.lcut(text) == words
+    assert tokenizer.cut_batch([text, '', text]) == [words, [], words]
     assert list(tokenizer(text)) == tokens
+    assert list(tokenizer.tokenize_stream(text)) == tokens
+
+
+@pytest.mark.parametrize('level, step', [(1, 1), (2, 1), (3, 1), (3, 2), (4, 3)])
+@pytest.mark.parametrize('filter_pattern', [r'^.*?[\p{P}\s].*?$', r'.*\s', None])
+def test_ngram_tokenization_windows(level, step, filter_pattern):
+    tokenizer = NgramTokenizer(level=level, step=step, filter_pattern=filter_pattern)
+    pattern = regex.compile(filter_pattern) if filter_pattern else None
+    for text in ['', '你', '你好', '你好啊！吃过了没有？', 'Hello, 世界', '第一行\n\n第二行 ok']:
+        lowered = text.lower()
+        expected = []
+        for idx, chars in enumerate(windowed(lowered, level, step=step, fillvalue='')):
+            term, start = ''.join(chars), idx * step
+            if not pattern or not pattern.match(term):
+                expected.append(Token(term, start, min(start + level, len(text))))
+
+        assert list(tokenizer.tokenize(text)) == expected
+        assert tokenizer.lcut(text) == [token.word for token in expected]
+        assert tokenizer.tokenize_stream(text) == TokenStream.from_tokens(expected)
 
 
 def test_space_tokenization():
     tokenizer = get_tokenizer('space')
-    text = 'hello world'
-    tokens = [Token('hello', 0, 5), Token('world', 6, 11)]
+    text = 'hello  world\n'
+    tokens = [Token('hello', 0, 5), Token('world', 7, 12)]
     words = ['hello', 'world']
     assert list(tokenizer.tokenize(text)) == tokens
     assert list(tokenizer.cut(text)) == words
     assert tokenizer.lcut(text) == words
+    assert tokenizer.cut_batch([text, '', text]) == [words, [], words]
     assert list(tokenizer(text)) == tokens
+    assert list(tokenizer.tokenize_stream(text)) == tokens
 
 
 def test_jieba_tokenizer():
@@ -96,7 +136,9 @@ def test_jieba_tokenizer():
     assert list(tokenizer.tokenize(text)) == tokens
     assert list(tokenizer.cut(text)) == words
     assert tokenizer.lcut(text) == words
+    assert tokenizer.cut_batch([text, '', text]) == [words, [], words]
     assert list(tokenizer(text)) == tokens
+    assert list(tokenizer.tokenize_stream(text)) == tokens
 
 
 def test_pku_tokenizer():
@@ -113,7 +155,9 @@ def test_pku_tokenizer():
     assert list(tokenizer.tokenize(text)) == tokens
     assert list(tokenizer.cut(text)) == words
     assert tokenizer.lcut(text) == words
+    assert tokenizer.cut_batch([text, '', text]) == [words, [], words]
     assert list(tokenizer(text)) == tokens
+    assert list(tokenizer.tokenize_stream(text)) == tokens
 
 
 @pytest.mark.usefixtures('mock_corenlp_post')
@@ -131,4 +175,16 @@ def test_corenlp_tokenizer():
     assert list(tokenizer.tokenize(text)) == tokens
     assert list(tokenizer.cut(text)) == words
     assert tokenizer.lcut(text) == words
+    assert tokenizer.cut_batch([text, '', text]) == [words, [], words]
     assert list(tokenizer(text)) == tokens
+    assert list(tokenizer.tokenize_stream(text)) == tokens
+
+
+@pytest.mark.usefixtures('mock_corenlp_post')
+def test_corenlp_tokenizer_batch():
+    tokenizer = get_tokenizer('corenlp', url="http://127.0.0.1:8000")
+    texts = ['今天的天气真好', '明天下雨', '', '今天的天气真好']
+    assert tokenizer.cut_batch(texts) == [
+        ['今天', '的', '天气', '真', '好'], ['明天', '下雨'], [], ['今天', '的', '天气', '真', '好']
+    ]
+    assert tokenizer.cut_batch([]) == []
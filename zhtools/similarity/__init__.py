@@ -4,12 +4,24 @@ from zhtools.metric.similarity import cosine, dice, jaccard, lcs
 from zhtools.tokenize import get_tokenizer
 
 
-__all__ = ["compute_similarity"]
+__all__ = ["compute_similarity", "compute_terms_similarity"]
 
 
 def compute_similarity(first, second, method='jaccard', tokenizer=None,
                        partial=False, ngram_range=None, ngram_weights=None):
     assert isinstance(first, str) and isinstance(second, str)
+
+    tokenizer = tokenizer or get_tokenizer("ngram", level=1)
+
+    first_terms = tokenizer.lcut(first)
+    second_terms = tokenizer.lcut(second)
+    return compute_terms_similarity(first_terms, second_terms, method=method, partial=partial,
+                                    ngram_range=ngram_range, ngram_weights=ngram_weights)
+
+
+def compute_terms_similarity(first_terms, second_terms, method='jaccard',
+                             partial=False, ngram_range=None, ngram_weights=None):
+    """计算两个已切分好的 term 序列的相似度，term 可以是任意可哈希的值，如 term id"""
     if not ngram_range:
         ngram_range = [1]
         ngram_weights = [1.0]
@@ -23,11 +35,6 @@ def compute_similarity(first, second, method='jaccard', tokenizer=None,
     if not metric_func:
         raise ValueError("unsupported method `{}`".format(method))
 
-    tokenizer = tokenizer or get_tokenizer("ngram", level=1)
-
-    first_terms = tokenizer.lcut(first)
-    second_terms = tokenizer.lcut(second)
-
     similarity = 0.0
     ngram_levels = list(range(ngram_range[0], ngram_range[-1] + 1))
     if not ngram_weights:
@@ -1,4 +1,4 @@
-from .token import Token
+from .token import Token, TokenStream
 from .base import (
     register_tokenizer,
     Tokenizer,
@@ -14,6 +14,7 @@ from .ext import (
 
 __all__ = [
     'Token',
+    'TokenStream',
     'register_tokenizer',
     'Tokenizer',
     'get_tokenizer',
@@ -1,18 +1,23 @@
 from abc import ABC, abstractmethod
+from array import array
+from itertools import accumulate
 import json
 import logging
 from typing.re import Pattern
 
 import regex
-from more_itertools import windowed
 
-from .token import Token
+from .token import Token, TokenStream
 from .utils import align_tokens
 
 
 LOGGER = logging.getLogger(__name__)
 _TOKENIZER_CLS_MAP = {}
 
+DEFAULT_FILTER_PATTERN = r'^.*?[\p{P}\s].*?$'
+_DEFAULT_FILTER_KEY = (DEFAULT_FILTER_PATTERN, regex.compile(DEFAULT_FILTER_PATTERN).flags)
+_PUNCT_OR_SPACE = regex.compile(r'[\p{P}\s]')
+
 
 def register_tokenizer(name):
     def wrap(cls):
@@ -59,12 +64,21 @@ class Tokenizer(ABC):
         raise NotImplementedError
 
     def cut(self, text):
+        """只返回词，子类可以覆盖该方法以跳过计算词的位置及创建 Token"""
         for token in self.tokenize(text):
             yield token.word
 
     def lcut(self, text):
         return list(self.cut(text))
 
+    def cut_batch(self, texts):
+        """切分多个文本，返回与 texts 一一对应的词列表"""
+        return [self.lcut(text) for text in texts]
+
+    def tokenize_stream(self, text):
+        """返回 TokenStream，子类可以覆盖该方法以避免为每个词创建 Token"""
+        return TokenStream.from_tokens(self.tokenize(text))
+
     def __call__(self, text):
         return self.tokenize(text)
 
@@ -72,7 +86,13 @@ class Tokenizer(ABC):
 @register_tokenizer('ngram')
 class NgramTokenizer(Tokenizer):
 
-    def __init__(self, level=3, step=1, lowercase=True, filter_pattern=r'^.*?[\p{P}\s].*?$'):
+    """按字符切分 n-gram，默认丢弃包含标点或空白字符的 n-gram
+
+    使用默认的 filter_pattern 时，不对每个 n-gram 进行正则匹配，而是预先标记文本中的标点及空白字符，
+    通过前缀和判断 n-gram 中是否包含它们；cut/lcut 直接返回切片得到的字符串，不创建 Token。
+    """
+
+    def __init__(self, level=3, step=1, lowercase=True, filter_pattern=DEFAULT_FILTER_PATTERN):
         self.level = level
         self.step = step
         self.lowercase = lowercase
@@ -85,17 +105,72 @@ class NgramTokenizer(Tokenizer):
             else:
                 raise ValueError("invalid filter pattern: {}".format(filter_pattern))
 
+        # 使用默认的 filter_pattern 时通过标点及空白字符的前缀和过滤 n-gram
+        self._mask_filter = isinstance(self.filter_pattern, regex.regex.Pattern) and \
+            (self.filter_pattern.pattern, self.filter_pattern.flags) == _DEFAULT_FILTER_KEY
+
+    def _starts(self, length):
+        """n-gram 的起始位置，与 windowed(text, level, step, fillvalue='') 的窗口一致"""
+        level, step = self.level, self.step
+        if length < level:
+            return range(1 if length else 0)
+
+        last = (length - level) // step * step
+        # 最后一个完整的窗口未覆盖到文本末尾时，还有一个不足 level 的窗口
+        if last + level < length and last + step < length:
+            last += step
+        return range(0, last + 1, step)
+
+    def _kept_starts(self, text):
+        """返回未被过滤的 n-gram 的起始位置，n-gram 为 text[start:start + level]"""
+        level, length = self.level, len(text)
+        starts = self._starts(length)
+        if self.filter_pattern is None:
+            return starts
+
+        # 默认的正则中 `.` 不匹配换行符，包含多个换行符的 n-gram 可能不被过滤，这时仍逐个匹配
+        if not self._mask_filter or (level > 2 and '\n' in text):
+            kept = []
+            for start in starts:
+                if self.filter_pattern.match(text[start:start + level]):
+                    LOGGER.debug("term is dropped by filter pattern: %s", text[start:start + level])
+                    continue
+                kept.append(start)
+            return kept
+
+        mask = bytearray(length + level)
+        for match in _PUNCT_OR_SPACE.finditer(text):
+            mask[match.start()] = 1
+        if not any(mask):
+            return starts
+
+        # counts[i] 为 text[:i] 中标点及空白字符的数量，末尾补齐 level 个位置以处理不足 level 的窗口
+        counts = [0, *accumulate(mask)]
+        return [start for start in starts if counts[start + level] == counts[start]]
+
     def tokenize(self, text):
         text = text if not self.lowercase else text.lower()
-        for idx, chars in enumerate(windowed(text, self.level, step=self.step, fillvalue='')):
-            term = ''.join(chars)
-            if self.filter_pattern and self.filter_pattern.match(term):
-                LOGGER.debug("term is dropped by filter pattern: %s", term)
-                continue
+        level, length = self.level, len(text)
+        for start in self._kept_starts(text):
+            yield Token(text[start:start + level], start, min(start + level, length))
+
+    def cut(self, text):
+        return iter(self.lcut(text))
+
+    def lcut(self, text):
+        text = text if not self.lowercase else text.lower()
+        level = self.level
+        return [text[start:start + level] for start in self._kept_starts(text)]
 
-            start = idx * self.step
-            end = min(start + self.level, len(text))
-            yield Token(term, start, end)
+    def tokenize_stream(self, text):
+        text = text if not self.lowercase else text.lower()
+        level, length = self.level, len(text)
+        starts = array('i', self._kept_starts(text))
+        # 只有最后一个 n-gram 可能不足 level 个字符
+        ends = array('i', (start + level for start in starts))
+        if ends and ends[-1] > length:
+            ends[-1] = length
+        return TokenStream([text[start:start + level] for start in starts], starts, ends)
 
 
 @register_tokenizer('space')
@@ -108,3 +183,14 @@ class SpaceTokenizer(Tokenizer):
         words = text.split()
         for word, span in zip(words, align_tokens(words, text)):
             yield Token(word, span[0], span[1])
+
+    def cut(self, text):
+        return iter(text.split())
+
+    def lcut(self, text):
+        return text.split()
+
+    def tokenize_stream(self, text):
+        words = text.split()
+        spans = align_tokens(words, text)
+        return TokenStream(words, (start for start, _ in spans), (end for _, end in spans))
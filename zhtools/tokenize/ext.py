@@ -1,8 +1,10 @@
+from array import array
+from bisect import bisect_right
 from os import path
 
 import requests
 
-from .token import Token
+from .token import Token, TokenStream
 from .utils import align_tokens
 from .base import register_tokenizer, Tokenizer
 
@@ -24,6 +26,24 @@ class JiebaTokenizer(Tokenizer):
             if word.strip():
                 yield Token(word, start, end)
 
+    def cut(self, text):
+        for word in self._tokenizer.cut(text):
+            if word.strip():
+                yield word
+
+    def tokenize_stream(self, text):
+        words, starts, ends = [], array('i'), array('i')
+        start = 0
+        for word in self._tokenizer.cut(text):
+            end = start + len(word)
+            if word.strip():
+                words.append(word)
+                starts.append(start)
+                ends.append(end)
+            start = end
+
+        return TokenStream(words, starts, ends)
+
 
 @register_tokenizer('pku')
 class PKUTokenizer(Tokenizer):
@@ -37,29 +57,73 @@ class PKUTokenizer(Tokenizer):
         for word, span in zip(words, align_tokens(words, text)):
             yield Token(word, span[0], span[1])
 
+    def cut(self, text):
+        return iter(self._tokenizer.cut(text))
+
+    def lcut(self, text):
+        return self._tokenizer.cut(text)
+
+    def tokenize_stream(self, text):
+        words = self._tokenizer.cut(text)
+        spans = align_tokens(words, text)
+        return TokenStream(words, (start for start, _ in spans), (end for _, end in spans))
+
 
 @register_tokenizer('corenlp')
 class CoreNLPTokenizer(Tokenizer):
 
+    SEPARATOR = '\n\n'
+
     def __init__(self, url, annotators='ssplit,tokenize', lang='zh'):
         self.url = url
         self.annotators = annotators
         self.lang = lang
 
-    def tokenize(self, text):
+    def _annotate(self, text, extra_properties=None):
         properties = {
             'annotators': self.annotators,
             'pipelineLanguage': self.lang,
             'outputFormat': 'json'
         }
+        properties.update(extra_properties or {})
         params = {'properties': str(properties)}
         data = text.encode('utf-8')
         headers = {'Connection': 'close'}
         response = requests.post(self.url, params=params, data=data, headers=headers)
         for sentence in response.json().get('sentences', []):
-            for token in sentence['tokens']:
-                yield Token(
-                    token['originalText'],
-                    token['characterOffsetBegin'],
-                    token['characterOffsetEnd'],
-                )
+            yield from sentence['tokens']
+
+    def tokenize(self, text):
+        for token in self._annotate(text):
+            yield Token(
+                token['originalText'],
+                token['characterOffsetBegin'],
+                token['characterOffsetEnd'],
+            )
+
+    def cut(self, text):
+        for token in self._annotate(text):
+            yield token['originalText']
+
+    def cut_batch(self, texts):
+        """将所有文本以空行连接后只请求一次，按词的位置将结果分配回各个文本"""
+        texts = list(texts)
+        if not texts:
+            return []
+
+        # CoreNLP 返回的位置以 UTF-16 编码单元计算
+        starts, offset = [], 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text.encode('utf-16-le')) // 2 + len(self.SEPARATOR)
+
+        results = [[] for _ in texts]
+        tokens = self._annotate(
+            self.SEPARATOR.join(texts), {'ssplit.newlineIsSentenceBreak': 'two'}
+        )
+        for token in tokens:
+            results[bisect_right(starts, token['characterOffsetBegin']) - 1].append(
+                token['originalText']
+            )
+
+        return results
@@ -1,5 +1,10 @@
+from array import array
+
+
 class Token():
 
+    __slots__ = ('word', 'start', 'end')
+
     def __init__(self, word, start, end):
         self.word = word
         self.start = start
@@ -15,4 +20,59 @@ class Token():
         if not isinstance(other, Token):
             return False
 
-        return self.__dict__ == other.__dict__
+        return (self.word, self.start, self.end) == (other.word, other.start, other.end)
+
+
+class TokenStream():
+
+    """一个文本的切分结果，词保存在 list 中，起止位置分别保存在 array 中，不为每个词创建 Token
+
+    Parameters
+    ----------
+    words: list
+        切分得到的词
+    starts: iterable
+        每个词在文本中的起始位置
+    ends: iterable
+        每个词在文本中的结束位置
+    """
+
+    __slots__ = ('words', 'starts', 'ends')
+
+    def __init__(self, words, starts, ends):
+        self.words = words
+        self.starts = starts if isinstance(starts, array) else array('i', starts)
+        self.ends = ends if isinstance(ends, array) else array('i', ends)
+        if not len(self.words) == len(self.starts) == len(self.ends):
+            raise ValueError("words, starts and ends must have the same length")
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        words, starts, ends = [], array('i'), array('i')
+        for token in tokens:
+            words.append(token.word)
+            starts.append(token.start)
+            ends.append(token.end)
+
+        return cls(words, starts, ends)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return TokenStream(self.words[idx], self.starts[idx], self.ends[idx])
+
+        return Token(self.words[idx], self.starts[idx], self.ends[idx])
+
+    def __iter__(self):
+        return map(Token, self.words, self.starts, self.ends)
+
+    def __eq__(self, other):
+        if not isinstance(other, TokenStream):
+            return False
+
+        return (self.words, self.starts, self.ends) == (other.words, other.starts, other.ends)
+
+    def __repr__(self):
+        return f'<TokenStream {len(self)} tokens>'
@@ -1,9 +1,23 @@
+from .columnar_storage import ColumnarDocumentStorage
 from .inverted_index import InvertedIndex
+from .log_storage import LogFileStorage
+from .minhash_index import MinHashIndex
+from .sharded_index import ShardedInvertedIndex
 from .storage import (
+    AsyncStorage,
+    CachedStorage,
     MemoryDocumentStorage,
+    SQLiteDocumentStorage,
 )
 
 __all__ = [
     'InvertedIndex',
+    'ShardedInvertedIndex',
+    'MinHashIndex',
     'MemoryDocumentStorage',
+    'SQLiteDocumentStorage',
+    'AsyncStorage',
+    'CachedStorage',
+    'LogFileStorage',
+    'ColumnarDocumentStorage',
 ]
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from threading import RLock
+import time
+
+
+class LRUCache():
+
+    """按最近最少使用策略淘汰的缓存，可以限制条目数量及总大小
+
+    Parameters
+    ----------
+    maxsize: int(optional)
+        最多保存的条目数量，不设置则不限制
+    max_weight: int(optional)
+        所有条目大小之和的上限，不设置则不限制
+    weigher: callable(optional)
+        计算条目大小的函数，参数为 key 与 value，默认每个条目大小为 1
+    ttl: float(optional)
+        条目写入后的有效秒数，过期的条目在下次访问时被清除并视为未命中，不设置则不过期
+    timer: callable(optional), default time.monotonic
+        返回当前时间的函数
+    """
+
+    def __init__(self, maxsize=None, max_weight=None, weigher=None, ttl=None,
+                 timer=time.monotonic):
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda key, value: 1)
+        self.ttl = ttl
+        self.timer = timer
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data and not self._expire(key)
+
+    def _expire(self, key):
+        """条目已过期时将其清除并返回 True"""
+        expires_at = self._data[key][2]
+        if expires_at is None or self.timer() < expires_at:
+            return False
+
+        self.pop(key)
+        return True
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data or self._expire(key):
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        weight = self.weigher(key, value)
+        with self._lock:
+            self.pop(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+
+            expires_at = self.timer() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, weight, expires_at)
+            self.weight += weight
+            while (self.maxsize is not None and len(self._data) > self.maxsize) or \
+                    (self.max_weight is not None and self.weight > self.max_weight):
+                _, (_, evicted_weight, _) = self._data.popitem(last=False)
+                self.weight -= evicted_weight
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+
+            value, weight, _ = self._data.pop(key)
+            self.weight -= weight
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'weight': self.weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
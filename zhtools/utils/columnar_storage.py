@@ -0,0 +1,151 @@
+"""按字段分列保存文档的内存存储
+
+每个字段的值保存在一列中: int/float 字段为 array，str 字段为 list 且值经过 sys.intern，
+重复的字符串只保存一份。文档不再是独立的 dict，get_by_id 返回引用列数据的只读 DocumentRow。
+"""
+from array import array
+from collections.abc import Mapping
+import sys
+
+from zhtools.utils.inverted_index import FieldNotExistsError, FieldType, IndexSchema
+from zhtools.utils.storage import Storage
+
+
+_COLUMN_TYPECODES = {
+    FieldType.INT: 'q',
+    FieldType.FLOAT: 'd',
+}
+_ABSENT = object()
+
+
+class DocumentRow(Mapping):
+
+    """ColumnarDocumentStorage 中一行文档的只读视图，可以像 dict 一样读取字段"""
+
+    __slots__ = ('storage', 'row')
+
+    def __init__(self, storage, row):
+        self.storage = storage
+        self.row = row
+
+    def __getitem__(self, field):
+        if not self.storage.has_value(field, self.row):
+            raise KeyError(field)
+
+        return self.storage.columns[field][self.row]
+
+    def __iter__(self):
+        return (field for field in self.storage.columns if self.storage.has_value(field, self.row))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'DocumentRow({dict(self)!r})'
+
+    def __reduce__(self):
+        # 序列化为 dict，避免连同整个 storage 一起被 pickle
+        return (dict, (dict(self),))
+
+
+class ColumnarDocumentStorage(Storage):
+
+    """
+    Parameters
+    ----------
+    schema: dict or IndexSchema
+        文档的结构定义，同 InvertedIndex，文档只能包含 schema 中定义的字段
+
+    Examples
+    --------
+    In [1]: storage = ColumnarDocumentStorage({"id": {"type": "str", "uuid": True},
+       ...:                                    "content": {"type": "str"}})
+    In [2]: storage.add_document({"id": "1", "content": "今天天气真好"})
+    In [3]: storage.get_by_ids(["1"], fields=["content"])
+    Out[3]: [{'content': '今天天气真好'}]
+    """
+
+    def __init__(self, schema):
+        self.schema = schema if isinstance(schema, IndexSchema) else IndexSchema(schema)
+        self.uuid_field = self.schema.uuid_field
+        self.columns = {
+            field: array(_COLUMN_TYPECODES[info.type]) if info.type in _COLUMN_TYPECODES else []
+            for field, info in self.schema.fields.items()
+        }
+        # 每个字段缺少该字段的行，array 中对应位置以 0 占位
+        self.absent = {field: set() for field in self.schema.fields}
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def has_value(self, field, row):
+        return row not in self.absent[field]
+
+    def add_document(self, document):
+        uuid = document.get(self.uuid_field)
+        if uuid in self.rows:
+            self.schema.validate(document)
+            return False
+
+        self._append_row(document)
+        return True
+
+    def update_document(self, document):
+        """添加或替换文档，被替换的文档的行不再被引用，已获取的 DocumentRow 仍返回旧的值"""
+        self._append_row(document)
+
+    def delete_document(self, uuid):
+        return self.rows.pop(uuid, None) is not None
+
+    def _append_row(self, document):
+        self.schema.validate(document)
+        for field in document:
+            if field not in self.columns:
+                raise ValueError(f"Field `{field}` is not defined in schema")
+
+        # 先转换所有字段的值，超出 array 范围等错误不会留下各列长度不一致的行
+        values = {}
+        for field, column in self.columns.items():
+            if field not in document:
+                values[field] = _ABSENT
+            elif isinstance(column, array):
+                try:
+                    values[field] = array(column.typecode, [document[field]])[0]
+                except OverflowError:
+                    raise ValueError(f"Value of field `{field}` is out of range")
+            else:
+                value = document[field]
+                values[field] = sys.intern(value) if isinstance(value, str) else value
+
+        # 删除及替换的文档的行仍然保留，新的行号为当前的行数
+        row = len(self.columns[self.uuid_field])
+        for field, column in self.columns.items():
+            value = values[field]
+            if value is _ABSENT:
+                self.absent[field].add(row)
+                value = 0 if isinstance(column, array) else None
+            column.append(value)
+        self.rows[document[self.uuid_field]] = row
+
+    def get_by_id(self, uuid):
+        row = self.rows.get(uuid)
+        return DocumentRow(self, row) if row is not None else None
+
+    def get_by_ids(self, uuids, fields=None):
+        """批量获取文档，设置 fields 时返回只包含这些字段的 dict，否则返回 DocumentRow"""
+        rows = [self.rows.get(uuid) for uuid in uuids]
+        if fields is None:
+            return [DocumentRow(self, row) if row is not None else None for row in rows]
+
+        for field in fields:
+            if field not in self.columns:
+                raise FieldNotExistsError(field)
+
+        columns = [(field, self.columns[field], self.absent[field]) for field in fields]
+        return [
+            {
+                field: column[row] for field, column, absent in columns if row not in absent
+            } if row is not None else None
+            for row in rows
+        ]
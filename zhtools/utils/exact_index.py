@@ -0,0 +1,67 @@
+"""InvertedIndex 中 str 字段的精确值索引
+
+字段的原值 -> doc id 的哈希表，用于 match_on_field 的等值查询。值先映射为连续分配的 value id，
+value id 再映射到倒排列表，从索引文件加载时两者分别由 MappedTermDict 和 MappedBlocks 提供。
+"""
+from array import array
+
+from zhtools.utils.postings import POSTING_TYPECODE, new_postings
+
+
+class ExactIndex():
+
+    """
+    Parameters
+    ----------
+    value_ids: Mapping(optional)
+        字段值 -> value id 的映射，用于从已有数据创建索引
+    postings: Mapping(optional)
+        value id -> 升序排列的 doc id 的映射
+    """
+
+    __slots__ = ('value_ids', 'postings')
+
+    def __init__(self, value_ids=None, postings=None):
+        self.value_ids = value_ids if value_ids is not None else dict()
+        self.postings = postings if postings is not None else dict()
+
+    def __len__(self):
+        return len(self.value_ids)
+
+    def add(self, value, docid):
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = self.value_ids[value] = len(self.value_ids)
+
+        postings = self.postings.get(value_id)
+        if postings is None:
+            self.postings[value_id] = new_postings([docid])
+            return
+
+        # 从文件加载的倒排列表为只读的 memoryview，第一次修改时复制为 array
+        if not isinstance(postings, array):
+            postings = self.postings[value_id] = new_postings(postings)
+        postings.append(docid)
+
+    def get(self, value):
+        """返回字段值与 value 相等的文档的 doc id"""
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            return ()
+
+        return self.postings.get(value_id, ())
+
+    def discard(self, docids):
+        """从索引中彻底去除 docids 中的文档，值本身保留在 value_ids 中"""
+        for value_id, postings in list(self.postings.items()):
+            if any(docid in docids for docid in postings):
+                self.postings[value_id] = array(
+                    POSTING_TYPECODE, (docid for docid in postings if docid not in docids)
+                )
+
+    def items(self):
+        """返回 (value, value id, docids)，按 value 的 utf-8 编码排序"""
+        return sorted(
+            (value, value_id, self.postings.get(value_id, ()))
+            for value, value_id in self.value_ids.items()
+        )
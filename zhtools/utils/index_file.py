@@ -0,0 +1,292 @@
+"""InvertedIndex 的二进制索引文件
+
+文件结构如下，各数据段按 8 字节对齐:
+
+    MAGIC(8 bytes) | VERSION(uint32) | HEADER_SIZE(uint32) | HEADER(json) | SECTIONS ...
+
+HEADER 中记录索引的元信息及各数据段相对于数据区起始位置的 offset 和长度，数据段中的
+整数数组以本机字节序保存，字节序同样记录在 HEADER 中。
+
+加载时使用 mmap 映射整个文件，数据段以 memoryview 的形式直接从映射的内存中读取，
+多个进程加载同一个文件时共享操作系统的 page cache。对已加载索引的修改写入内存中的
+overlay，不会修改映射的文件。
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'ZHINDEX\0'
+VERSION = 4
+ALIGNMENT = 8
+
+_PREAMBLE = struct.Struct('<8sII')
+
+
+class IndexFileError(ValueError):
+    pass
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+class IndexFileWriter():
+
+    def __init__(self):
+        self.sections = {}
+
+    def add_section(self, name, data):
+        """添加一个数据段，data 为 array 或 bytes"""
+        if isinstance(data, array):
+            self.sections[name] = (data.typecode, data.tobytes())
+        else:
+            self.sections[name] = ('B', bytes(data))
+
+    def add_string_table(self, name, values):
+        """以 offsets + utf-8 数据的形式保存字符串列表"""
+        offsets, chunks, size = array('Q', [0]), [], 0
+        for value in values:
+            chunk = value.encode('utf-8')
+            chunks.append(chunk)
+            size += len(chunk)
+            offsets.append(size)
+
+        self.add_section(f'{name}.offsets', offsets)
+        self.add_section(f'{name}.data', b''.join(chunks))
+
+    def add_blocks(self, name, blocks):
+        """保存按 key 排序的若干整数数组，blocks 为 (key, values) 的列表"""
+        keys, offsets, data = array('I'), array('Q', [0]), array('I')
+        for key, values in sorted(blocks, key=lambda item: item[0]):
+            keys.append(key)
+            data.extend(values)
+            offsets.append(len(data))
+
+        self.add_section(f'{name}.keys', keys)
+        self.add_section(f'{name}.offsets', offsets)
+        self.add_section(f'{name}.data', data)
+
+    def write(self, filename, header):
+        """写入临时文件后替换目标文件，避免破坏正在被其他进程映射的旧文件"""
+        table, offset = {}, 0
+        for name, (typecode, data) in self.sections.items():
+            table[name] = [offset, len(data), typecode]
+            offset += len(data) + _padding(len(data))
+
+        header = dict(header, byteorder=sys.byteorder, sections=table)
+        header_data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        header_data += b' ' * _padding(_PREAMBLE.size + len(header_data))
+
+        tmp_filename = f'{filename}.tmp'
+        with open(tmp_filename, 'wb') as fout:
+            fout.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_data)))
+            fout.write(header_data)
+            for _, data in self.sections.values():
+                fout.write(data)
+                fout.write(b'\0' * _padding(len(data)))
+
+        os.replace(tmp_filename, filename)
+
+
+class IndexFile():
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fin:
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _PREAMBLE.size:
+            raise IndexFileError(f'Invalid index file: {filename}')
+
+        magic, version, header_size = _PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise IndexFileError(f'Invalid index file: {filename}')
+        if version != VERSION:
+            raise IndexFileError(f'Unsupported index file version: {version}')
+
+        start = _PREAMBLE.size
+        self.header = json.loads(self._mmap[start:start + header_size].decode('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise IndexFileError(f"Index file is in {self.header['byteorder']} endian")
+
+        self._buffer = memoryview(self._mmap)
+        self._data_start = start + header_size
+
+    def section(self, name):
+        offset, size, typecode = self.header['sections'][name]
+        start = self._data_start + offset
+        return self._buffer[start:start + size].cast(typecode)
+
+    def string_table(self, name, decode=None):
+        return StringTable(self.section(f'{name}.offsets'), self.section(f'{name}.data'), decode)
+
+    def blocks(self, name):
+        return MappedBlocks(
+            self.section(f'{name}.keys'),
+            self.section(f'{name}.offsets'),
+            self.section(f'{name}.data'),
+        )
+
+
+class StringTable(Sequence):
+
+    def __init__(self, offsets, data, decode=None):
+        self.offsets = offsets
+        self.data = data
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, idx):
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('string table index out of range')
+
+        value = str(self.raw(idx), 'utf-8')
+        return self.decode(value) if self.decode else value
+
+
+class MappedTermDict(Mapping):
+
+    """term -> term id 的映射，字符串 term 以 utf-8 字节序保存在文件中，通过二分查找定位"""
+
+    def __init__(self, terms, term_ids, overlay=None):
+        self.terms = terms
+        self.term_ids = term_ids
+        self.overlay = overlay or {}
+
+    def _find(self, term):
+        target = term.encode('utf-8')
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms.raw(mid).tobytes() < target:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self.terms) and self.terms.raw(lo) == target:
+            return self.term_ids[lo]
+
+        return None
+
+    def __getitem__(self, term):
+        if term in self.overlay:
+            return self.overlay[term]
+
+        term_id = self._find(term) if isinstance(term, str) else None
+        if term_id is None:
+            raise KeyError(term)
+
+        return term_id
+
+    def __setitem__(self, term, term_id):
+        self.overlay[term] = term_id
+
+    def __len__(self):
+        return len(self.terms) + len(self.overlay)
+
+    def __iter__(self):
+        yield from self.terms
+        yield from self.overlay
+
+
+class MappedBlocks(Mapping):
+
+    """key -> 整数数组的映射，数组为映射内存的 memoryview，修改过的数组保存在 overlay 中"""
+
+    def __init__(self, keys, offsets, data):
+        self.block_keys = keys
+        self.offsets = offsets
+        self.data = data
+        self.overlay = {}
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            return self.overlay[key]
+
+        pos = bisect_left(self.block_keys, key)
+        if pos == len(self.block_keys) or self.block_keys[pos] != key:
+            raise KeyError(key)
+
+        return self.data[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def __setitem__(self, key, values):
+        self.overlay[key] = values
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        for key in self.block_keys:
+            if key not in self.overlay:
+                yield key
+
+        yield from self.overlay
+
+
+class MappedList(Sequence):
+
+    """只能追加的列表，已有的元素来自文件"""
+
+    def __init__(self, items):
+        self.items = items
+        self.overlay = []
+
+    def __len__(self):
+        return len(self.items) + len(self.overlay)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < len(self.items):
+            return self.items[idx]
+
+        return self.overlay[idx - len(self.items)]
+
+    def append(self, item):
+        self.overlay.append(item)
+
+
+class LazyDocIds(Mapping):
+
+    """uuid -> doc id 的映射，仅在第一次访问时由 uuid 列表构建，已删除的 doc id 会被跳过"""
+
+    def __init__(self, uuids, deleted=()):
+        self.uuids = uuids
+        self.deleted = deleted
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {
+                uuid: docid for docid, uuid in enumerate(self.uuids) if docid not in self.deleted
+            }
+            self.deleted = ()
+        return self._data
+
+    def __getitem__(self, uuid):
+        return self.data[uuid]
+
+    def __setitem__(self, uuid, docid):
+        self.data[uuid] = docid
+
+    def __delitem__(self, uuid):
+        del self.data[uuid]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
@@ -1,13 +1,39 @@
-from operator import itemgetter
-from collections import defaultdict, namedtuple
+from array import array
+import asyncio
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+from copy import deepcopy
+import heapq
 import logging
-import pickle
+from math import ceil, floor, log, sqrt
 from enum import IntEnum
-from copy import deepcopy
+from functools import lru_cache, partial
+from itertools import repeat
+from multiprocessing import Pool, get_all_start_methods, get_context
+import time
+from types import MappingProxyType
+import weakref
+
+from more_itertools import chunked
 
 from zhtools.preprocess import to_halfwidth
 from zhtools.tokenize import get_tokenizer
-from zhtools.similarity import compute_similarity
+from zhtools.similarity import compute_similarity, compute_terms_similarity
+from zhtools.utils.cache import LRUCache
+from zhtools.utils.index_file import (
+    IndexFile,
+    IndexFileWriter,
+    LazyDocIds,
+    MappedList,
+    MappedTermDict,
+)
+from zhtools.utils.exact_index import ExactIndex
+from zhtools.utils.numeric_index import (
+    FLOAT_TYPECODE, INT_MAX, INT_MIN, INT_TYPECODE, NumericIndex,
+)
+from zhtools.utils.postings import accumulate, accumulate_known, intersect, new_postings
+from zhtools.utils.segment import Segment, merge_segments
+from zhtools.utils.storage import project
 
 
 LOGGER = logging.getLogger(__name__)
@@ -16,11 +42,12 @@ LOGGER = logging.getLogger(__name__)
 class FieldNotExistsError(KeyError):
 
     def __init__(self, field):
+        super().__init__(field)
         self.field = field
         self.message = "Field is missing"
 
 
-FieldInfo = namedtuple('FieldInfo', 'type, index, uuid')
+FieldInfo = namedtuple('FieldInfo', 'type, index, uuid, exact', defaults=(False,))
 
 
 class FieldType(IntEnum):
@@ -29,6 +56,10 @@ class FieldType(IntEnum):
     INT = 1
     FLOAT = 2
 
+    @property
+    def type_name(self):
+        return self.name.lower() if self != FieldType.STRING else 'str'
+
     @staticmethod
     def get_type(type_name):
         type_map = {
@@ -58,6 +89,8 @@ class IndexSchema():
         - type: 指定该字段的值类型，用于校验实际数据，目前仅支持: str/int/float
         - index: 指定该字段是否要用于索引，默认为 True，至少有一个字段为 True
         - uuid: 指定该字段为唯一标识符，默认为 False，有且仅有一个字段可为 True
+        - exact: 为被索引的 str 类型字段额外建立以原值为 key 的哈希索引，默认为 False，
+          match_on_field 在该字段上只需一次查找，且不需要从 storage 获取不匹配的文档
     """
 
     FIELD_TYPE_MAPS = {
@@ -75,8 +108,12 @@ class IndexSchema():
             self._fields[field] = FieldInfo(
                 FieldType.get_type(info['type']),
                 bool(info.get('index', True)),
-                bool(info.get('uuid', False))
+                bool(info.get('uuid', False)),
+                bool(info.get('exact', False)),
             )
+            if self._fields[field].exact and (
+                    self._fields[field].type != FieldType.STRING or not self._fields[field].index):
+                raise ValueError(f"Exact index is only supported on indexed str field: {field}")
             if self._fields[field].uuid:
                 uuid_fields.add(field)
 
@@ -110,6 +147,16 @@ class IndexSchema():
                     "`{type(value)}`"
                 )
 
+    def to_dict(self):
+        """返回可用于重建 IndexSchema 的 schema 定义"""
+        return {
+            field: {
+                'type': info.type.type_name, 'index': info.index, 'uuid': info.uuid,
+                'exact': info.exact,
+            }
+            for field, info in self._fields.items()
+        }
+
     def get_field_type(self, field):
         if field not in self.fields:
             return None
@@ -119,11 +166,11 @@ class IndexSchema():
 
     @property
     def fields(self):
-        return deepcopy(self._fields)
+        return MappingProxyType(self._fields)
 
     @property
     def index_fields(self):
-        return deepcopy(self._index_fields)
+        return frozenset(self._index_fields)
 
     @property
     def uuid_field(self):
@@ -137,23 +184,55 @@ class InvertedIndex():
     ----------
     schema: dict
         文档的结构定义，指定文档每个字段的值类型、是否要索引、是否是唯一字段
+    forward_index: bool(optional), default True
+        是否为 str 类型的字段保存正排索引，即每个文档预处理并切分后的 term id 序列，
+        用于在使用 lcs/cosine 排序时避免重复预处理和切分文档，内存受限时可以关闭
+    segment_size: int(optional), default 10000
+        每个 segment 最多包含的文档数量，新文档写入最新的 segment，写满后该 segment 被封存
+    merge_factor: int(optional), default 10
+        同一层级的已封存 segment 数量达到 merge_factor 时，将它们合并为一个更大的 segment
+    cache_size: int(optional)
+        设置时缓存最近 cache_size 次 retrieve 的结果，索引发生变化后缓存的结果自动失效
 
     Instance Methods
     -------
     add_document(document)
         将一个文档添加到索引中
 
+    add_documents(documents, workers=None, batch_size=1000)
+        批量将文档添加到索引中，可使用多个进程并行处理
+
+    delete_document(uuid)
+        将文档从索引中删除
+
+    merge()
+        合并所有 segment，并从倒排列表中彻底清除已删除的文档
+
     retrieve(query, fields=None, limit=None, rank_metric='jaccard',
-             metric_base='both', threshold=None)
+             metric_base='both', threshold=None, filters=None)
         检索与 query 相关的文档
 
     retrieve_on_field(query, fields=None, limit=None, rank_metric='jaccard',
                       metric_base='both', threshold=None)
         根据指定 field 检索与 query 相关的文档
 
+    retrieve_batch(storage, queries, field, limit=None, rank_metric='jaccard',
+                   metric_base='both', threshold=None)
+        批量检索与多个 query 相关的文档
+
     match_on_field(field, value)
         获取指定字段值与 value 相等的文档
 
+    match_range(storage, field, lo=None, hi=None)
+        获取 int/float 类型字段的值位于 [lo, hi] 范围内的文档
+
+    find_duplicates(storage, field, rank_metric='jaccard', threshold=0.8, workers=None)
+        查找指定字段相似度不低于 threshold 的所有文档对
+
+    aretrieve(storage, query, field, ..., concurrency=16)
+    amatch_on_field(storage, field, value, concurrency=16)
+        retrieve/match_on_field 的异步版本，从 AsyncStorage 并发获取文档
+
     dump(filename)
         将索引及 storage 保存到文件，storage 的保存行为由对应的类决定，如 MemoryDocumentStorage
         会将数据本身也一起保存到文件
@@ -182,17 +261,63 @@ class InvertedIndex():
     """
 
     FIELD_ID = 'id'
-    METRICS = set(['lcs', 'jaccard', 'dice', 'cosine'])
+    METRICS = set(['lcs', 'jaccard', 'dice', 'cosine', 'bm25', 'tfidf'])
     PREPROCESSORS = [to_halfwidth]
 
-    __slots__ = ('schema', 'fields', 'term_dict', 'index', 'tokenizer')
+    # 可以直接由索引中的统计信息计算得到的相似度
+    INDEX_METRICS = set(['jaccard', 'dice'])
+
+    # 由词频及文档频率计算的相关度，分数不在 [0, 1] 范围内，也不区分 metric_base
+    RELEVANCE_METRICS = set(['bm25', 'tfidf'])
+    BM25_K1 = 1.2
+    BM25_B = 0.75
 
-    def __init__(self, schema):
+    # 没有正排索引且需要用原文计算相似度时，每次通过 storage.get_by_ids 预先获取的候选文档数量
+    FETCH_WINDOW = 64
+
+    __slots__ = (
+        'schema', 'fields', 'term_dict', 'doc_ids', 'uuids', 'segments', 'deleted',
+        'doc_lengths', 'field_lengths', 'field_stats', 'forward_index', 'tokenizer',
+        'numeric', 'exact', 'segment_size', 'merge_factor', 'generation', 'cache',
+    )
+
+    def __init__(self, schema, forward_index=True, segment_size=10000, merge_factor=10,
+                 cache_size=None):
         self.schema = IndexSchema(schema)
         self.fields = sorted(self.schema.index_fields)
         self.term_dict = dict()
-        self.index = [defaultdict(set) for _ in self.fields]
+        # 文档的 uuid 会被映射为从 0 开始连续分配的整数 doc id，倒排列表中只保存 doc id，
+        # 更新文档时会分配新的 doc id，旧的 doc id 记录在 deleted 中
+        self.doc_ids = dict()
+        self.uuids = []
+        self.segments = []
+        self.deleted = set()
+        self.segment_size = segment_size
+        self.merge_factor = merge_factor
+        self.doc_lengths = [array('I') for _ in self.fields]
+        # 每个文档各字段的 term 总数，以及每个字段现有文档的 [term 总数之和, 文档数量]，用于 bm25/tfidf
+        self.field_lengths = [array('I') for _ in self.fields]
+        self.field_stats = [[0, 0] for _ in self.fields]
+        self.forward_index = [dict() for _ in self.fields] if forward_index else None
+        # int/float 类型字段不进入 term_dict，而是保存在按值排序的 NumericIndex 中
+        self.numeric = {
+            field_id: NumericIndex(self._numeric_typecode(self.schema.fields[field].type))
+            for field_id, field in enumerate(self.fields)
+            if self.schema.fields[field].type != FieldType.STRING
+        }
+        # 设置了 exact 的 str 类型字段另外以原值为 key 建立 ExactIndex
+        self.exact = {
+            field_id: ExactIndex()
+            for field_id, field in enumerate(self.fields) if self.schema.fields[field].exact
+        }
         self.tokenizer = get_tokenizer("ngram", level=2)
+        # 每次修改索引时递增，作为 retrieve 结果缓存的 key 的一部分，保证不会返回过期的结果
+        self.generation = 0
+        self.cache = LRUCache(cache_size) if cache_size else None
+
+    @staticmethod
+    def _numeric_typecode(field_type):
+        return INT_TYPECODE if field_type == FieldType.INT else FLOAT_TYPECODE
 
     @classmethod
     def preprocess(cls, text):
@@ -202,34 +327,297 @@ class InvertedIndex():
         return text
 
     def add_document(self, document):
-        """将一个文档添加到索引中"""
-        self.schema.validate(document)
+        """将一个文档添加到索引中，若索引中已有相同 uuid 的文档，则用新的文档替换它
+
+        索引不保存文档原文，替换文档时调用方需通过 storage.update_document 同步更新 storage
+        """
+        uuid, fields = self._analyze_document(self.schema, self.fields, self.tokenizer, document)
+        self.generation += 1
+        docid = self._assign_docid(uuid)
+        for field_id, value, is_text in fields:
+            if is_text:
+                self._index_terms(docid, field_id, [self._get_term_id(term) for term in value])
+            else:
+                self.numeric[field_id].add(value, docid)
+        for field_id, value in self._exact_values(self.schema, self.fields, document):
+            self.exact[field_id].add(value, docid)
+
+    def add_documents(self, documents, workers=None, batch_size=1000):
+        """批量将文档添加到索引中
+
+        Parameters
+        ----------
+        documents: iterable
+            要添加的文档
+        workers: int(optional)
+            大于 1 时使用对应数量的进程并行地校验和切分文档，结果在当前进程中合并到索引
+        batch_size: int(optional), default 1000
+            每个进程每次处理的文档数量
+
+        Return
+        ------
+        count: int
+            添加的文档数量
+        """
+        start, count = time.time(), 0
+        analyze = partial(
+            _analyze_documents, type(self), self.schema, self.fields, self.tokenizer
+        )
+        batches = chunked(documents, batch_size)
+        if workers and workers > 1:
+            with Pool(workers) as pool:
+                for vocab, analyzed in pool.imap(analyze, batches):
+                    count += self._merge_analyzed(vocab, analyzed)
+        else:
+            for vocab, analyzed in map(analyze, batches):
+                count += self._merge_analyzed(vocab, analyzed)
+
+        elapsed = time.time() - start
+        LOGGER.info(
+            "indexed %d documents in %.2fs (%.1f docs/sec)",
+            count, elapsed, count / elapsed if elapsed else 0.0
+        )
+        return count
+
+    def _merge_analyzed(self, vocab, analyzed):
+        """将 _analyze_documents 的结果合并到索引，局部 term id 一次性映射为全局 term id"""
+        self.generation += 1
+        term_ids = [self._get_term_id(term) for term in vocab]
+        for uuid, fields, exact_values in analyzed:
+            docid = self._assign_docid(uuid)
+            for field_id, value, is_text in fields:
+                if is_text:
+                    self._index_terms(docid, field_id, [term_ids[idx] for idx in value])
+                else:
+                    self.numeric[field_id].add(value, docid)
+            for field_id, value in exact_values:
+                self.exact[field_id].add(value, docid)
+
+        return len(analyzed)
+
+    @classmethod
+    def _analyze_document(cls, schema, fields, tokenizer, document):
+        """校验文档并对需要索引的字段进行预处理和切分
+
+        Return
+        ------
+        (uuid, [(field_id, value, is_text), ...])
+            str 类型字段的 value 为切分后的 terms，int/float 类型字段的 value 为原值
+        """
+        schema.validate(document)
 
-        uuid = document[self.schema.uuid_field]
-        for field, value in document.items():
-            if field not in self.schema.index_fields:
+        schema_fields, analyzed = schema.fields, []
+        for field_id, field in enumerate(fields):
+            if field not in document:
                 continue
 
-            terms = []
-            field_info = self.schema.fields[field]
+            value = document[field]
             # 仅对 str 类型的 value 进行 tokenization
-            if field_info.type == FieldType.STRING:
-                value = self.preprocess(value)
-                terms = self.tokenizer.lcut(value)
+            if schema_fields[field].type == FieldType.STRING:
+                analyzed.append((field_id, tokenizer.lcut(cls.preprocess(value)), True))
             else:
-                terms = [value]
+                # NumericIndex 以 int64 保存 int 字段，需在修改索引前拒绝超出范围的值
+                if schema_fields[field].type == FieldType.INT and not INT_MIN <= value <= INT_MAX:
+                    raise ValueError(f"Value of field `{field}` is out of int64 range")
+                analyzed.append((field_id, value, False))
 
-            field_id = self.fields.index(field)
-            for term in terms:
-                if term in self.term_dict:
-                    term_id = self.term_dict[term]
-                else:
-                    term_id = len(self.term_dict)
-                    self.term_dict[term] = term_id
-                self.index[field_id][term_id].add(uuid)
+        return document[schema.uuid_field], analyzed
+
+    @staticmethod
+    def _exact_values(schema, fields, document):
+        """返回文档中需要建立 ExactIndex 的字段的 (field_id, 原值)"""
+        return [
+            (field_id, document[field]) for field_id, field in enumerate(fields)
+            if schema.fields[field].exact and field in document
+        ]
+
+    def _get_term_id(self, term):
+        term_id = self.term_dict.get(term)
+        if term_id is None:
+            term_id = self.term_dict[term] = len(self.term_dict)
+
+        return term_id
+
+    def _index_terms(self, docid, field_id, term_ids):
+        segment = self.segments[-1]
+        for term_id in term_ids:
+            segment.add(field_id, term_id, docid)
+
+        # 记录文档中不重复的 term 数量，用于直接计算 jaccard/dice
+        self._set_length(self.doc_lengths, field_id, docid, len(set(term_ids)))
+        self._set_length(self.field_lengths, field_id, docid, len(term_ids))
+        self.field_stats[field_id][0] += len(term_ids)
+        self.field_stats[field_id][1] += 1
+        if self.forward_index is not None:
+            self.forward_index[field_id][docid] = array('I', term_ids)
 
-    def retrieve(self, storage, query, field, limit=None,
-                 rank_metric='jaccard', metric_base='both', threshold=None):
+    @staticmethod
+    def _set_length(lengths_list, field_id, docid, length):
+        lengths = lengths_list[field_id]
+        # 从文件加载的数据为只读的 memoryview，第一次修改时复制为 array
+        if not isinstance(lengths, array):
+            lengths = lengths_list[field_id] = array('I', lengths)
+        if len(lengths) <= docid:
+            lengths.extend([0] * (docid + 1 - len(lengths)))
+        lengths[docid] = length
+
+    def _mark_deleted(self, docid):
+        """标记文档已被删除，并从字段统计中去除该文档"""
+        self.deleted.add(docid)
+        for field_id, lengths in enumerate(self.field_lengths):
+            if docid < len(lengths) and lengths[docid]:
+                self.field_stats[field_id][0] -= lengths[docid]
+                self.field_stats[field_id][1] -= 1
+
+    def _assign_docid(self, uuid):
+        """为文档分配新的 doc id，uuid 已存在时视为更新，旧的 doc id 被标记为已删除"""
+        old_docid = self.doc_ids.get(uuid)
+        if old_docid is not None:
+            self._mark_deleted(old_docid)
+
+        segment = self._writable_segment()
+        docid = self.doc_ids[uuid] = len(self.uuids)
+        self.uuids.append(uuid)
+        segment.end = docid + 1
+        return docid
+
+    def _writable_segment(self):
+        segment = self.segments[-1] if self.segments else None
+        if segment is not None and not segment.sealed:
+            if len(segment) < self.segment_size:
+                return segment
+
+            segment.sealed = True
+            self._merge_tiers()
+
+        segment = Segment(len(self.fields), len(self.uuids))
+        self.segments.append(segment)
+        return segment
+
+    def _merge_tiers(self):
+        """末尾 merge_factor 个已封存的 segment 位于同一层级时，将它们合并到上一层级"""
+        while len(self.segments) >= self.merge_factor:
+            tail = self.segments[-self.merge_factor:]
+            if any(not segment.sealed or segment.level != tail[0].level for segment in tail):
+                break
+
+            self._merge_segments(len(self.segments) - self.merge_factor, len(self.segments))
+
+    def _merge_segments(self, start, end):
+        segments = self.segments[start:end]
+        lo, hi = segments[0].start, segments[-1].end
+        deleted = set(docid for docid in self.deleted if lo <= docid < hi)
+        self.segments[start:end] = [merge_segments(segments, deleted)]
+
+        # 合并后的 segment 中已不包含这些文档，不再需要保留删除标记和正排索引
+        self.deleted -= deleted
+        for numeric_index in self.numeric.values():
+            numeric_index.discard(deleted)
+        for exact_index in self.exact.values():
+            exact_index.discard(deleted)
+        for forward_index in self.forward_index or []:
+            if isinstance(forward_index, dict):
+                for docid in deleted:
+                    forward_index.pop(docid, None)
+
+    def merge(self):
+        """合并所有 segment，并从倒排列表中彻底清除已删除的文档，之后为现有文档重新分配连续的 doc id"""
+        if self.segments:
+            self._merge_segments(0, len(self.segments))
+        if len(self.doc_ids) < len(self.uuids):
+            self._compact_docids()
+
+    def _compact_docids(self):
+        """回收已删除及已更新的文档占用的 doc id，只能在所有 segment 合并为一个之后调用
+
+        新的 doc id 按原 doc id 的顺序连续分配，重新映射后倒排列表等仍然保持升序
+        """
+        live = sorted(self.doc_ids.values())
+        remap = {old: new for new, old in enumerate(live)}
+
+        def renumber(docids):
+            return new_postings(remap[docid] for docid in docids)
+
+        for segment in self.segments:
+            segment.postings = [
+                {term_id: renumber(postings) for term_id, postings in field_postings.items()}
+                for field_postings in segment.postings
+            ]
+            segment.freqs = [dict(field_freqs.items()) for field_freqs in segment.freqs]
+            segment.start, segment.end = 0, len(live)
+
+        for field_id, _ in enumerate(self.fields):
+            for lengths in (self.doc_lengths, self.field_lengths):
+                old_lengths = lengths[field_id]
+                lengths[field_id] = array('I', (
+                    old_lengths[old] if old < len(old_lengths) else 0 for old in live
+                ))
+            if self.forward_index is not None:
+                forward_index = self.forward_index[field_id]
+                self.forward_index[field_id] = {
+                    remap[old]: forward_index[old] for old in live if old in forward_index
+                }
+
+        for field_id, numeric_index in self.numeric.items():
+            values, docids = numeric_index.items()
+            self.numeric[field_id] = NumericIndex(
+                numeric_index.typecode, array(numeric_index.typecode, values), renumber(docids)
+            )
+        for field_id, exact_index in self.exact.items():
+            self.exact[field_id] = ExactIndex(exact_index.value_ids, {
+                value_id: renumber(docids) for _, value_id, docids in exact_index.items() if docids
+            })
+
+        self.uuids = [self.uuids[old] for old in live]
+        self.doc_ids = {uuid: docid for docid, uuid in enumerate(self.uuids)}
+        self.deleted = set()
+        self.generation += 1
+
+    def delete_document(self, uuid):
+        """将文档从索引中删除，文档不存在时返回 False；storage 中的文档需调用方通过
+        storage.delete_document 删除
+        """
+        docid = self.doc_ids.get(uuid)
+        if docid is None:
+            return False
+
+        del self.doc_ids[uuid]
+        self._mark_deleted(docid)
+        self.generation += 1
+        return True
+
+    def _iter_postings(self, field_id, term_id, before=None):
+        """依次返回各个 segment 中 term 的倒排列表，设置 before 时只返回小于 before 的 doc id"""
+        for segment in self.segments:
+            if before is not None and segment.start >= before:
+                break
+
+            postings = segment.get(field_id, term_id)
+            if postings and before is not None and before < segment.end:
+                postings = postings[:bisect_left(postings, before)]
+            if postings:
+                yield postings
+
+    def _iter_postings_freqs(self, field_id, term_id):
+        """依次返回各个 segment 中 term 的倒排列表及对应的词频序列"""
+        for segment in self.segments:
+            postings = segment.get(field_id, term_id)
+            if postings:
+                freqs = segment.get_freqs(field_id, term_id)
+                yield postings, freqs if freqs is not None else repeat(1, len(postings))
+
+    def _drop_deleted(self, docids):
+        """从 doc id -> value 的 dict 中去除已删除的文档"""
+        if len(self.deleted) < len(docids):
+            for docid in self.deleted:
+                docids.pop(docid, None)
+        else:
+            for docid in [docid for docid in docids if docid in self.deleted]:
+                del docids[docid]
+
+    def retrieve(self, storage, query, field, limit=None, rank_metric='jaccard',
+                 metric_base='both', threshold=None, filters=None, fields=None,
+                 return_documents=True, collection_stats=None):
         """检索与 query 相关的文档
 
         Parameters
@@ -243,7 +631,8 @@ class InvertedIndex():
         limit: int(optional)
             返回结果的最大数量限制，若不设置则返回全部
         rank_metric: str(optional), default 'jaccard'
-            计算检索结果与 query 相似度的方法，最终结果将按此进行排序
+            计算检索结果与 query 相似度的方法，最终结果将按此进行排序，其中 bm25/tfidf 为
+            只由索引中的词频统计计算的相关度，见 _rank_relevance
         metric_base: str(optional), default 'both'
             计算文档与 query 相似度时，以哪一方为准，有三个选项
             1. both: 计算对称的相似度，即 S(query, document)=S(document, query)
@@ -255,14 +644,138 @@ class InvertedIndex():
             3. 选项为 document 时，得到的结果为 1/3
         threshold: float(optional)
             query 与文档的相似度阈值，若相似度低于阈值则不会被返回
+        filters: dict(optional)
+            对被索引的 int/float 类型字段的过滤条件，如 {"cnt": (10, 100), "year": 2019}，
+            值为 (lo, hi) 时要求字段值位于 [lo, hi] 范围内，lo/hi 为 None 表示该方向不限制，
+            否则要求字段值与之相等；只有满足所有条件的候选文档才会计算相似度
+        fields: list(optional)
+            只返回文档的这些字段，通过 storage.get_by_ids(uuids, fields) 获取
+        return_documents: bool(optional), default True
+            为 False 时只返回文档的 uuid 及相似度，不从 storage 获取返回的文档
+        collection_stats: tuple(optional)
+            bm25/tfidf 使用的统计信息，格式同 collection_stats 方法的返回值，默认使用本索引的统计；
+            多个索引的统计信息合并后传入，各个索引检索结果的分数才可以相互比较
 
         Return
         ------
-        matches: list, 如: [{"document": <Document>, "score": 1.0}, ...]
+        matches: list, 如: [{"document": <Document>, "score": 1.0}, ...]，
+            return_documents 为 False 时为 [{"uuid": <uuid>, "score": 1.0}, ...]
         """
-        assert rank_metric in set(['lcs', 'jaccard', 'dice', 'lcs', 'cosine'])
+        assert rank_metric in self.METRICS
         assert metric_base in set(['query', 'document', 'both'])
 
+        field_info = self._queryable_field(field, query)
+        if field_info is None:
+            return []
+
+        if field_info.type == FieldType.STRING:
+            query = self.preprocess(query)
+
+        cache_key, results = self._cached_results(
+            storage, query, field, limit, rank_metric, metric_base, threshold,
+            self._filters_key(filters), tuple(fields) if fields is not None else None,
+            return_documents, self._stats_key(collection_stats),
+        )
+        if results is not None:
+            return results
+
+        allowed = self._filter_docids(filters)
+        fetch = self._document_fetcher(storage)
+        # 若指定 field 不是 str 类型，那么进行严格匹配
+        if field_info.type != FieldType.STRING:
+            docids = [
+                docid for docid in self._match_docids(field, query)
+                if allowed is None or docid in allowed
+            ]
+            ranked = [(1.0, docid) for docid in (docids[:limit] if limit else docids)]
+        elif rank_metric in self.RELEVANCE_METRICS:
+            ranked = self._rank_relevance(
+                query, field, limit, rank_metric, threshold, allowed, collection_stats
+            )
+        else:
+            # 除了需要用原文计算相似度的情况，只有最终返回的文档才需要从 storage 中获取
+            terms, overlaps = self._collect_candidates(
+                query, field, rank_metric, metric_base, threshold, allowed
+            )
+            ranked = self._rank_candidates(
+                fetch, query, terms, overlaps, field, limit, rank_metric, metric_base, threshold
+            )
+
+        results = self._ranked_results(fetch, ranked, fields, return_documents)
+
+        return self._cache_results(cache_key, results)
+
+    async def aretrieve(self, storage, query, field, limit=None, rank_metric='jaccard',
+                        metric_base='both', threshold=None, concurrency=16, filters=None):
+        """retrieve 的异步版本，storage 为 AsyncStorage
+
+        从 storage 获取文档时最多同时发出 concurrency 个请求，其他参数及返回值同 retrieve
+        """
+        assert rank_metric in self.METRICS
+        assert metric_base in set(['query', 'document', 'both'])
+
+        field_info = self._queryable_field(field, query)
+        if field_info is None:
+            return []
+
+        if field_info.type == FieldType.STRING:
+            query = self.preprocess(query)
+
+        cache_key, results = self._cached_results(
+            storage, query, field, limit, rank_metric, metric_base, threshold,
+            self._filters_key(filters)
+        )
+        if results is not None:
+            return results
+
+        allowed = self._filter_docids(filters)
+        if field_info.type != FieldType.STRING:
+            documents = self._keep_allowed_documents(
+                await self.amatch_on_field(storage, field, query, concurrency), allowed
+            )
+            results = [dict(document=doc, score=1.0) for doc in documents]
+            results = results if not limit else results[:limit]
+            return self._cache_results(cache_key, results)
+
+        semaphore, documents = asyncio.Semaphore(concurrency), {}
+        if rank_metric in self.RELEVANCE_METRICS:
+            ranked = self._rank_relevance(query, field, limit, rank_metric, threshold, allowed)
+            await self._afetch_documents(
+                storage, documents, semaphore, [docid for _, docid in ranked]
+            )
+            results = [dict(document=documents[docid], score=score) for score, docid in ranked]
+            return self._cache_results(cache_key, results)
+
+        terms, overlaps = self._collect_candidates(
+            query, field, rank_metric, metric_base, threshold, allowed
+        )
+        candidates, score_func, needs_document = self._prepare_ranking(
+            documents.__getitem__, query, terms, overlaps, field, rank_metric, metric_base
+        )
+
+        # 需要用原文计算相似度时，每次并发获取 concurrency 个仍可能进入结果的候选文档后再计算，
+        # 否则所有候选文档都只需由索引计算，最后并发获取 top-k 的文档
+        ranked = []
+        window = concurrency if needs_document else max(len(candidates), 1)
+        for start in range(0, len(candidates), window):
+            batch = [
+                candidate for candidate in candidates[start:start + window]
+                if self._may_enter(ranked, -candidate[0], limit, threshold)
+            ]
+            if needs_document:
+                await self._afetch_documents(
+                    storage, documents, semaphore, [docid for _, docid, _ in batch]
+                )
+            if not self._select_top(ranked, batch, score_func, limit, threshold, start):
+                break
+
+        ranked = self._sorted_top(ranked)
+        await self._afetch_documents(storage, documents, semaphore, [docid for _, docid in ranked])
+        results = [dict(document=documents[docid], score=score) for score, docid in ranked]
+        return self._cache_results(cache_key, results)
+
+    def _queryable_field(self, field, value):
+        """检查 field 及用于检索的值，返回 field 的 FieldInfo，不可能有匹配结果时返回 None"""
         # field 不存在则抛异常
         if field not in self.schema.fields:
             raise FieldNotExistsError(field)
@@ -271,56 +784,688 @@ class InvertedIndex():
         # 2. 若 value 与 schema 中 field value 的类型不一致，则认为无匹配结果
         field_info = self.schema.fields[field]
         if not field_info.index or \
-           not isinstance(query, self.schema.get_field_type(field)):
-            return []
+           not isinstance(value, self.schema.get_field_type(field)):
+            return None
 
-        # 若指定 field 不是 str 类型，那么进行严格匹配
-        if field_info.type != FieldType.STRING:
-            documents = self.match_on_field(storage, field, query)
-            results = [dict(document=doc, score=1.0) for doc in documents][:limit]
-            return results if not limit else results[:limit]
+        return field_info
+
+    def _cached_results(self, storage, *args):
+        """返回 (cache_key, 缓存的结果)，未开启缓存或 storage 不支持弱引用时 cache_key 为 None
+
+        id(storage) 在 storage 被回收后可能被复用，因此缓存中同时保存 storage 的弱引用，
+        只有弱引用仍指向同一个 storage 时才使用缓存的结果
+        """
+        if self.cache is None:
+            return None, None
+
+        try:
+            storage_ref = weakref.ref(storage)
+        except TypeError:
+            return None, None
 
-        related, field_id = set(), self.fields.index(field)
+        cache_key = (self.generation, id(storage)) + args
+        cached = self.cache.get(cache_key)
+        if cached is None or cached[0]() is not storage:
+            return (storage_ref, cache_key), None
 
-        # 切分 terms 后寻找相关文档
-        query = self.preprocess(query)
+        return (storage_ref, cache_key), deepcopy(cached[1])
+
+    def _cache_results(self, cache_key, results):
+        """缓存结果的深拷贝，调用方修改返回的文档不会影响缓存"""
+        if cache_key is None:
+            return results
+
+        storage_ref, cache_key = cache_key
+        self.cache.put(cache_key, (storage_ref, deepcopy(results)))
+        return results
+
+    @staticmethod
+    def _stats_key(collection_stats):
+        if collection_stats is None:
+            return None
+
+        total_length, num_docs, dfs = collection_stats
+        return total_length, num_docs, tuple(sorted(dfs.items()))
+
+    @staticmethod
+    def _filters_key(filters):
+        if not filters:
+            return None
+
+        return tuple(sorted(
+            (field, tuple(condition) if isinstance(condition, (tuple, list)) else condition)
+            for field, condition in filters.items()
+        ))
+
+    def _filter_docids(self, filters):
+        """返回满足所有 filters 条件的 doc id 集合，filters 为空时返回 None"""
+        if not filters:
+            return None
+
+        allowed = None
+        for field, condition in filters.items():
+            field_id = self._numeric_field_id(field)
+            if field_id is None:
+                return set()
+
+            lo, hi = condition if isinstance(condition, (tuple, list)) else (condition, condition)
+            docids = set(self.numeric[field_id].range(lo, hi))
+            allowed = docids if allowed is None else allowed & docids
+
+        return allowed
+
+    @staticmethod
+    def _keep_allowed(candidates, allowed):
+        """从 doc id -> value 的 dict 中去除不在 allowed 中的文档"""
+        for docid in [docid for docid in candidates if docid not in allowed]:
+            del candidates[docid]
+
+    def _keep_allowed_documents(self, documents, allowed):
+        if allowed is None:
+            return documents
+
+        uuid_field = self.schema.uuid_field
+        return [
+            document for document in documents
+            if self.doc_ids.get(document[uuid_field]) in allowed
+        ]
+
+    def _collect_candidates(self, query, field, rank_metric, metric_base='both', threshold=None,
+                            allowed=None):
+        """切分预处理后的 query，返回 terms 以及候选文档的 doc id 到其与 query 重合程度的映射
+
+        重合程度用于估计相似度上界，见 _overlap_weight。设置 threshold 时进行两种过滤:
+        1. 前缀过滤: 按文档频率从低到高排列 query 的 term，若只包含靠后的若干常见 term 的文档
+           相似度上界已低于阈值，则只有包含前面的罕见 term 的文档才能成为候选文档，
+           常见 term 的倒排列表只用于累计已有候选文档的重合程度
+        2. 长度过滤: jaccard/dice 的相似度受文档与 query 的 term 数量之比限制，
+           term 数量不在 _length_range 范围内的文档不可能达到阈值
+        allowed 为满足 filters 的 doc id 集合，不为 None 时只保留其中的候选文档
+        """
+        field_id = self.fields.index(field)
         terms = self.tokenizer.lcut(query)
-        for term in terms:
+        overlaps = self._filtered_overlaps(
+            field_id, Counter(self._lookup_term_ids(terms)), rank_metric, metric_base, threshold,
+            allowed=allowed,
+        )
+        return terms, overlaps
+
+    def _filtered_overlaps(self, field_id, term_freqs, rank_metric, metric_base, threshold,
+                           before=None, document_frequency=None, allowed=None):
+        """由 query 的 term id 词频统计候选文档的重合程度，过滤方法见 _collect_candidates
+
+        term_freqs 中未被索引的 term 的 id 由 _lookup_term_ids 分配，不小于 len(term_dict)；
+        设置 before 时只返回 doc id 小于 before 的候选文档
+        """
+        num_terms = len(self.term_dict)
+        weighted_terms = [
+            (term_id, self._overlap_weight(rank_metric, freq))
+            for term_id, freq in term_freqs.items() if term_id < num_terms
+        ]
+
+        prefix_size = len(weighted_terms)
+        if threshold:
+            document_frequency = document_frequency or partial(self._document_frequency, field_id)
+            weighted_terms.sort(key=lambda item: document_frequency(item[0]))
+            upper_bound = self._score_upper_bound(rank_metric, metric_base, term_freqs)
+            suffix_weight = 0
+            while prefix_size > 0:
+                suffix_weight += weighted_terms[prefix_size - 1][1]
+                # 留出浮点误差的余量，保证过滤掉的文档一定低于阈值
+                if upper_bound(suffix_weight) >= threshold - 1e-9:
+                    break
+                prefix_size -= 1
+
+        overlaps = Counter()
+        for term_id, weight in weighted_terms[:prefix_size]:
+            for postings in self._iter_postings(field_id, term_id, before):
+                accumulate(overlaps, postings, weight)
+
+        if self.deleted:
+            self._drop_deleted(overlaps)
+        if allowed is not None:
+            self._keep_allowed(overlaps, allowed)
+
+        length_range = None
+        if threshold:
+            length_range = self._length_range(rank_metric, metric_base, len(term_freqs), threshold)
+        if length_range:
+            self._drop_by_length(overlaps, self.doc_lengths[field_id], *length_range)
+
+        for term_id, weight in weighted_terms[prefix_size:]:
+            if not overlaps:
+                break
+            for postings in self._iter_postings(field_id, term_id, before):
+                accumulate_known(overlaps, postings, weight)
+
+        return overlaps
+
+    def _document_frequency(self, field_id, term_id):
+        """term 的倒排列表总长度，包含已删除但还未清除的文档"""
+        return sum(len(postings) for postings in self._iter_postings(field_id, term_id))
+
+    @staticmethod
+    def _length_range(rank_metric, metric_base, query_size, threshold):
+        """返回相似度可能达到 threshold 的文档的 term 数量范围 (lo, hi)，无法限制时返回 None
+
+        文档与 query 分别有 d 和 q 个不同的 term 时，共有 term 数量不超过 min(d, q)，因此
+        - jaccard: min(d, q) / max(d, q) >= t，即 t * q <= d <= q / t
+        - dice: 2 * min(d, q) / (d + q) >= t，即 t * q / (2 - t) <= d <= (2 - t) * q / t
+        - metric_base 为 query 时 d / q >= t，为 document 时 q / d >= t
+        cosine/lcs 与词频及 term 顺序有关，不做长度过滤
+        """
+        if rank_metric not in ('jaccard', 'dice') or threshold <= 0:
+            return None
+
+        if metric_base == 'query':
+            lo, hi = threshold * query_size, None
+        elif metric_base == 'document':
+            lo, hi = None, query_size / threshold
+        elif rank_metric == 'jaccard':
+            lo, hi = threshold * query_size, query_size / threshold
+        else:
+            lo = threshold * query_size / (2 - threshold)
+            hi = (2 - threshold) * query_size / threshold
+
+        lo = ceil(lo - 1e-9) if lo is not None else 0
+        hi = floor(hi + 1e-9) if hi is not None else None
+        return lo, hi
+
+    @staticmethod
+    def _drop_by_length(overlaps, doc_lengths, lo, hi):
+        """从候选文档中去除 term 数量不在 [lo, hi] 范围内的文档"""
+        dropped = [
+            docid for docid in overlaps
+            if doc_lengths[docid] < lo or (hi is not None and doc_lengths[docid] > hi)
+        ]
+        for docid in dropped:
+            del overlaps[docid]
+
+    def retrieve_batch(self, storage, queries, field, limit=None, rank_metric='jaccard',
+                       metric_base='both', threshold=None, filters=None, fields=None,
+                       return_documents=True):
+        """批量检索与多个 query 相关的文档
+
+        所有 query 中相同的 term 只遍历一次倒排列表，相同的文档只从 storage 中获取一次，
+        参数含义同 retrieve
+
+        Return
+        ------
+        matches_list: list
+            与 queries 一一对应的检索结果
+        """
+        assert rank_metric in self.METRICS
+        assert metric_base in set(['query', 'document', 'both'])
+
+        if field not in self.schema.fields:
+            raise FieldNotExistsError(field)
+
+        field_info = self.schema.fields[field]
+        # bm25/tfidf 只由索引计算，没有需要共享的文档获取，逐个检索即可
+        if field_info.type != FieldType.STRING or not field_info.index or \
+                rank_metric in self.RELEVANCE_METRICS:
+            return [
+                self.retrieve(
+                    storage, query, field, limit, rank_metric, metric_base, threshold, filters,
+                    fields, return_documents,
+                )
+                for query in queries
+            ]
+
+        # 相同的 query 只检索一次，类型不符的 query 没有匹配结果
+        texts, positions = [], []
+        text_positions = {}
+        for query in queries:
+            if not isinstance(query, str):
+                positions.append(None)
+                continue
+
+            text = self.preprocess(query)
+            if text not in text_positions:
+                text_positions[text] = len(texts)
+                texts.append(text)
+            positions.append(text_positions[text])
+
+        # 记录每个 term 出现在哪些 query 中，每个 term 的倒排列表只遍历一次
+        field_id = self.fields.index(field)
+        terms_list = self.tokenizer.cut_batch(texts)
+        term_queries = defaultdict(list)
+        for idx, terms in enumerate(terms_list):
+            for term, freq in Counter(terms).items():
+                term_queries[term].append((idx, self._overlap_weight(rank_metric, freq)))
+
+        overlaps_list = [Counter() for _ in texts]
+        for term, weights in term_queries.items():
             term_id = self.term_dict.get(term)
             if term_id is None:
                 continue
 
-            for docid in self.index[field_id][term_id]:
-                related.add(docid)
+            for postings in self._iter_postings(field_id, term_id):
+                for idx, weight in weights:
+                    accumulate(overlaps_list[idx], postings, weight)
+
+        fetch = self._document_fetcher(storage)
+        allowed = self._filter_docids(filters)
+        results = []
+        # 倒排列表由多个 query 共享遍历，不做前缀过滤，只按长度过滤候选文档
+        for text, terms, overlaps in zip(texts, terms_list, overlaps_list):
+            if self.deleted:
+                self._drop_deleted(overlaps)
+            if allowed is not None:
+                self._keep_allowed(overlaps, allowed)
+
+            length_range = None
+            if threshold:
+                length_range = self._length_range(
+                    rank_metric, metric_base, len(set(terms)), threshold
+                )
+            if length_range:
+                self._drop_by_length(overlaps, self.doc_lengths[field_id], *length_range)
+
+            ranked = self._rank_candidates(
+                fetch, text, terms, overlaps, field, limit, rank_metric, metric_base, threshold
+            )
+            results.append(self._ranked_results(fetch, ranked, fields, return_documents))
+
+        return [
+            [dict(result) for result in results[position]] if position is not None else []
+            for position in positions
+        ]
+
+    def find_duplicates(self, storage, field, rank_metric='jaccard', threshold=0.8,
+                        workers=None, batch_size=1000):
+        """查找索引中指定字段相似度不低于 threshold 的所有文档对
+
+        按 doc id 顺序处理每个文档，只与 doc id 更小的文档比较，因此每对文档只会被访问一次；
+        候选文档的生成同 retrieve 一样进行前缀过滤及长度过滤，相似度为 metric_base='both' 的
+        相似度。lcs 通过 difflib 计算，交换两个文档的顺序时结果可能不同，这里取两个方向中较大的值，
+        使结果与文档的先后顺序无关。
+
+        Parameters
+        ----------
+        storage: Storage
+            存储后端，没有正排索引时用于获取文档原文
+        field: str
+            比较的字段，须为被索引的 str 类型字段
+        rank_metric: str(optional), default 'jaccard'
+            相似度的计算方法，同 retrieve
+        threshold: float(optional), default 0.8
+            相似度阈值，取值范围 (0, 1]
+        workers: int(optional)
+            大于 1 时使用对应数量的进程并行处理，各进程处理不同范围的 doc id；子进程总是以 fork
+            方式创建，直接继承索引而不需要序列化（从文件加载的索引引用了映射的内存，开启缓存的
+            索引包含锁，均无法序列化），不支持 fork 的平台上只使用当前进程
+        batch_size: int(optional), default 1000
+            每个进程每次处理的文档数量
+
+        Return
+        ------
+        pairs: generator
+            依次产生 (first_uuid, second_uuid, score)，first_uuid 为先加入索引的文档
+        """
+        assert rank_metric in self.METRICS - self.RELEVANCE_METRICS
+        assert 0 < threshold <= 1
+
+        if field not in self.schema.fields:
+            raise FieldNotExistsError(field)
+
+        field_info = self.schema.fields[field]
+        if field_info.type != FieldType.STRING:
+            raise ValueError(f'Field `{field}` is not a str field')
+        if not field_info.index:
+            return
+
+        field_id = self.fields.index(field)
+        num_docs = len(self.doc_lengths[field_id])
+        ranges = [
+            (start, min(start + batch_size, num_docs)) for start in range(0, num_docs, batch_size)
+        ]
+        if workers and workers > 1 and 'fork' not in get_all_start_methods():
+            LOGGER.warning("fork is not available, find_duplicates runs in a single process")
+            workers = None
+        if workers and workers > 1:
+            # 子进程通过 initializer 获得索引，spawn/forkserver 会序列化 initializer 的参数，
+            # 因此不使用默认的启动方式
+            context = (self, storage, field_id, rank_metric, threshold)
+            with get_context('fork').Pool(workers, _init_join_worker, context) as pool:
+                for pairs in pool.imap(_join_range, ranges):
+                    yield from pairs
+        else:
+            join = partial(self._join_range, storage, field_id, rank_metric, threshold)
+            for start, end in ranges:
+                yield from join(start, end)
+
+    def _join_range(self, storage, field_id, rank_metric, threshold, start, end):
+        """查找 doc id 位于 [start, end) 的文档与 doc id 更小的文档组成的相似文档对"""
+        field = self.fields[field_id]
+        doc_lengths = self.doc_lengths[field_id]
+        document_frequency = lru_cache(maxsize=None)(partial(self._document_frequency, field_id))
+        if self.forward_index is not None:
+            doc_terms = self.forward_index[field_id].__getitem__
+        else:
+            # 没有正排索引时从 storage 获取文档并切分，文档会被多次比较，因此缓存切分结果
+            @lru_cache(maxsize=None)
+            def doc_terms(docid):
+                text = self.preprocess(storage.get_by_id(self.uuids[docid])[field])
+                return self._lookup_term_ids(self.tokenizer.lcut(text))
+
+        pairs = []
+        for docid in range(start, end):
+            # 跳过已删除、已被更新及不包含该字段的文档
+            uuid = self.uuids[docid]
+            if not doc_lengths[docid] or self.doc_ids.get(uuid) != docid:
+                continue
+
+            terms = doc_terms(docid)
+            term_freqs = Counter(terms)
+            overlaps = self._filtered_overlaps(
+                field_id, term_freqs, rank_metric, 'both', threshold,
+                before=docid, document_frequency=document_frequency,
+            )
+            if not overlaps:
+                continue
+
+            if rank_metric in self.INDEX_METRICS:
+                score_func = self._index_similarity(
+                    rank_metric, 'both', len(term_freqs), doc_lengths
+                )
+            else:
+                upper_bound = self._score_upper_bound(rank_metric, 'both', term_freqs)
+
+                def score_func(other, overlap):
+                    if upper_bound(overlap) < threshold:
+                        return 0.0
+                    other_terms = doc_terms(other)
+                    score = compute_terms_similarity(other_terms, terms, method=rank_metric)
+                    # 两个方向的匹配长度都不超过共有 term 数量，上界及候选过滤对两者都成立
+                    if rank_metric == 'lcs' and score < 1.0:
+                        score = max(score, compute_terms_similarity(
+                            terms, other_terms, method=rank_metric
+                        ))
+                    return score
+
+            for other, overlap in sorted(overlaps.items()):
+                score = score_func(other, overlap)
+                if score >= threshold:
+                    pairs.append((self.uuids[other], uuid, score))
+
+        return pairs
+
+    def _document_fetcher(self, storage):
+        """返回根据 doc id 获取文档的 DocumentFetcher，同一个文档只会从 storage 中获取一次"""
+        return DocumentFetcher(storage, self.uuids)
+
+    def _ranked_results(self, fetch, ranked, fields=None, return_documents=True):
+        """将 [(score, docid), ...] 转换为 retrieve 的返回结果，文档通过一次批量请求获取"""
+        if not return_documents:
+            return [dict(uuid=self.uuids[docid], score=score) for score, docid in ranked]
+
+        documents = fetch.many([docid for _, docid in ranked], fields)
+        return [
+            dict(document=document, score=score)
+            for (score, _), document in zip(ranked, documents)
+        ]
+
+    def _rank_candidates(self, fetch, query, terms, overlaps, field, limit,
+                         rank_metric, metric_base, threshold):
+        """对候选文档计算相似度并排序，返回 [(score, docid), ...]
+
+        overlaps 为候选文档的 doc id 到其与 query 重合程度的映射，见 _overlap_weight
+        """
+        candidates, score_func, needs_document = self._prepare_ranking(
+            fetch, query, terms, overlaps, field, rank_metric, metric_base
+        )
+        results = []
+        if not needs_document:
+            self._select_top(results, candidates, score_func, limit, threshold)
+            return self._sorted_top(results)
+
+        # 每次批量获取 FETCH_WINDOW 个仍可能进入结果的候选文档后再计算，同 aretrieve
+        window = self.FETCH_WINDOW
+        for start in range(0, len(candidates), window):
+            batch = [
+                candidate for candidate in candidates[start:start + window]
+                if self._may_enter(results, -candidate[0], limit, threshold)
+            ]
+            fetch.many([docid for _, docid, _ in batch])
+            if not self._select_top(results, batch, score_func, limit, threshold, start):
+                break
+
+        return self._sorted_top(results)
+
+    def _prepare_ranking(self, fetch, query, terms, overlaps, field, rank_metric, metric_base):
+        """返回 (candidates, score_func, needs_document)
+
+        candidates 为按相似度上界从高到低排列的 (-上界, docid, overlap)，上界相同时按 doc id 排序，
+        使相似度相同的文档的顺序是确定的；score_func(docid, overlap) 计算文档与 query 的相似度，
+        needs_document 表示 score_func 是否需要通过 fetch 获取文档
+        """
+        field_id = self.fields.index(field)
+        term_freqs = Counter(terms)
+        upper_bound = self._score_upper_bound(rank_metric, metric_base, term_freqs)
+        candidates = sorted(
+            ((-upper_bound(overlap), docid, overlap) for docid, overlap in overlaps.items())
+        )
+
+        # jaccard/dice 只依赖共有 term 数量和文档长度，可以直接由索引计算
+        if rank_metric in self.INDEX_METRICS:
+            index_similarity = self._index_similarity(
+                rank_metric, metric_base, len(term_freqs), self.doc_lengths[field_id]
+            )
+            return candidates, index_similarity, False
 
         # 准备 compute_similarity 的参数
         parameters = {"method": rank_metric}
         if metric_base in ('query', 'document'):
             parameters["partial"] = True
 
-        parameters["tokenizer"] = self.tokenizer
+        # 有正排索引时直接比较 term id 序列，query 中未被索引的 term 使用不会冲突的 id
+        if self.forward_index is not None:
+            forward_index = self.forward_index[field_id]
+            query_term_ids = self._lookup_term_ids(terms)
 
-        # 对结果进行排序
-        # TODO: 使用小顶堆优化内存占用和速度
-        results = []
-        for docid in related:
-            document = storage.get_by_id(docid)
-            text = self.preprocess(document[field])
+            def terms_similarity(docid, overlap):
+                if metric_base == 'document':
+                    return compute_terms_similarity(
+                        forward_index[docid], query_term_ids, **parameters
+                    )
+                return compute_terms_similarity(query_term_ids, forward_index[docid], **parameters)
+
+            return candidates, terms_similarity, False
 
+        parameters["tokenizer"] = self.tokenizer
+
+        def text_similarity(docid, overlap):
+            text = self.preprocess(fetch(docid)[field])
             if metric_base == 'document':
-                score = compute_similarity(text, query, **parameters)
-            else:
-                score = compute_similarity(query, text, **parameters)
+                return compute_similarity(text, query, **parameters)
+            return compute_similarity(query, text, **parameters)
+
+        return candidates, text_similarity, True
 
+    @staticmethod
+    def _may_enter(results, bound, limit, threshold):
+        """相似度上界为 bound 的候选文档是否还可能进入 results"""
+        if threshold and bound < threshold:
+            return False
+        if limit and len(results) >= limit and bound <= results[0][0]:
+            return False
+
+        return True
+
+    @classmethod
+    def _select_top(cls, results, candidates, score_func, limit, threshold, start=0):
+        """按相似度上界从高到低处理候选文档，用容量为 limit 的小顶堆 results 保存当前最好的结果
+
+        当上界已不可能超过堆顶或阈值时，剩下的候选文档无需再获取和计算，此时返回 False；
+        start 为 candidates 中第一个候选文档的序号，分多次处理时保证结果顺序与一次处理相同
+        """
+        for seq, (bound, docid, overlap) in enumerate(candidates, start):
+            if not cls._may_enter(results, -bound, limit, threshold):
+                return False
+
+            score = score_func(docid, overlap)
             if threshold and score < threshold:
                 continue
 
-            results.append(dict(document=document, score=score))
+            if not limit or len(results) < limit:
+                heapq.heappush(results, (score, -seq, docid))
+            elif score > results[0][0]:
+                heapq.heapreplace(results, (score, -seq, docid))
+
+        return True
+
+    @staticmethod
+    def _sorted_top(results):
+        results.sort(reverse=True)
+        return [(score, docid) for score, _, docid in results]
+
+    async def _afetch_documents(self, storage, documents, semaphore, docids):
+        """并发获取 documents 中还没有的文档，同时进行的请求数量受 semaphore 限制"""
+        async def fetch(docid):
+            async with semaphore:
+                documents[docid] = await storage.get_by_id(self.uuids[docid])
+
+        await asyncio.gather(*(fetch(docid) for docid in set(docids) if docid not in documents))
+
+    def collection_stats(self, query, field):
+        """返回 bm25/tfidf 计算 query 与 field 相关度所需的统计信息 (字段总长度, 文档数量, {term: df})，
+        field 不是被索引的 str 字段时返回 None
+
+        各个索引的统计信息逐项相加后通过 retrieve 的 collection_stats 参数传入，可以使各个索引
+        按整个文档集合的统计信息计算分数，如 ShardedInvertedIndex
+        """
+        field_info = self._queryable_field(field, query)
+        if field_info is None or field_info.type != FieldType.STRING:
+            return None
+
+        field_id = self.fields.index(field)
+        total_length, num_docs = self.field_stats[field_id]
+        dfs = {}
+        for term in set(self.tokenizer.lcut(self.preprocess(query))):
+            term_id = self.term_dict.get(term)
+            dfs[term] = self._document_frequency(field_id, term_id) if term_id is not None else 0
+
+        return total_length, num_docs, dfs
+
+    def _rank_relevance(self, query, field, limit, rank_metric, threshold, allowed=None,
+                        collection_stats=None):
+        """按 term 依次遍历倒排列表及词频数组，累计每个文档的 bm25/tfidf 相关度，
+        返回 [(score, docid), ...]，整个过程不需要访问 storage
+
+        N 为现有文档数量，df 为 term 的文档频率，tf 为 term 在文档中的词频，dl 为文档的 term 总数，
+        avgdl 为 dl 的平均值，N、df 及 avgdl 可以由 collection_stats 给出，query 中出现多次的 term
+        的得分按次数累加:
+        - bm25: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))，
+          其中 idf = ln(1 + (N - df + 0.5) / (df + 0.5))
+        - tfidf: sqrt(tf) * idf ** 2 / sqrt(dl)，其中 idf = 1 + ln((N + 1) / (df + 1))
+        """
+        field_id = self.fields.index(field)
+        field_lengths = self.field_lengths[field_id]
+        if collection_stats is not None:
+            total_length, num_docs, dfs = collection_stats
+        else:
+            (total_length, num_docs), dfs = self.field_stats[field_id], {}
+        avgdl = total_length / num_docs if num_docs else 1.0
+        k1, b = self.BM25_K1, self.BM25_B
+
+        scores = defaultdict(float)
+        for term, query_freq in Counter(self.tokenizer.lcut(query)).items():
+            term_id = self.term_dict.get(term)
+            if term_id is None:
+                continue
+
+            # 文档频率包含已删除但还未从倒排列表中清除的文档，此时可能大于现有文档数量
+            df = dfs.get(term)
+            if df is None:
+                df = self._document_frequency(field_id, term_id)
+            count = max(num_docs, df)
+            for postings, freqs in self._iter_postings_freqs(field_id, term_id):
+                if rank_metric == 'bm25':
+                    weight = query_freq * log(1 + (count - df + 0.5) / (df + 0.5))
+                    for docid, freq in zip(postings, freqs):
+                        norm = k1 * (1 - b + b * field_lengths[docid] / avgdl)
+                        scores[docid] += weight * freq * (k1 + 1) / (freq + norm)
+                else:
+                    weight = query_freq * (1 + log((count + 1) / (df + 1))) ** 2
+                    for docid, freq in zip(postings, freqs):
+                        scores[docid] += weight * sqrt(freq / field_lengths[docid])
+
+        if self.deleted:
+            self._drop_deleted(scores)
+        if allowed is not None:
+            self._keep_allowed(scores, allowed)
+
+        # 分数相同时 doc id 小的文档排在前面
+        ranked = (
+            (score, -docid) for docid, score in scores.items()
+            if not threshold or score >= threshold
+        )
+        ranked = heapq.nlargest(limit, ranked) if limit else sorted(ranked, reverse=True)
+        return [(score, -docid) for score, docid in ranked]
+
+    def _lookup_term_ids(self, terms):
+        """将 terms 转换为 term id，未被索引的 term 依次分配大于所有已有 id 的值"""
+        unknown, term_ids = {}, []
+        for term in terms:
+            term_id = self.term_dict.get(term)
+            if term_id is None:
+                term_id = unknown.setdefault(term, len(self.term_dict) + len(unknown))
+            term_ids.append(term_id)
+
+        return term_ids
+
+    @staticmethod
+    def _index_similarity(rank_metric, metric_base, query_size, doc_lengths):
+        """返回根据共有 term 数量及文档长度计算 jaccard/dice 的函数，结果与 compute_similarity 一致"""
+        if metric_base == 'query':
+            return lambda docid, overlap: overlap / query_size
+        if metric_base == 'document':
+            return lambda docid, overlap: overlap / doc_lengths[docid]
+        if rank_metric == 'dice':
+            return lambda docid, overlap: 2 * overlap / (query_size + doc_lengths[docid])
+
+        return lambda docid, overlap: overlap / (query_size + doc_lengths[docid] - overlap)
+
+    @staticmethod
+    def _overlap_weight(rank_metric, freq):
+        """query 中出现 freq 次的 term 被文档命中时，对重合程度的贡献"""
+        if rank_metric == 'cosine':
+            return freq ** 2
+        if rank_metric == 'lcs':
+            return freq
+
+        return 1
 
-        results.sort(key=itemgetter('score'), reverse=True)
-        return results if not limit else results[:limit]
+    @staticmethod
+    def _score_upper_bound(rank_metric, metric_base, term_freqs):
+        """返回根据文档与 query 的重合程度估计相似度上界的函数
 
-    def match_on_field(self, storage, field, value):
+        - jaccard/dice: overlap 为共有的 term 数量
+        - cosine: overlap 为共有 term 在 query 中词频的平方和，由柯西不等式可得上界
+        - lcs: overlap 为共有 term 在 query 中的出现次数之和，是公共子序列长度的上界
+        """
+        if metric_base == 'document':
+            return lambda overlap: 1.0
+
+        if rank_metric in ('jaccard', 'dice'):
+            size = len(term_freqs)
+            if rank_metric == 'dice' and metric_base == 'both':
+                return lambda overlap: 2 * overlap / (size + overlap)
+            return lambda overlap: overlap / size
+
+        if rank_metric == 'cosine':
+            norm = sum(freq ** 2 for freq in term_freqs.values())
+            if metric_base == 'both':
+                return lambda overlap: sqrt(overlap / norm)
+            return lambda overlap: overlap / norm
+
+        length = sum(term_freqs.values())
+        if metric_base == 'both':
+            return lambda overlap: 2 * overlap / (length + overlap)
+        return lambda overlap: overlap / length
+
+    def match_on_field(self, storage, field, value, fields=None, return_documents=True):
         """查找对应字段值与 value 完全相等的文档
 
         Parameters
@@ -331,71 +1476,330 @@ class InvertedIndex():
             要匹配的文档的字段，若不存在触发 FieldNotExistsError 异常
         value: any
             需匹配的字段的值
+        fields: list(optional)
+            只返回文档的这些字段，通过 storage.get_by_ids(uuids, fields) 获取
+        return_documents: bool(optional), default True
+            为 False 时只返回匹配到的文档的 uuid；需要比较原文的字符串字段仍会获取该字段
 
         Return
         ------
         documents: list
-            匹配到的文档列表
+            匹配到的文档列表，return_documents 为 False 时为 uuid 列表
         """
-        # field 不存在则抛异常
-        if field not in self.schema.fields:
-            raise FieldNotExistsError(field)
+        if self._queryable_field(field, value) is None:
+            return []
 
-        # 1. 若 field 未被索引，则认为无匹配结果
-        # 2. 若 value 与 schema 中 field value 的类型不一致，则认为无匹配结果
-        field_info = self.schema.fields[field]
-        if not field_info.index or \
-           not isinstance(value, self.schema.get_field_type(field)):
+        # 当 field 为 id 时，直接使用 storage 的方法来获取，已从索引中删除的文档不返回
+        if field == self.schema.uuid_field:
+            if value not in self.doc_ids:
+                return []
+            if not return_documents:
+                return [value]
+            document = storage.get_by_ids([value], fields)[0]
+            return [document] if document else []
+
+        uuids = [self.uuids[docid] for docid in self._match_docids(field, value)]
+        if not isinstance(value, str) or self.schema.fields[field].exact:
+            if not return_documents:
+                return uuids
+            return storage.get_by_ids(uuids, fields)
+
+        # 需要比较原文时至少获取 field，比较后再去掉未要求返回的 field
+        fetch_fields = None if fields is None else list(dict.fromkeys([*fields, field]))
+        if not return_documents:
+            fetch_fields = [field]
+        documents = storage.get_by_ids(uuids, fetch_fields)
+        matched = [
+            (uuid, document) for uuid, document in zip(uuids, documents)
+            if document is not None and document.get(field) == value
+        ]
+        if not return_documents:
+            return [uuid for uuid, _ in matched]
+        if fields is not None and field not in fields:
+            return [project([document], fields)[0] for _, document in matched]
+        return [document for _, document in matched]
+
+    async def amatch_on_field(self, storage, field, value, concurrency=16):
+        """match_on_field 的异步版本，storage 为 AsyncStorage，最多同时获取 concurrency 个文档"""
+        if self._queryable_field(field, value) is None:
             return []
 
-        # 当 field 为 id 时，直接使用 storage 的方法来获取
         if field == self.schema.uuid_field:
-            document = storage.get_by_id(value)
+            if value not in self.doc_ids:
+                return []
+            document = await storage.get_by_id(value)
             return [document] if document else []
 
-        documents = []
+        docids, documents = self._match_docids(field, value), {}
+        await self._afetch_documents(storage, documents, asyncio.Semaphore(concurrency), docids)
+        return self._filter_matched((documents[docid] for docid in docids), field, value)
+
+    def _match_docids(self, field, value):
+        """返回可能与 value 相等的文档的 doc id"""
         field_id = self.fields.index(field)
 
-        # 当 value 为非字符串内容时，先从 index 中获得文档的 id，再取得文档
+        # 当 value 为非字符串内容时，直接从 NumericIndex 中获得文档的 id
         if not isinstance(value, str):
-            term_id = self.term_dict.get(value)
-            if term_id is None:
-                return []
-            for docid in self.index[field_id].get(term_id, set()):
-                documents.append(storage.get_by_id(docid))
+            return sorted(
+                docid for docid in self.numeric[field_id].range(value, value)
+                if docid not in self.deleted
+            )
 
-            return documents
+        # ExactIndex 以原值为 key，查到的文档一定与 value 相等
+        if field_id in self.exact:
+            return [docid for docid in self.exact[field_id].get(value) if docid not in self.deleted]
 
-        # 当 value 为字符串内容时，将字符串切分为 term，检索出相关 docid
+        # 当 value 为字符串内容时，将字符串切分为 term，在每个 segment 中取所有 term 倒排列表的交集
         text = self.preprocess(value)
-        terms = self.tokenizer.lcut(text)
-        related = defaultdict(int)
-        for term in terms:
+        term_ids = []
+        for term in set(self.tokenizer.lcut(text)):
             # 文本中存在未索引的 term，认为不会有匹配的结果
             term_id = self.term_dict.get(term)
             if term_id is None:
                 return []
+            term_ids.append(term_id)
 
-            for docid in self.index[field_id][term_id]:
-                related[docid] += 1
-
-        for docid, score in related.items():
-            # 若 docid 被匹配到的次数比 terms 少，说明 terms 中某个 term 在
-            # 对应的 field value 中不存在，可以认为两者无法匹配
-            if score < len(terms):
+        docids = []
+        for segment in self.segments:
+            postings_list = [segment.get(field_id, term_id) for term_id in term_ids]
+            if not postings_list or not all(postings_list):
                 continue
 
-            document = storage.get_by_id(docid)
-            if document[field] == value:
-                documents.append(document)
+            docids.extend(docid for docid in intersect(postings_list) if docid not in self.deleted)
+
+        return docids
+
+    def _filter_matched(self, documents, field, value):
+        """倒排列表只能保证文档包含 value 的所有 term，没有 ExactIndex 的字符串字段还需要比较原文"""
+        if not isinstance(value, str) or self.schema.fields[field].exact:
+            return list(documents)
+
+        return [document for document in documents if document[field] == value]
 
-        return documents
+    def match_range(self, storage, field, lo=None, hi=None):
+        """查找 int/float 类型字段的值位于 [lo, hi] 范围内的文档
+
+        Parameters
+        ----------
+        storage: Storage
+            存储后端，用于获取实际的文档内容
+        field: str
+            要匹配的文档的字段，若不存在触发 FieldNotExistsError 异常，若不是 int/float 类型
+            触发 ValueError 异常
+        lo: int/float(optional)
+            字段值的下界，不设置则不限制
+        hi: int/float(optional)
+            字段值的上界，不设置则不限制
+
+        Return
+        ------
+        documents: list
+            匹配到的文档列表，按字段值升序排列
+        """
+        field_id = self._numeric_field_id(field)
+        if field_id is None:
+            return []
+
+        return storage.get_by_ids([
+            self.uuids[docid]
+            for docid in self.numeric[field_id].range(lo, hi) if docid not in self.deleted
+        ])
+
+    def _numeric_field_id(self, field):
+        """返回 int/float 类型字段的 field id，字段未被索引时返回 None"""
+        if field not in self.schema.fields:
+            raise FieldNotExistsError(field)
+
+        field_info = self.schema.fields[field]
+        if field_info.type == FieldType.STRING:
+            raise ValueError(f'Field `{field}` is not an int/float field')
+        if not field_info.index:
+            return None
+
+        return self.fields.index(field)
 
     def dump(self, filename):
-        with open(filename, 'wb') as fout:
-            pickle.dump(self, fout)
+        """将索引保存为二进制索引文件，格式见 zhtools.utils.index_file"""
+        uuid_type = self.schema.fields[self.schema.uuid_field].type
+        writer = IndexFileWriter()
+
+        terms = sorted((term.encode('utf-8'), term_id) for term, term_id in self.term_dict.items())
+        writer.add_string_table('terms', (term.decode('utf-8') for term, _ in terms))
+        writer.add_section('terms.ids', array('I', (term_id for _, term_id in terms)))
+        # 保存前合并所有 segment 并重新分配连续的 doc id，文件中不包含已删除的文档
+        self.merge()
+        segment = self.segments[0] if self.segments else None
+        writer.add_string_table('uuids', (str(uuid) for uuid in self.uuids))
+        writer.add_section('deleted', array('I', (
+            docid for docid, uuid in enumerate(self.uuids) if self.doc_ids.get(uuid) != docid
+        )))
+        for field_id, _ in enumerate(self.fields):
+            writer.add_section(f'{field_id}.lengths', array('I', self.doc_lengths[field_id]))
+            writer.add_section(
+                f'{field_id}.field_lengths', array('I', self.field_lengths[field_id])
+            )
+            writer.add_blocks(
+                f'{field_id}.postings', segment.postings[field_id].items() if segment else ()
+            )
+            writer.add_blocks(
+                f'{field_id}.freqs', segment.freqs[field_id].items() if segment else ()
+            )
+            if self.forward_index is not None:
+                writer.add_blocks(f'{field_id}.forward', self.forward_index[field_id].items())
+
+        for field_id, exact_index in self.exact.items():
+            items = exact_index.items()
+            writer.add_string_table(f'{field_id}.exact.values', (value for value, _, _ in items))
+            writer.add_section(
+                f'{field_id}.exact.ids', array('I', (value_id for _, value_id, _ in items))
+            )
+            writer.add_blocks(
+                f'{field_id}.exact.docids', ((value_id, docids) for _, value_id, docids in items)
+            )
+
+        # int/float 类型字段的有序索引
+        for field_id, numeric_index in self.numeric.items():
+            values, docids = numeric_index.items()
+            writer.add_section(f'{field_id}.numeric.values', array(numeric_index.typecode, values))
+            writer.add_section(f'{field_id}.numeric.docids', array('I', docids))
+
+        header = {
+            'schema': self.schema.to_dict(),
+            'uuid_type': uuid_type.type_name,
+            'forward_index': self.forward_index is not None,
+            'segment_size': self.segment_size,
+            'merge_factor': self.merge_factor,
+            'field_stats': self.field_stats,
+        }
+        writer.write(filename, header)
 
     @classmethod
-    def load(cls, filename):
-        with open(filename, 'rb') as fin:
-            return pickle.load(fin)
+    def load(cls, filename, cache_size=None):
+        """通过 mmap 加载 dump 方法导出的索引文件，倒排列表等数据在查询时才从文件中读取"""
+        index_file = IndexFile(filename)
+        header = index_file.header
+
+        index = cls.__new__(cls)
+        index.schema = IndexSchema(header['schema'])
+        index.fields = sorted(index.schema.index_fields)
+        index.tokenizer = get_tokenizer("ngram", level=2)
+        index.term_dict = MappedTermDict(
+            index_file.string_table('terms'), index_file.section('terms.ids')
+        )
+
+        uuid_type = IndexSchema.FIELD_TYPE_MAPS[FieldType.get_type(header['uuid_type'])]
+        index.uuids = MappedList(index_file.string_table('uuids', decode=uuid_type))
+        # 文件中的倒排列表已不包含被删除的文档，删除标记只用于重建 uuid 到 doc id 的映射
+        index.doc_ids = LazyDocIds(index.uuids, deleted=set(index_file.section('deleted')))
+        index.deleted = set()
+        index.segment_size = header['segment_size']
+        index.merge_factor = header['merge_factor']
+        index.generation = 0
+        index.cache = LRUCache(cache_size) if cache_size else None
+
+        postings, freqs, index.doc_lengths, index.field_lengths = [], [], [], []
+        index.field_stats = header['field_stats']
+        index.forward_index = [] if header['forward_index'] else None
+        for field_id, _ in enumerate(index.fields):
+            postings.append(index_file.blocks(f'{field_id}.postings'))
+            freqs.append(index_file.blocks(f'{field_id}.freqs'))
+            index.doc_lengths.append(index_file.section(f'{field_id}.lengths'))
+            index.field_lengths.append(index_file.section(f'{field_id}.field_lengths'))
+            if index.forward_index is not None:
+                index.forward_index.append(index_file.blocks(f'{field_id}.forward'))
+
+        index.numeric = {
+            field_id: NumericIndex(
+                index._numeric_typecode(index.schema.fields[field].type),
+                values=index_file.section(f'{field_id}.numeric.values'),
+                docids=index_file.section(f'{field_id}.numeric.docids'),
+            )
+            for field_id, field in enumerate(index.fields)
+            if index.schema.fields[field].type != FieldType.STRING
+        }
+
+        index.exact = {
+            field_id: ExactIndex(
+                MappedTermDict(
+                    index_file.string_table(f'{field_id}.exact.values'),
+                    index_file.section(f'{field_id}.exact.ids'),
+                ),
+                index_file.blocks(f'{field_id}.exact.docids'),
+            )
+            for field_id, field in enumerate(index.fields) if index.schema.fields[field].exact
+        }
+
+        # 文件中的数据作为一个已封存的 segment，层级与同样大小的合并结果一致
+        segment = Segment(len(index.fields), 0, postings=postings, freqs=freqs)
+        segment.end = len(index.uuids)
+        segment.sealed = True
+        while segment.level < 32 and \
+                index.segment_size * index.merge_factor ** (segment.level + 1) <= len(segment):
+            segment.level += 1
+        index.segments = [segment]
+
+        return index
+
+
+class DocumentFetcher():
+
+    """根据 doc id 从 storage 获取文档并缓存，同一个文档只会被获取一次"""
+
+    __slots__ = ('storage', 'uuids', 'documents')
+
+    def __init__(self, storage, uuids):
+        self.storage = storage
+        self.uuids = uuids
+        self.documents = {}
+
+    def __call__(self, docid):
+        if docid not in self.documents:
+            self.documents[docid] = self.storage.get_by_id(self.uuids[docid])
+        return self.documents[docid]
+
+    def many(self, docids, fields=None):
+        """通过 storage.get_by_ids 一次获取所有尚未缓存的文档
+
+        设置 fields 时已缓存的完整文档在本地取出这些字段，其余文档只获取这些字段且不缓存
+        """
+        missing = [docid for docid in dict.fromkeys(docids) if docid not in self.documents]
+        if fields is not None:
+            fetched = dict(zip(missing, self.storage.get_by_ids(
+                [self.uuids[docid] for docid in missing], fields
+            ))) if missing else {}
+            cached = project([self.documents.get(docid) for docid in docids], fields)
+            return [fetched.get(docid, document) for docid, document in zip(docids, cached)]
+
+        if missing:
+            documents = self.storage.get_by_ids([self.uuids[docid] for docid in missing])
+            self.documents.update(zip(missing, documents))
+
+        return [self.documents[docid] for docid in docids]
+
+
+_JOIN_CONTEXT = None
+
+
+def _init_join_worker(index, storage, field_id, rank_metric, threshold):
+    global _JOIN_CONTEXT
+    _JOIN_CONTEXT = (index, storage, field_id, rank_metric, threshold)
+
+
+def _join_range(bounds):
+    """在子进程中执行 InvertedIndex._join_range"""
+    index, *args = _JOIN_CONTEXT
+    return index._join_range(*args, *bounds)
+
+
+def _analyze_documents(index_cls, schema, fields, tokenizer, documents):
+    """在子进程中处理一批文档，返回这批文档的局部词表及用局部 term id 表示的各字段 terms"""
+    vocab, analyzed = {}, []
+    for document in documents:
+        uuid, fields_values = index_cls._analyze_document(schema, fields, tokenizer, document)
+        analyzed.append((uuid, [
+            (field_id, array('I', (vocab.setdefault(term, len(vocab)) for term in value)), True)
+            if is_text else (field_id, value, False)
+            for field_id, value, is_text in fields_values
+        ], index_cls._exact_values(schema, fields, document)))
+
+    return list(vocab), analyzed
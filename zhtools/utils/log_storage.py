@@ -0,0 +1,357 @@
+"""只追加写入的日志文件存储
+
+文档以记录的形式依次追加到数据文件中，每条记录为:
+
+    KIND(uint8) | LENGTH(uint32) | PAYLOAD(LENGTH bytes)
+
+KIND 为 RECORD_DOCUMENT 时 PAYLOAD 为文档的 JSON，为 RECORD_DELETED 时为被删除文档的 uuid 的 JSON。
+数据文件的第一条记录为 RECORD_FILE_HEADER，PAYLOAD 为 {"nonce": <随机字符串>}，每次 compact 重写数据文件
+时生成新的 nonce。
+内存中只保存 uuid -> 槽位 的 dict 及各槽位的 uuid 和记录的 (offset, length) 数组，读取时从 mmap 映射的
+数据文件中取出对应的 PAYLOAD。
+
+偏移量索引保存在 `<path>.idx` 中（格式同 zhtools.utils.index_file），并记录它覆盖的数据文件长度及
+数据文件的 nonce，打开时只需扫描该长度之后新追加的记录；nonce 不一致时偏移量索引不属于当前的数据文件，
+忽略它并扫描整个数据文件。更新及删除的文档的旧记录在 compact 时被清除。
+"""
+from array import array
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from zhtools.utils.index_file import IndexFile, IndexFileError, IndexFileWriter
+from zhtools.utils.storage import Storage, project
+
+
+LOGGER = logging.getLogger(__name__)
+
+RECORD_DOCUMENT = 0
+RECORD_DELETED = 1
+RECORD_FILE_HEADER = 2
+
+_RECORD_HEADER = struct.Struct('<BI')
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+class LogFileStorage(Storage):
+
+    """
+    Parameters
+    ----------
+    uuid_field: str
+        文档的唯一标识字段，uuid 需可以被 JSON 序列化
+    path: str
+        数据文件路径，不存在时创建
+
+    Examples
+    --------
+    In [1]: storage = LogFileStorage('id', 'documents.log')
+    In [2]: storage.add_document({'id': '1', 'content': '今天天气真好'})
+    In [3]: storage.update_document({'id': '1', 'content': '今天天气不好'})
+    In [4]: storage.compact()
+    In [5]: storage.close()
+    """
+
+    def __init__(self, uuid_field, path):
+        self.uuid_field = uuid_field
+        self.path = path
+        self.index_path = f'{path}.idx'
+        self.slots = {}
+        self.uuids = []
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        # 数据文件中不再被引用的记录的字节数
+        self.garbage = 0
+        self._lock = threading.RLock()
+        self._mmap = None
+        self._file = open(path, 'ab+')
+        self.nonce = self._read_nonce()
+        if self.nonce is None and os.path.getsize(path) == 0:
+            self.nonce = self._new_nonce()
+            self._file.write(self._file_header(self.nonce))
+            self._file.flush()
+        self._load_index()
+
+    @staticmethod
+    def _new_nonce():
+        return os.urandom(8).hex()
+
+    @staticmethod
+    def _file_header(nonce):
+        payload = _encode({'nonce': nonce})
+        return _RECORD_HEADER.pack(RECORD_FILE_HEADER, len(payload)) + payload
+
+    def _read_nonce(self):
+        """读取数据文件第一条记录中的 nonce，没有 RECORD_FILE_HEADER 的旧数据文件返回 None"""
+        with open(self.path, 'rb') as fin:
+            header = fin.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return None
+
+            kind, length = _RECORD_HEADER.unpack(header)
+            payload = fin.read(length)
+            if kind != RECORD_FILE_HEADER or len(payload) < length:
+                return None
+
+            try:
+                return json.loads(payload)['nonce']
+            except (ValueError, KeyError, TypeError):
+                return None
+
+    def _load_index(self):
+        size, indexed = os.path.getsize(self.path), 0
+        if os.path.exists(self.index_path):
+            try:
+                indexed = self._read_sidecar(size)
+            except (IndexFileError, KeyError, ValueError) as exc:
+                LOGGER.warning("ignore invalid offset index %s: %r", self.index_path, exc)
+                self._reset_index()
+                indexed = 0
+
+        if indexed and indexed < size:
+            try:
+                self._scan(indexed, size)
+                return
+            except (KeyError, ValueError) as exc:
+                # 偏移量索引与数据文件不一致，不能据此截断数据文件，重新扫描整个数据文件
+                LOGGER.warning("offset index %s disagrees with the data file: %r",
+                               self.index_path, exc)
+                self._reset_index()
+                indexed = 0
+
+        if indexed < size:
+            self._scan(indexed, size)
+
+    def _reset_index(self):
+        self.slots, self.uuids = {}, []
+        self.offsets, self.lengths = array('Q'), array('I')
+        self.garbage = 0
+
+    def _read_sidecar(self, size):
+        index_file = IndexFile(self.index_path)
+        header = index_file.header
+        if header.get('nonce') != self.nonce:
+            raise ValueError('offset index does not belong to the data file')
+        if header.get('data_size', size + 1) > size:
+            raise ValueError('offset index is newer than the data file')
+
+        decode = json.loads if header['uuid_json'] else None
+        self.uuids = list(index_file.string_table('uuids', decode=decode))
+        self.slots = {uuid: slot for slot, uuid in enumerate(self.uuids)}
+        self.offsets = array('Q', index_file.section('offsets'))
+        self.lengths = array('I', index_file.section('lengths'))
+        self.garbage = header['garbage']
+        return header['data_size']
+
+    def _scan(self, start, size):
+        """从 start 开始读取数据文件中的记录，更新偏移量索引，末尾不完整的记录会被截断
+
+        遇到无法解析的记录时触发 ValueError 异常，此时不截断数据文件
+        """
+        with open(self.path, 'rb') as fin:
+            fin.seek(start)
+            offset = start
+            while offset + _RECORD_HEADER.size <= size:
+                kind, length = _RECORD_HEADER.unpack(fin.read(_RECORD_HEADER.size))
+                if offset + _RECORD_HEADER.size + length > size:
+                    break
+
+                payload = fin.read(length)
+                if kind == RECORD_DOCUMENT:
+                    uuid = json.loads(payload)[self.uuid_field]
+                    self._point(uuid, offset + _RECORD_HEADER.size, length)
+                elif kind == RECORD_DELETED:
+                    self._unlink(json.loads(payload))
+                    self.garbage += _RECORD_HEADER.size + length
+                elif kind != RECORD_FILE_HEADER or offset != 0:
+                    raise ValueError(f'invalid record kind {kind} at {offset}')
+                offset += _RECORD_HEADER.size + length
+
+        if offset < size:
+            LOGGER.warning("truncate incomplete record at %d in %s", offset, self.path)
+            self._file.truncate(offset)
+
+    def _point(self, uuid, offset, length):
+        slot = self.slots.get(uuid)
+        if slot is None:
+            self.slots[uuid] = len(self.offsets)
+            self.uuids.append(uuid)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            return
+
+        self.garbage += _RECORD_HEADER.size + self.lengths[slot]
+        self.offsets[slot] = offset
+        self.lengths[slot] = length
+
+    def _unlink(self, uuid):
+        """删除 uuid 的文档，槽位被末尾的槽位填补"""
+        slot = self.slots.pop(uuid, None)
+        if slot is None:
+            return False
+
+        self.garbage += _RECORD_HEADER.size + self.lengths[slot]
+        last = len(self.offsets) - 1
+        if slot != last:
+            self.slots[self.uuids[last]] = slot
+            self.uuids[slot] = self.uuids[last]
+            self.offsets[slot] = self.offsets[last]
+            self.lengths[slot] = self.lengths[last]
+        self.uuids.pop()
+        self.offsets.pop()
+        self.lengths.pop()
+        return True
+
+    def _append(self, kind, payload):
+        """追加一条记录，返回 PAYLOAD 的 offset"""
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell() + _RECORD_HEADER.size
+        self._file.write(_RECORD_HEADER.pack(kind, len(payload)))
+        self._file.write(payload)
+        return offset
+
+    def _view(self, offset, length):
+        """返回 mmap 中的 PAYLOAD，数据文件增长后重新映射"""
+        if self._mmap is None or offset + length > len(self._mmap):
+            self._file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mmap[offset:offset + length]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, uuid):
+        return uuid in self.slots
+
+    def get_by_id(self, uuid):
+        with self._lock:
+            slot = self.slots.get(uuid)
+            if slot is None:
+                return None
+
+            return json.loads(self._view(self.offsets[slot], self.lengths[slot]))
+
+    def get_by_ids(self, uuids, fields=None):
+        """按文档在数据文件中的位置顺序读取，设置 fields 时只返回这些字段"""
+        with self._lock:
+            slots = [self.slots.get(uuid) for uuid in uuids]
+            order = sorted(
+                (self.offsets[slot], idx) for idx, slot in enumerate(slots) if slot is not None
+            )
+            documents = [None] * len(uuids)
+            for offset, idx in order:
+                documents[idx] = json.loads(self._view(offset, self.lengths[slots[idx]]))
+
+            return project(documents, fields)
+
+    def add_document(self, document):
+        """添加文档，已存在相同 uuid 的文档时不做修改并返回 False"""
+        with self._lock:
+            uuid = document[self.uuid_field]
+            if uuid in self.slots:
+                return False
+
+            payload = _encode(document)
+            self._point(uuid, self._append(RECORD_DOCUMENT, payload), len(payload))
+            return True
+
+    def add_documents(self, documents):
+        with self._lock:
+            count = sum(1 for document in documents if self.add_document(document))
+            self._file.flush()
+            return count
+
+    def update_document(self, document):
+        """添加或替换文档，被替换的旧记录在 compact 时清除"""
+        with self._lock:
+            payload = _encode(document)
+            offset = self._append(RECORD_DOCUMENT, payload)
+            self._point(document[self.uuid_field], offset, len(payload))
+
+    def delete_document(self, uuid):
+        """删除文档，文档不存在时返回 False"""
+        with self._lock:
+            if uuid not in self.slots:
+                return False
+
+            payload = _encode(uuid)
+            self._append(RECORD_DELETED, payload)
+            self.garbage += _RECORD_HEADER.size + len(payload)
+            return self._unlink(uuid)
+
+    def flush(self):
+        """将数据写入磁盘并保存偏移量索引"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._write_sidecar()
+
+    def _write_sidecar(self):
+        # uuid 均为 str 时直接保存，避免加载时逐个解析 JSON
+        uuid_json = not all(isinstance(uuid, str) for uuid in self.uuids)
+        writer = IndexFileWriter()
+        writer.add_string_table('uuids', (
+            json.dumps(uuid, ensure_ascii=False) if uuid_json else uuid for uuid in self.uuids
+        ))
+        writer.add_section('offsets', self.offsets)
+        writer.add_section('lengths', self.lengths)
+        writer.write(self.index_path, {
+            'nonce': self.nonce,
+            'data_size': os.path.getsize(self.path),
+            'garbage': self.garbage,
+            'uuid_json': uuid_json,
+        })
+
+    def compact(self):
+        """只保留每个文档最新的记录重写数据文件，返回回收的字节数"""
+        with self._lock:
+            self._file.flush()
+            before = os.path.getsize(self.path)
+            tmp_path = f'{self.path}.compact'
+            offsets, lengths = array('Q'), array('I')
+            nonce = self._new_nonce()
+            with open(tmp_path, 'wb') as fout:
+                fout.write(self._file_header(nonce))
+                for slot in range(len(self.offsets)):
+                    payload = self._view(self.offsets[slot], self.lengths[slot])
+                    fout.write(_RECORD_HEADER.pack(RECORD_DOCUMENT, len(payload)))
+                    offsets.append(fout.tell())
+                    lengths.append(len(payload))
+                    fout.write(payload)
+                fout.flush()
+                os.fsync(fout.fileno())
+
+            self._close_files()
+            # 先删除旧的偏移量索引，替换数据文件后若未能写入新的偏移量索引，打开时扫描整个数据文件
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'ab+')
+            self.offsets, self.lengths, self.garbage = offsets, lengths, 0
+            self.nonce = nonce
+            self._write_sidecar()
+            return before - os.path.getsize(self.path)
+
+    def _close_files(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def close(self):
+        """保存偏移量索引并关闭数据文件"""
+        with self._lock:
+            if self._file.closed:
+                return
+
+            self.flush()
+            self._close_files()
@@ -0,0 +1,227 @@
+"""基于 MinHash 签名及 LSH 分段的近似检索索引
+
+每个文档预处理并切分后的 term 集合被表示为 bands * rows 个 MinHash 值组成的签名，两个签名中
+相等的 MinHash 值所占比例是两个 term 集合 jaccard 相似度的无偏估计。签名被分为 bands 段，
+每段 rows 个值，任意一段完全相同的文档会落入同一个桶中成为候选文档。jaccard 相似度为 s 的
+文档成为候选文档的概率为 1 - (1 - s ** rows) ** bands，该曲线在 (1 / bands) ** (1 / rows)
+附近陡峭上升: 增加 rows 减少低相似度的候选文档，增加 bands 提高高相似度文档的召回率。
+"""
+from array import array
+from collections import defaultdict
+import heapq
+import logging
+from operator import eq
+import random
+import zlib
+
+from zhtools.similarity import compute_similarity
+from zhtools.tokenize import get_tokenizer
+from zhtools.utils.inverted_index import (
+    FieldNotExistsError, FieldType, IndexSchema, InvertedIndex,
+)
+from zhtools.utils.postings import new_postings
+
+
+LOGGER = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+class MinHashIndex():
+
+    """MinHash + LSH 近似索引，用于在大规模语料上检索 jaccard 相似度较高的文档
+
+    与 InvertedIndex 使用相同的 schema 定义、storage、预处理及 ngram tokenizer，只索引 str 类型
+    的字段，检索时只返回 jaccard 相似度的近似 top-k。
+
+    Parameters
+    ----------
+    schema: dict
+        文档的结构定义，同 InvertedIndex
+    bands: int(optional), default 32
+        LSH 的分段数量
+    rows: int(optional), default 4
+        每段包含的 MinHash 值的数量，签名长度为 bands * rows
+    seed: int(optional), default 1
+        生成 MinHash 哈希函数的随机种子，相同的种子得到相同的签名
+
+    Examples
+    --------
+    In [1]: index = MinHashIndex({"id": {"type": "str", "uuid": True}, "content": "str"})
+    In [2]: index.add_document({"id": "1", "content": "今天天气真好"})
+    In [3]: index.retrieve(storage, "今天天气真好啊", "content", limit=10, rerank=True)
+    """
+
+    __slots__ = (
+        'schema', 'fields', 'bands', 'rows', 'permutations', 'doc_ids', 'uuids', 'deleted',
+        'signatures', 'buckets', 'tokenizer',
+    )
+
+    def __init__(self, schema, bands=32, rows=4, seed=1):
+        self.schema = IndexSchema(schema)
+        self.fields = sorted(
+            field for field in self.schema.index_fields
+            if self.schema.fields[field].type == FieldType.STRING
+        )
+        self.bands = bands
+        self.rows = rows
+        rand = random.Random(seed)
+        self.permutations = [
+            (rand.randrange(1, _MERSENNE_PRIME), rand.randrange(0, _MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+        self.doc_ids = dict()
+        self.uuids = []
+        self.deleted = set()
+        # 每个字段的签名依次保存在一个 array 中，文档 docid 的签名位于
+        # [docid * num_perm, (docid + 1) * num_perm)
+        self.signatures = [array('I') for _ in self.fields]
+        # 每个字段每一段的 段哈希值 -> 倒排列表
+        self.buckets = [[defaultdict(new_postings) for _ in range(bands)] for _ in self.fields]
+        self.tokenizer = get_tokenizer("ngram", level=2)
+
+    @property
+    def num_perm(self):
+        return self.bands * self.rows
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def signature(self, text):
+        """计算预处理后的文本的 MinHash 签名，没有 term 的文本返回 None"""
+        hashes = set(zlib.crc32(term.encode('utf-8')) for term in self.tokenizer.cut(text))
+        if not hashes:
+            return None
+
+        return array('I', [
+            min((a * value + b) % _MERSENNE_PRIME for value in hashes) & _MAX_HASH
+            for a, b in self.permutations
+        ])
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [
+            hash(tuple(signature[start:start + rows])) for start in range(0, len(signature), rows)
+        ]
+
+    def add_document(self, document):
+        """将一个文档添加到索引中，若索引中已有相同 uuid 的文档，则用新的文档替换它"""
+        self.schema.validate(document)
+        uuid = document[self.schema.uuid_field]
+        old_docid = self.doc_ids.get(uuid)
+        if old_docid is not None:
+            self.deleted.add(old_docid)
+
+        docid = len(self.uuids)
+        self.uuids.append(uuid)
+        self.doc_ids[uuid] = docid
+        for field_id, field in enumerate(self.fields):
+            signature = None
+            if field in document:
+                signature = self.signature(InvertedIndex.preprocess(document[field]))
+
+            # 没有签名的文档用全为 _MAX_HASH 的签名占位，不进入任何桶
+            if signature is None:
+                self.signatures[field_id].extend([_MAX_HASH] * self.num_perm)
+                continue
+
+            self.signatures[field_id].extend(signature)
+            for band, key in enumerate(self._band_keys(signature)):
+                self.buckets[field_id][band][key].append(docid)
+
+    def add_documents(self, documents):
+        count = 0
+        for document in documents:
+            self.add_document(document)
+            count += 1
+
+        return count
+
+    def delete_document(self, uuid):
+        """将文档从索引中删除，文档不存在时返回 False"""
+        docid = self.doc_ids.pop(uuid, None)
+        if docid is None:
+            return False
+
+        self.deleted.add(docid)
+        return True
+
+    def candidates(self, signature, field_id):
+        """返回至少有一段签名与 signature 完全相同的文档的 doc id"""
+        buckets = self.buckets[field_id]
+        docids = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            postings = buckets[band].get(key)
+            if postings:
+                docids.update(postings)
+
+        return docids - self.deleted if self.deleted else docids
+
+    def estimate_similarity(self, signature, field_id, docid):
+        """由签名中相等的 MinHash 值的比例估计 jaccard 相似度"""
+        num_perm = self.num_perm
+        other = self.signatures[field_id][docid * num_perm:(docid + 1) * num_perm]
+        return sum(map(eq, signature, other)) / num_perm
+
+    def retrieve(self, storage, query, field, limit=None, threshold=None, rerank=False):
+        """检索与 query 的 jaccard 相似度较高的文档
+
+        Parameters
+        ----------
+        storage: Storage
+            存储后端，用于获取实际的文档内容
+        query: str
+            用于检索文档的文本
+        field: str
+            要匹配的文档的字段，若不存在触发 FieldNotExistsError 异常
+        limit: int(optional)
+            返回结果的最大数量限制，若不设置则返回全部候选文档
+        threshold: float(optional)
+            相似度阈值，若相似度低于阈值则不会被返回
+        rerank: bool(optional), default False
+            为 False 时 score 为由签名估计的 jaccard 相似度，只需从 storage 获取最终返回的文档；
+            为 True 时获取所有候选文档，用 compute_similarity 计算准确的 jaccard 相似度后排序
+
+        Return
+        ------
+        matches: list, 如: [{"document": <Document>, "score": 1.0}, ...]
+        """
+        if field not in self.schema.fields:
+            raise FieldNotExistsError(field)
+
+        if field not in self.fields or not isinstance(query, str):
+            return []
+
+        field_id = self.fields.index(field)
+        query = InvertedIndex.preprocess(query)
+        signature = self.signature(query)
+        if signature is None:
+            return []
+
+        candidates = sorted(self.candidates(signature, field_id))
+        if rerank:
+            documents = storage.get_by_ids([self.uuids[docid] for docid in candidates])
+            scored = [
+                (compute_similarity(query, InvertedIndex.preprocess(document[field]),
+                                    method='jaccard', tokenizer=self.tokenizer), -seq, document)
+                for seq, document in enumerate(documents)
+            ]
+        else:
+            scored = [
+                (self.estimate_similarity(signature, field_id, docid), -seq, docid)
+                for seq, docid in enumerate(candidates)
+            ]
+
+        if threshold:
+            scored = [item for item in scored if item[0] >= threshold]
+        scored = heapq.nlargest(limit, scored) if limit else sorted(scored, reverse=True)
+
+        if rerank:
+            return [dict(document=document, score=score) for score, _, document in scored]
+
+        documents = storage.get_by_ids([self.uuids[docid] for _, _, docid in scored])
+        return [
+            dict(document=document, score=score)
+            for (score, _, _), document in zip(scored, documents)
+        ]
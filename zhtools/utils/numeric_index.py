@@ -0,0 +1,109 @@
+"""InvertedIndex 中 int/float 字段的有序列索引
+
+每个字段的 (value, docid) 按升序保存在两个等长的数组中，范围查询通过二分查找定位。新添加的
+记录先放在缓冲区中，查询时分别在有序数组和排序后的缓冲区中查找再归并结果；缓冲区超过
+MAX_PENDING 及有序数组长度的 1/8 时才一次性归并到有序数组，持续写入时每次查询不需要重建整个数组。
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+
+from zhtools.utils.postings import POSTING_TYPECODE, new_postings
+
+
+# int 字段的值需在 int64 范围内
+INT_TYPECODE = 'q'
+INT_MIN, INT_MAX = -2 ** 63, 2 ** 63 - 1
+FLOAT_TYPECODE = 'd'
+
+
+class NumericIndex():
+
+    """
+    Parameters
+    ----------
+    typecode: str
+        保存值的 array 的 typecode，int 字段为 INT_TYPECODE，float 字段为 FLOAT_TYPECODE
+    values: sequence(optional)
+        升序排列的值，用于从已有数据创建索引，可以是只读的 memoryview
+    docids: sequence(optional)
+        与 values 一一对应的 doc id
+    """
+
+    __slots__ = ('typecode', 'values', 'docids', 'pending', 'pending_sorted')
+
+    MAX_PENDING = 1024
+
+    def __init__(self, typecode, values=None, docids=None):
+        self.typecode = typecode
+        self.values = values if values is not None else array(typecode)
+        self.docids = docids if docids is not None else new_postings()
+        self.pending = []
+        self.pending_sorted = True
+
+    def __len__(self):
+        return len(self.values) + len(self.pending)
+
+    def add(self, value, docid):
+        if self.typecode == INT_TYPECODE and not INT_MIN <= value <= INT_MAX:
+            raise ValueError(f'int value out of int64 range: {value}')
+
+        self.pending.append((value, docid))
+        self.pending_sorted = False
+        if len(self.pending) > max(self.MAX_PENDING, len(self.values) // 8):
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        self._sort_pending()
+        merged = list(heapq.merge(zip(self.values, self.docids), self.pending))
+        self.values = array(self.typecode, (value for value, _ in merged))
+        self.docids = array(POSTING_TYPECODE, (docid for _, docid in merged))
+        self.pending = []
+
+    def _sort_pending(self):
+        if not self.pending_sorted:
+            self.pending.sort()
+            self.pending_sorted = True
+
+    def range(self, lo=None, hi=None):
+        """返回值位于 [lo, hi] 范围内的文档的 doc id，按 (value, docid) 升序排列，
+        lo/hi 为 None 时表示该方向不限制
+        """
+        start = bisect_left(self.values, lo) if lo is not None else 0
+        end = bisect_right(self.values, hi) if hi is not None else len(self.values)
+        if not self.pending:
+            return self.docids[start:end] if start < end else new_postings()
+
+        self._sort_pending()
+        pending = self.pending
+        # 缓冲区中的元素为 (value, docid)，以 (lo,) 和 (hi, inf) 为界
+        pending_start = bisect_left(pending, (lo,)) if lo is not None else 0
+        pending_end = bisect_right(pending, (hi, float('inf'))) if hi is not None \
+            else len(pending)
+        if pending_start >= pending_end:
+            return self.docids[start:end] if start < end else new_postings()
+
+        merged = heapq.merge(
+            zip(self.values[start:end], self.docids[start:end]),
+            pending[pending_start:pending_end],
+        )
+        return array(POSTING_TYPECODE, (docid for _, docid in merged))
+
+    def discard(self, docids):
+        """从索引中彻底去除 docids 中的文档"""
+        self._flush()
+        if not any(docid in docids for docid in self.docids):
+            return
+
+        kept = [(value, docid) for value, docid in zip(self.values, self.docids)
+                if docid not in docids]
+        self.values = array(self.typecode, (value for value, _ in kept))
+        self.docids = array(POSTING_TYPECODE, (docid for _, docid in kept))
+
+    def items(self):
+        """返回升序排列的 (values, docids)"""
+        self._flush()
+        return self.values, self.docids
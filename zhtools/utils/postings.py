@@ -0,0 +1,67 @@
+"""倒排列表的相关操作
+
+倒排列表为升序排列、不含重复值的 doc id 序列，通常为 array('I')，也可以是任意支持
+下标访问的只读序列（如 memoryview）。词频数组与倒排列表等长，记录 term 在对应文档中出现的次数。
+"""
+from array import array
+from bisect import bisect_left
+
+
+POSTING_TYPECODE = 'I'
+FREQ_TYPECODE = 'I'
+
+
+def new_postings(docids=()):
+    return array(POSTING_TYPECODE, docids)
+
+
+def new_freqs(freqs=()):
+    return array(FREQ_TYPECODE, freqs)
+
+
+def intersect(postings_list):
+    """求多个倒排列表的交集，以最短的列表为基准在其他列表中二分查找"""
+    if not postings_list:
+        return new_postings()
+
+    postings_list = sorted(postings_list, key=len)
+    result = postings_list[0]
+    for postings in postings_list[1:]:
+        matched, lo = new_postings(), 0
+        for docid in result:
+            lo = bisect_left(postings, docid, lo)
+            if lo == len(postings):
+                break
+            if postings[lo] == docid:
+                matched.append(docid)
+        result = matched
+        if not result:
+            break
+
+    return new_postings(result)
+
+
+def accumulate(counter, postings, weight=1):
+    """将 counter 中倒排列表包含的每个 doc id 的计数增加 weight，counter 为 collections.Counter"""
+    if weight == 1:
+        # Counter.update 对可迭代对象的计数在 C 中实现，比逐个累加快得多
+        counter.update(postings)
+    else:
+        for docid in postings:
+            counter[docid] += weight
+
+
+def accumulate_known(counter, postings, weight=1):
+    """只对 counter 中已有的 doc id 增加 weight，不会引入新的 doc id
+
+    counter 远小于倒排列表时在倒排列表中二分查找每个 doc id，否则顺序遍历倒排列表
+    """
+    if len(counter) * 8 < len(postings):
+        for docid in counter:
+            pos = bisect_left(postings, docid)
+            if pos < len(postings) and postings[pos] == docid:
+                counter[docid] += weight
+    else:
+        for docid in postings:
+            if docid in counter:
+                counter[docid] += weight
@@ -0,0 +1,113 @@
+"""InvertedIndex 的 segment
+
+doc id 按添加顺序递增分配，每个 segment 保存 doc id 位于 [start, end) 的文档的倒排列表。
+只有最新的 segment 可以写入，写满后被封存，之后不再修改；删除及更新文档只在索引中记录
+被删除的 doc id，在合并 segment 时才真正从倒排列表中去除。
+
+倒排列表可以有一个等长的词频数组，依次记录 term 在对应文档中出现的次数。大多数 term 在每个
+文档中只出现一次，因此只有词频大于 1 时才创建词频数组，没有词频数组的倒排列表词频均为 1。
+"""
+from itertools import repeat
+
+from zhtools.utils.postings import new_freqs, new_postings
+
+
+class Segment():
+
+    """
+    Parameters
+    ----------
+    num_fields: int
+        被索引的字段数量，每个字段有独立的倒排列表
+    start: int
+        segment 中第一个文档的 doc id
+    level: int(optional), default 0
+        segment 的层级，由 level 层 segment 合并得到的 segment 位于 level + 1 层
+    postings: list(optional)
+        每个字段的 term id -> 倒排列表的映射，用于从已有数据创建 segment
+    freqs: list(optional)
+        每个字段的 term id -> 词频数组的映射，与 postings 一同给出，只包含有词频数组的 term
+    """
+
+    __slots__ = ('postings', 'freqs', 'start', 'end', 'level', 'sealed')
+
+    def __init__(self, num_fields, start, level=0, postings=None, freqs=None):
+        self.postings = postings if postings is not None else [dict() for _ in range(num_fields)]
+        self.freqs = freqs if freqs is not None else [dict() for _ in range(num_fields)]
+        self.start = start
+        self.end = start
+        self.level = level
+        self.sealed = False
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __contains__(self, docid):
+        return self.start <= docid < self.end
+
+    def add(self, field_id, term_id, docid):
+        """向可写的 segment 添加倒排记录，文档的 doc id 总是大于 segment 中已有的 doc id，
+        同一个文档的 term 重复添加时增加其词频
+        """
+        assert not self.sealed, "segment is sealed"
+
+        postings = self.postings[field_id].get(term_id)
+        if postings is None:
+            postings = self.postings[field_id][term_id] = new_postings()
+        freqs = self.freqs[field_id].get(term_id)
+        if not postings or postings[-1] != docid:
+            postings.append(docid)
+            if freqs is not None:
+                freqs.append(1)
+        else:
+            if freqs is None:
+                freqs = self.freqs[field_id][term_id] = new_freqs([1] * len(postings))
+            freqs[-1] += 1
+
+    def get(self, field_id, term_id):
+        return self.postings[field_id].get(term_id)
+
+    def get_freqs(self, field_id, term_id):
+        """返回 term 的词频数组，词频均为 1 时返回 None"""
+        return self.freqs[field_id].get(term_id)
+
+
+def merge_segments(segments, deleted):
+    """合并 doc id 相邻的若干 segment，已被删除的文档不会出现在合并后的 segment 中"""
+    segments = sorted(segments, key=lambda segment: segment.start)
+    num_fields = len(segments[0].postings)
+    merged = Segment(num_fields, segments[0].start, level=max(s.level for s in segments) + 1)
+    merged.end = segments[-1].end
+
+    for field_id in range(num_fields):
+        merged_postings, merged_freqs = merged.postings[field_id], merged.freqs[field_id]
+        for segment in segments:
+            for term_id, postings in segment.postings[field_id].items():
+                freqs = segment.get_freqs(field_id, term_id)
+                target = merged_postings.get(term_id)
+                if target is None:
+                    target = merged_postings[term_id] = new_postings()
+                target_freqs = merged_freqs.get(term_id)
+                if target_freqs is None and freqs is not None:
+                    target_freqs = merged_freqs[term_id] = new_freqs([1] * len(target))
+
+                if freqs is None:
+                    freqs = repeat(1, len(postings))
+                if deleted:
+                    for docid, freq in zip(postings, freqs):
+                        if docid not in deleted:
+                            target.append(docid)
+                            if target_freqs is not None:
+                                target_freqs.append(freq)
+                else:
+                    target.extend(postings)
+                    if target_freqs is not None:
+                        target_freqs.extend(freqs)
+
+        # 去除全部文档都已被删除的 term
+        for term_id in [term_id for term_id, postings in merged_postings.items() if not postings]:
+            del merged_postings[term_id]
+            merged_freqs.pop(term_id, None)
+
+    merged.sealed = True
+    return merged
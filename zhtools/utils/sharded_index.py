@@ -0,0 +1,260 @@
+from collections import Counter
+from heapq import merge
+from itertools import islice
+import logging
+from multiprocessing import Pipe, Process
+from operator import itemgetter
+import zlib
+
+from zhtools.utils.inverted_index import IndexSchema, InvertedIndex
+from zhtools.utils.storage import MemoryDocumentStorage
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ShardServer():
+
+    """持有一个分片的 InvertedIndex 及 storage，处理来自 connection 的请求
+
+    请求为 (method, args, kwargs)，响应为 (True, result) 或 (False, exception)，
+    connection 只需提供 send/recv 方法，如 multiprocessing.connection 中的 Connection，
+    因此同样可以通过 multiprocessing.connection.Listener 在 socket 上提供服务。
+    """
+
+    METHODS = set([
+        'add_document', 'add_documents', 'delete_document', 'retrieve', 'collection_stats',
+        'match_on_field', 'match_range', 'merge',
+    ])
+
+    def __init__(self, schema, storage_factory=None, **index_options):
+        self.index = InvertedIndex(schema, **index_options)
+        uuid_field = self.index.schema.uuid_field
+        self.storage = (storage_factory or MemoryDocumentStorage)(uuid_field)
+
+    def add_document(self, document):
+        # 重复的 uuid 在索引中替换旧文档，storage 中也需要替换
+        self.index.add_document(document)
+        self.storage.update_document(document)
+
+    def add_documents(self, documents):
+        for document in documents:
+            self.add_document(document)
+
+        return len(documents)
+
+    def delete_document(self, uuid):
+        deleted = self.index.delete_document(uuid)
+        self.storage.delete_document(uuid)
+        return deleted
+
+    def retrieve(self, *args, **kwargs):
+        return self.index.retrieve(self.storage, *args, **kwargs)
+
+    def collection_stats(self, query, field):
+        return self.index.collection_stats(query, field)
+
+    def match_on_field(self, *args, **kwargs):
+        return self.index.match_on_field(self.storage, *args, **kwargs)
+
+    def match_range(self, *args, **kwargs):
+        return self.index.match_range(self.storage, *args, **kwargs)
+
+    def merge(self):
+        self.index.merge()
+
+    def handle(self, method, args, kwargs):
+        if method not in self.METHODS:
+            raise ValueError(f'Unsupported method: {method}')
+
+        return getattr(self, method)(*args, **kwargs)
+
+    def serve(self, connection):
+        """处理请求直到收到 close 请求或连接断开"""
+        while True:
+            try:
+                method, args, kwargs = connection.recv()
+            except EOFError:
+                break
+
+            if method == 'close':
+                connection.send((True, None))
+                break
+
+            try:
+                connection.send((True, self.handle(method, args, kwargs)))
+            except Exception as exc:  # noqa
+                LOGGER.debug("shard request `%s` failed: %r", method, exc)
+                connection.send((False, exc))
+
+
+def _serve_shard(connection, schema, storage_factory, index_options):
+    ShardServer(schema, storage_factory, **index_options).serve(connection)
+    connection.close()
+
+
+class ShardClient():
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def send(self, method, *args, **kwargs):
+        self.connection.send((method, args, kwargs))
+
+    def receive(self):
+        success, result = self.connection.recv()
+        if not success:
+            raise result
+
+        return result
+
+    def call(self, method, *args, **kwargs):
+        self.send(method, *args, **kwargs)
+        return self.receive()
+
+
+class ShardedInvertedIndex():
+
+    """按 uuid 的哈希值将文档分配到多个进程中的 InvertedIndex，查询时并发请求所有分片并合并结果
+
+    Parameters
+    ----------
+    schema: dict
+        文档的结构定义，同 InvertedIndex
+    num_shards: int(optional), default 4
+        分片数量，每个分片运行在独立的进程中
+    storage_factory: callable(optional)
+        以 uuid 字段名为参数创建分片 storage 的函数，默认使用 MemoryDocumentStorage；storage 需支持
+        update_document 及 delete_document，用于替换和删除文档
+    index_options: dict
+        创建各分片 InvertedIndex 时的其他参数
+
+    Examples
+    --------
+    In [1]: with ShardedInvertedIndex(schema, num_shards=4) as index:
+       ...:     index.add_documents(documents)
+       ...:     index.retrieve("world", "content", limit=10)
+    """
+
+    def __init__(self, schema, num_shards=4, storage_factory=None, **index_options):
+        self.schema = IndexSchema(schema)
+        self.shards, self.processes = [], []
+        for _ in range(num_shards):
+            parent_conn, child_conn = Pipe()
+            process = Process(
+                target=_serve_shard,
+                args=(child_conn, schema, storage_factory, index_options),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.shards.append(ShardClient(parent_conn))
+            self.processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shard_of(self, uuid):
+        """根据 uuid 计算文档所在的分片，使用 crc32 保证在不同进程中结果一致"""
+        return zlib.crc32(str(uuid).encode('utf-8')) % len(self.shards)
+
+    def _broadcast(self, method, *args, **kwargs):
+        """向所有分片发送请求后再依次接收结果，各分片并行处理"""
+        for shard in self.shards:
+            shard.send(method, *args, **kwargs)
+
+        return self._gather()
+
+    def _gather(self):
+        """接收所有分片的结果，即使有分片出错也要读完其他分片的响应以保持连接状态一致"""
+        results, error = [], None
+        for shard in self.shards:
+            try:
+                results.append(shard.receive())
+            except Exception as exc:  # noqa
+                error = error or exc
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def add_document(self, document):
+        self.schema.validate(document)
+        uuid = document[self.schema.uuid_field]
+        self.shards[self.shard_of(uuid)].call('add_document', document)
+
+    def add_documents(self, documents):
+        batches = [[] for _ in self.shards]
+        for document in documents:
+            self.schema.validate(document)
+            batches[self.shard_of(document[self.schema.uuid_field])].append(document)
+
+        for shard, batch in zip(self.shards, batches):
+            shard.send('add_documents', batch)
+
+        return sum(self._gather())
+
+    def delete_document(self, uuid):
+        return self.shards[self.shard_of(uuid)].call('delete_document', uuid)
+
+    def retrieve(self, query, field, limit=None, **kwargs):
+        """在所有分片中检索，各分片返回的 top-k 结果按 score 归并，参数同 InvertedIndex.retrieve
+
+        bm25/tfidf 的分数依赖文档数量等统计信息，先汇总所有分片的统计信息，各分片再按整体的
+        统计信息计算分数，使不同分片的分数可以比较
+        """
+        if kwargs.get('rank_metric') in InvertedIndex.RELEVANCE_METRICS:
+            kwargs['collection_stats'] = self.collection_stats(query, field)
+        results = self._broadcast('retrieve', query, field, limit=limit, **kwargs)
+        merged = merge(*results, key=itemgetter('score'), reverse=True)
+        return list(islice(merged, limit) if limit else merged)
+
+    def collection_stats(self, query, field):
+        """所有分片的 InvertedIndex.collection_stats 之和"""
+        stats = self._broadcast('collection_stats', query, field)
+        if any(shard_stats is None for shard_stats in stats):
+            return None
+
+        dfs = Counter()
+        for _, _, shard_dfs in stats:
+            dfs.update(shard_dfs)
+
+        return (
+            sum(total_length for total_length, _, _ in stats),
+            sum(num_docs for _, num_docs, _ in stats),
+            dict(dfs),
+        )
+
+    def match_on_field(self, field, value, **kwargs):
+        if field == self.schema.uuid_field:
+            return self.shards[self.shard_of(value)].call('match_on_field', field, value, **kwargs)
+
+        return [
+            document
+            for documents in self._broadcast('match_on_field', field, value, **kwargs)
+            for document in documents
+        ]
+
+    def match_range(self, field, lo=None, hi=None):
+        """各分片返回的文档已按字段值升序排列，归并后保持有序"""
+        results = self._broadcast('match_range', field, lo, hi)
+        return list(merge(*results, key=itemgetter(field)))
+
+    def merge(self):
+        self._broadcast('merge')
+
+    def close(self):
+        for shard, process in zip(self.shards, self.processes):
+            if process.is_alive():
+                try:
+                    shard.call('close')
+                except (EOFError, OSError):
+                    pass
+            shard.connection.close()
+            process.join()
+
+        self.shards, self.processes = [], []
@@ -1,5 +1,26 @@
 from copy import deepcopy
 from abc import ABC, abstractmethod
+import json
+import sqlite3
+import sys
+import threading
+import weakref
+
+from more_itertools import chunked
+
+from zhtools.utils.cache import LRUCache
+
+
+def project(documents, fields=None):
+    """只保留 documents 中每个文档的 fields 字段，fields 为 None 时原样返回"""
+    if fields is None:
+        return documents
+
+    return [
+        {field: document[field] for field in fields if field in document}
+        if document is not None else None
+        for document in documents
+    ]
 
 
 class Storage(ABC):
@@ -15,6 +36,30 @@ class Storage(ABC):
     def add_document(self, document):
         pass
 
+    def get_by_ids(self, uuids, fields=None):
+        """批量获取文档，返回与 uuids 一一对应的列表，不存在的文档为 None
+
+        InvertedIndex 通过该方法一次获取所有要返回的文档，子类可以用一次请求实现它；
+        设置 fields 时返回只包含这些字段的 dict，支持部分读取的子类可以只读取这些字段
+        """
+        return project([self.get_by_id(uuid) for uuid in uuids], fields)
+
+    def add_documents(self, documents):
+        """批量添加文档，返回新添加的文档数量"""
+        return sum(1 for document in documents if self.add_document(document))
+
+    def update_document(self, document):
+        """添加或替换文档
+
+        InvertedIndex.add_document 遇到已存在的 uuid 时会替换索引中的文档，调用方需要同时
+        用该方法替换 storage 中的文档，删除文档时同样需要调用 delete_document
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support updating documents')
+
+    def delete_document(self, uuid):
+        """删除文档，文档不存在时返回 False"""
+        raise NotImplementedError(f'{type(self).__name__} does not support deleting documents')
+
 
 class MemoryDocumentStorage(Storage):
 
@@ -35,3 +80,322 @@ class MemoryDocumentStorage(Storage):
             return True
 
         return False
+
+    def update_document(self, document):
+        self.data[document[self.uuid_field]] = deepcopy(document)
+
+    def delete_document(self, uuid):
+        return self.data.pop(uuid, None) is not None
+
+
+class SQLiteDocumentStorage(Storage):
+
+    """使用 sqlite3 保存文档的存储后端，文档以 JSON 格式保存，不需要将全部文档放在内存中
+
+    数据库使用 WAL 模式，读操作不会被写操作阻塞；每个线程使用独立的连接，线程结束后连接随之关闭。
+
+    Parameters
+    ----------
+    uuid_field: str
+        文档的唯一标识字段
+    path: str
+        数据库文件路径
+    batch_size: int(optional), default 10000
+        add_documents 每个事务写入的文档数量
+    """
+
+    # 单条 SQL 语句中参数数量的上限，旧版本 sqlite 为 999
+    MAX_VARIABLES = 900
+
+    def __init__(self, uuid_field, path, batch_size=10000):
+        self.uuid_field = uuid_field
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            # uuid 列不声明类型，int 与 str 类型的 uuid 按原类型保存
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS documents (uuid PRIMARY KEY, document TEXT NOT NULL)'
+            )
+
+    def _connection(self):
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            # 连接只在创建它的线程中使用，close 时可能由其他线程关闭
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._lock:
+                self._connections.add(conn)
+            # holder 只被线程的 threading.local 引用，线程结束后被回收时关闭连接；
+            # finalize 不能引用 self，否则 storage 本身无法被回收
+            holder = self._local.holder = _ConnectionHolder(conn)
+            weakref.finalize(holder, _release_connection, conn, self._connections, self._lock)
+
+        return holder.conn
+
+    def get_by_id(self, uuid):
+        row = self._connection().execute(
+            'SELECT document FROM documents WHERE uuid = ?', (uuid,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_ids(self, uuids, fields=None):
+        """设置 fields 时通过 json_extract 只读取这些字段，不需要解析整个文档"""
+        if fields is not None:
+            return self._get_fields(uuids, fields)
+
+        conn, found = self._connection(), {}
+        for chunk in chunked(set(uuids), self.MAX_VARIABLES):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT uuid, document FROM documents WHERE uuid IN ({placeholders})', chunk
+            )
+            found.update(rows)
+
+        return [json.loads(found[uuid]) if uuid in found else None for uuid in uuids]
+
+    def _get_fields(self, uuids, fields):
+        paths = ['$."{}"'.format(field.replace('"', '\\"')) for field in fields]
+        columns = ', '.join('json_extract(document, ?), json_type(document, ?)' for _ in fields)
+        params = [param for path in paths for param in (path, path)]
+        conn, found = self._connection(), {}
+        for chunk in chunked(set(uuids), max(1, self.MAX_VARIABLES - len(params))):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT uuid, {columns} FROM documents WHERE uuid IN ({placeholders})',
+                params + list(chunk),
+            )
+            for uuid, *values in rows:
+                document = found[uuid] = {}
+                for field, value, value_type in zip(fields, values[::2], values[1::2]):
+                    # json_type 为 NULL 表示文档中没有该字段
+                    if value_type in ('object', 'array'):
+                        value = json.loads(value)
+                    elif value_type in ('true', 'false'):
+                        value = bool(value)
+                    if value_type is not None:
+                        document[field] = value
+
+        return [found.get(uuid) for uuid in uuids]
+
+    def add_document(self, document):
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO documents (uuid, document) VALUES (?, ?)',
+                (document[self.uuid_field], json.dumps(document, ensure_ascii=False)),
+            )
+
+        return cursor.rowcount == 1
+
+    def update_document(self, document):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO documents (uuid, document) VALUES (?, ?)',
+                (document[self.uuid_field], json.dumps(document, ensure_ascii=False)),
+            )
+
+    def delete_document(self, uuid):
+        with self._connection() as conn:
+            cursor = conn.execute('DELETE FROM documents WHERE uuid = ?', (uuid,))
+
+        return cursor.rowcount == 1
+
+    def add_documents(self, documents):
+        conn, count = self._connection(), 0
+        for batch in chunked(documents, self.batch_size):
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    'INSERT OR IGNORE INTO documents (uuid, document) VALUES (?, ?)',
+                    ((document[self.uuid_field], json.dumps(document, ensure_ascii=False))
+                     for document in batch),
+                )
+                count += conn.total_changes - before
+
+        return count
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def close(self):
+        """关闭所有线程创建的连接"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class _ConnectionHolder():
+
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _release_connection(conn, connections, lock):
+    with lock:
+        connections.discard(conn)
+    conn.close()
+
+
+def approximate_size(document):
+    """估计文档占用的内存字节数，只计算 dict 及其第一层的 key 和 value"""
+    return sys.getsizeof(document) + sum(
+        sys.getsizeof(key) + sys.getsizeof(value) for key, value in document.items()
+    )
+
+
+class CachedStorage(Storage):
+
+    """在任意 Storage 前增加 LRU 缓存，读取时未命中的文档从 storage 获取后放入缓存
+
+    写入操作直接写入 storage，add_document 成功写入的文档的副本同时放入缓存；add_documents 批量写入
+    后会清除缓存中这些 uuid 的条目。可以在多个线程中使用，读取 storage 期间被其他线程写入的
+    文档不会放入缓存。
+
+    Parameters
+    ----------
+    storage: Storage
+        实际保存文档的存储后端
+    maxsize: int(optional)
+        最多缓存的文档数量，不设置则不限制
+    max_bytes: int(optional)
+        缓存的文档的总大小上限，文档大小由 approximate_size 估计，不设置则不限制
+    ttl: float(optional)
+        文档在缓存中的有效秒数，不设置则不过期
+    """
+
+    def __init__(self, storage, maxsize=None, max_bytes=None, ttl=None):
+        self.storage = storage
+        self.cache = LRUCache(
+            maxsize=maxsize, max_weight=max_bytes, ttl=ttl,
+            weigher=(lambda uuid, document: approximate_size(document)) if max_bytes else None,
+        )
+        # 正在从 storage 读取的 uuid -> [读取中的线程数, 版本]，读取期间写入该 uuid 时版本加 1，
+        # 读取结束时版本已改变的文档可能已经过期，不放入缓存
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def _begin_fetch(self, uuids):
+        with self._lock:
+            versions = []
+            for uuid in uuids:
+                entry = self._fetching.setdefault(uuid, [0, 0])
+                entry[0] += 1
+                versions.append(entry[1])
+
+        return versions
+
+    def _end_fetch(self, uuids, versions, documents):
+        with self._lock:
+            for uuid, version, document in zip(uuids, versions, documents):
+                entry = self._fetching[uuid]
+                if document is not None and entry[1] == version:
+                    self.cache.put(uuid, document)
+                entry[0] -= 1
+                if not entry[0]:
+                    del self._fetching[uuid]
+
+    def _fetch(self, uuids):
+        """从 storage 批量读取文档，读取期间没有被写入的文档放入缓存"""
+        versions = self._begin_fetch(uuids)
+        documents = [None] * len(uuids)
+        try:
+            documents = self.storage.get_by_ids(uuids)
+        finally:
+            self._end_fetch(uuids, versions, documents)
+
+        return documents
+
+    def _invalidate(self, uuid, document=None):
+        """写入 storage 之后调用，用写入的文档替换缓存中的文档，document 为 None 时移除缓存"""
+        with self._lock:
+            entry = self._fetching.get(uuid)
+            if entry is not None:
+                entry[1] += 1
+            if document is None:
+                self.cache.pop(uuid)
+            else:
+                self.cache.put(uuid, document)
+
+    def get_by_id(self, uuid):
+        document = self.cache.get(uuid)
+        if document is None:
+            versions = self._begin_fetch([uuid])
+            try:
+                document = self.storage.get_by_id(uuid)
+            finally:
+                self._end_fetch([uuid], versions, [document])
+
+        return document
+
+    def get_by_ids(self, uuids, fields=None):
+        """缓存中保存完整的文档，设置 fields 时从完整的文档中取出这些字段"""
+        if fields is not None:
+            return project(self.get_by_ids(uuids), fields)
+
+        documents = [self.cache.get(uuid) for uuid in uuids]
+        missing = list(dict.fromkeys(
+            uuid for uuid, document in zip(uuids, documents) if document is None
+        ))
+        if not missing:
+            return documents
+
+        fetched = dict(zip(missing, self._fetch(missing)))
+        return [
+            document if document is not None else fetched[uuid]
+            for uuid, document in zip(uuids, documents)
+        ]
+
+    def add_document(self, document):
+        added = self.storage.add_document(document)
+        if added:
+            self._invalidate(document[self.storage.uuid_field], deepcopy(document))
+
+        return added
+
+    def add_documents(self, documents):
+        documents = list(documents)
+        count = self.storage.add_documents(documents)
+        for document in documents:
+            self._invalidate(document[self.storage.uuid_field])
+
+        return count
+
+    def update_document(self, document):
+        self.storage.update_document(document)
+        self._invalidate(document[self.storage.uuid_field], deepcopy(document))
+
+    def delete_document(self, uuid):
+        deleted = self.storage.delete_document(uuid)
+        self._invalidate(uuid)
+        return deleted
+
+    @property
+    def stats(self):
+        """缓存的命中、未命中及淘汰次数等统计信息"""
+        return self.cache.stats
+
+    def clear(self):
+        self.cache.clear()
+
+
+class AsyncStorage(ABC):
+
+    """异步的存储后端，用于 InvertedIndex.aretrieve/amatch_on_field，方法均为协程"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @abstractmethod
+    async def get_by_id(self, uuid):
+        pass
+
+    @abstractmethod
+    async def add_document(self, document):
+        pass